@@ -0,0 +1,171 @@
+import argparse
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pydantic import BaseModel, Field
+from main import get_all_items_ozon, setup_logging
+from crawler import CrawlStats
+from cache import ResponseCache, CACHE_TTL, CategoryCache, PageFingerprints
+from requests_handler import CLIENT_POOL
+from writers import REPORT_FORMATS
+from snapshots import SnapshotStore, SNAPSHOTS_PATH
+from sessions import SessionPool, SESSION_STRATEGIES
+from parsing import make_parse_pool, default_parse_workers
+
+
+# число продавцов, собираемых одновременно
+BATCH_WORKERS = 4
+
+
+class SellerResult(BaseModel):
+    """
+    Итог сбора по одному продавцу
+    """
+    url: str = Field(description='Адрес магазина')
+    status: bool = Field(default=False, description='Статус успешного или неуспешного выполнения')
+    seconds: float = Field(default=0.0, description='Время сбора')
+    items: int = Field(default=0, description='Собрано товаров')
+    pages: int = Field(default=0, description='Запрошено страниц')
+    error: str | None = Field(default=None, description='Текст ошибки')
+
+
+def read_urls(path: str) -> list[str]:
+    """
+    Чтение списка адресов: по одному в строке, пустые строки и строки с # пропускаются
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = (line.strip() for line in f)
+        return [line for line in lines if line and not line.startswith('#')]
+
+
+async def scrape_seller(url: str, semaphore: asyncio.Semaphore, cache: ResponseCache = None,
+                        executor: Executor = None, fmt: str = 'csv', snapshots: SnapshotStore = None,
+                        sessions: SessionPool = None, parse_executor: Executor = None,
+                        category_cache: CategoryCache = None, refresh_categories: bool = False,
+                        fingerprints: PageFingerprints = None) -> SellerResult:
+    """
+    Сбор одного продавца с перехватом ошибок, чтобы сбой не останавливал весь пакет
+    """
+    async with semaphore:
+        result = SellerResult(url=url)
+        stats = CrawlStats()
+        started = time.monotonic()
+        try:
+            result.status = await get_all_items_ozon(url, cache=cache, stats=stats, executor=executor, fmt=fmt,
+                                                     snapshots=snapshots, sessions=sessions,
+                                                     parse_executor=parse_executor, category_cache=category_cache,
+                                                     refresh_categories=refresh_categories, fingerprints=fingerprints)
+            if not result.status:
+                result.error = 'неверная ссылка или отчет не сохранен'
+        except Exception as e:
+            result.error = f'{type(e).__name__}: {e}'
+        result.seconds = time.monotonic() - started
+        result.items = stats.items
+        result.pages = stats.pages_requested
+        return result
+
+
+async def run_batch(urls: list[str], workers: int = BATCH_WORKERS, rate_limit: float = None,
+                    use_cache: bool = True, cache_ttl: float = CACHE_TTL, processes: int = 0,
+                    fmt: str = 'csv', snapshots_path: str = None, session_files: list[str] = None,
+                    session_strategy: str = 'round_robin', parse_workers: int = 0,
+                    refresh_categories: bool = False) -> list[SellerResult]:
+    """
+    Сбор списка продавцов в одном цикле событий с общим пулом соединений и общим лимитом запросов
+    """
+    CLIENT_POOL.set_rate_limit(rate_limit)
+    semaphore = asyncio.Semaphore(workers)
+    cache = ResponseCache(ttl=cache_ttl) if use_cache else None
+    category_cache = CategoryCache() if use_cache else None
+    fingerprints = PageFingerprints() if use_cache else None
+    snapshots = SnapshotStore(snapshots_path) if snapshots_path else None
+    # пул сессий общий для всех продавцов пакета
+    sessions = SessionPool.from_files(session_files, strategy=session_strategy) if session_files else None
+    # сборка дата-фреймов (нагрузка на процессор) при необходимости уходит в пул процессов
+    executor = ProcessPoolExecutor(max_workers=processes) if processes else None
+    # разбор страниц из байтов ответа - в общем для всех продавцов пуле процессов
+    parse_executor = make_parse_pool(parse_workers) if parse_workers else None
+    try:
+        async with CLIENT_POOL:
+            return await asyncio.gather(*(scrape_seller(url, semaphore, cache, executor, fmt, snapshots, sessions,
+                                                        parse_executor, category_cache, refresh_categories,
+                                                        fingerprints)
+                                          for url in urls))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if parse_executor is not None:
+            parse_executor.shutdown()
+        if cache is not None:
+            cache.close()
+        if category_cache is not None:
+            category_cache.close()
+        if fingerprints is not None:
+            fingerprints.close()
+        if snapshots is not None:
+            snapshots.close()
+        if sessions is not None:
+            print_sessions(sessions)
+
+
+def print_summary(results: list[SellerResult], spent: float):
+    """
+    Сводка по пакету: время, число товаров и ошибки по каждому продавцу
+    """
+    print(f'{"status":<6} {"seconds":>8} {"items":>8} {"pages":>6}  url')
+    for result in results:
+        status = 'OK' if result.status else 'FAIL'
+        print(f'{status:<6} {result.seconds:>8.1f} {result.items:>8} {result.pages:>6}  {result.url}')
+        if result.error:
+            print(f'{"":<32}{result.error}')
+    failed = sum(not result.status for result in results)
+    items = sum(result.items for result in results)
+    print(f'SELLERS {len(results)}, failed {failed}, items {items}, SPENT {spent:.1f} s')
+
+
+def print_sessions(sessions: SessionPool):
+    """
+    Сводка по сессиям пула: запросы, ответы 429, блокировки
+    """
+    print(f'{"requests":>8} {"429":>5} {"blocked":>7}  session')
+    for row in sessions.summary():
+        mark = ' (карантин)' if row['quarantined'] else ''
+        print(f'{row["requests"]:>8} {row["throttled"]:>5} {row["blocked"]:>7}  {row["name"]}{mark}')
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Пакетный сбор товаров нескольких продавцов Ozon')
+    parser.add_argument('file', help='файл со списком адресов магазинов (по одному в строке)')
+    parser.add_argument('--workers', type=int, default=BATCH_WORKERS, help='продавцов одновременно')
+    parser.add_argument('--rate', type=float, default=None, help='общий лимит запросов в секунду')
+    parser.add_argument('--processes', type=int, default=0,
+                        help='процессов для сборки дата-фреймов (0 - в основном процессе)')
+    parser.add_argument('--parse-workers', type=int, nargs='?', const=default_parse_workers(), default=0,
+                        help='процессов для разбора страниц (без числа - по числу ядер минус одно, 0 - в цикле событий)')
+    parser.add_argument('--no-cache', action='store_true', help='не использовать дисковый кэш ответов')
+    parser.add_argument('--cache-ttl', type=float, default=CACHE_TTL, help='время жизни кэша ответов, с')
+    parser.add_argument('--refresh-categories', action='store_true',
+                        help='запросить карты категорий заново, не используя сохраненные')
+    parser.add_argument('--format', default='csv', choices=REPORT_FORMATS, help='формат отчетов')
+    parser.add_argument('--snapshots', nargs='?', const=str(SNAPSHOTS_PATH), default=None,
+                        help='вести историю цен в базе снимков (по умолчанию app/snapshots.sqlite)')
+    parser.add_argument('--sessions', nargs='+', default=None, metavar='FILE',
+                        help='файлы с curl-командами для общего пула сессий (вместо settings.txt)')
+    parser.add_argument('--session-strategy', default='round_robin', choices=SESSION_STRATEGIES,
+                        help='выбор сессии: по кругу или дольше всех не получавшая 429')
+    parser.add_argument('--log-level', default='INFO', help='уровень логирования (DEBUG - с каждым запросом)')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    setup_logging(args.log_level)
+    started_at = time.monotonic()
+    batch_results = asyncio.run(run_batch(read_urls(args.file), workers=args.workers, rate_limit=args.rate,
+                                          use_cache=not args.no_cache, cache_ttl=args.cache_ttl,
+                                          processes=args.processes, fmt=args.format,
+                                          snapshots_path=args.snapshots, session_files=args.sessions,
+                                          session_strategy=args.session_strategy,
+                                          parse_workers=args.parse_workers,
+                                          refresh_categories=args.refresh_categories))
+    print_summary(batch_results, time.monotonic() - started_at)
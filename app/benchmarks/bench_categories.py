@@ -0,0 +1,54 @@
+"""
+Сравнение извлечения дерева категорий: быстрое сканирование html против BeautifulSoup (html.parser).
+
+Запуск из папки app: python benchmarks/bench_categories.py [сохраненная_страница.html ...]
+Без аргументов используется синтетическая страница на несколько мегабайт.
+"""
+import sys
+import json
+import html
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from common import CATEGORIES_ELEMENT_ID, find_attribute_fast, find_attribute_soup  # noqa: E402
+
+
+def make_seller_page(categories: int = 300, filler_blocks: int = 20_000) -> str:
+    """
+    Синтетическая страница продавца: много разметки и блок фильтров с data-state
+    """
+    state = {'sections': [{'filters': [{'categoryFilter': {'categories': [
+        {'title': f'Категория {i}', 'level': i % 3, 'urlValue': f'/seller/shop-1/cat-{i}/'}
+        for i in range(categories)
+    ]}}]}]}
+    filler = ''.join(f'<div class="tile" data-id="{i}"><a href="/product/{i}/">Товар {i} &amp; ко</a>'
+                     f'<span class="price">{i} ₽</span></div>' for i in range(filler_blocks))
+    target = (f'<div id="{CATEGORIES_ELEMENT_ID}" data-state=\'{html.escape(json.dumps(state), quote=False)}\''
+              f' class="filters"></div>')
+    return f'<html><head><title>shop</title></head><body>{filler}{target}{filler}</body></html>'
+
+
+def measure(label: str, func, page: str) -> str:
+    tracemalloc.start()
+    start = time.perf_counter()
+    value = func(page, CATEGORIES_ELEMENT_ID, 'data-state')
+    spent = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'  {label:<16} {spent * 1000:9.1f} мс, пик памяти {peak / 2 ** 20:8.1f} МБ')
+    return value
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        pages = {path: Path(path).read_text(encoding='utf-8') for path in sys.argv[1:]}
+    else:
+        pages = {'синтетическая': make_seller_page()}
+    for name, page in pages.items():
+        print(f'{name}: {len(page.encode()) / 2 ** 20:.1f} МБ')
+        fast = measure('сканирование', find_attribute_fast, page)
+        soup = measure('BeautifulSoup', find_attribute_soup, page)
+        print(f'  результаты совпадают: {fast == soup}')
@@ -0,0 +1,75 @@
+"""
+Сравнение пропускной способности: новый клиент на каждый запрос против общего пула клиентов,
+по HTTP/1.1 и по HTTP/2 (все запросы пула - потоками одного соединения).
+
+Запуск из папки app: python benchmarks/bench_client_pool.py [число_запросов] [параллельность]
+"""
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from requests_handler import ClientPool, send_request  # noqa: E402
+from stub_server import start_stub_server  # noqa: E402
+
+
+async def fetch_new_client(url: str, http1: bool = True):
+    """
+    Прежнее поведение: отдельный клиент (и новое соединение) на каждый запрос
+    """
+    async with httpx.AsyncClient(follow_redirects=True, timeout=30.0, http1=http1, http2=True) as client:
+        r = await client.get(url)
+        r.json()
+
+
+async def fetch_pooled(url: str, pool: ClientPool):
+    """
+    Новое поведение: send_request с долгоживущим клиентом из пула
+    """
+    await send_request(url=url, pool=pool)
+
+
+async def measure(label: str, make_task, total: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await make_task()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    spent = time.perf_counter() - start
+    rps = total / spent
+    print(f'{label:<28} {total} запросов за {spent:.2f} с -> {rps:.1f} req/s')
+    return rps
+
+
+async def compare(http2: bool, total: int, concurrency: int):
+    server = start_stub_server(http2=http2)
+    host, port = server.server_address
+    url = f'http://{host}:{port}/api/entrypoint-api.bx/page/json/v2'
+    protocol = 'HTTP/2' if http2 else 'HTTP/1.1'
+    try:
+        before = await measure(f'новый клиент, {protocol}', lambda: fetch_new_client(url, not http2),
+                               total, concurrency)
+        async with ClientPool(http1=not http2) as pool:
+            after = await measure(f'пул клиентов, {protocol}', lambda: fetch_pooled(url, pool), total, concurrency)
+        print(f'ускорение: x{after / before:.2f}')
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+async def main(total: int, concurrency: int):
+    for http2 in (False, True):
+        await compare(http2, total, concurrency)
+
+
+if __name__ == '__main__':
+    total_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    concurrency_level = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    asyncio.run(main(total_requests, concurrency_level))
@@ -0,0 +1,206 @@
+"""
+Сквозной бенчмарк get_all_items_ozon на локальной имитации Ozon: страницы/с, товары/с,
+p50/p99 задержки запросов и пиковая память процесса сбора.
+
+Имитация запускается отдельным процессом, чтобы ее потоки не делили GIL и память с замеряемым сбором.
+
+Запуск из папки app:
+python benchmarks/bench_end_to_end.py --pages 50 --latency 0.02 --error-rate 0.01 --rate-429 0.005 --repeat 3
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import requests_handler  # noqa: E402
+from main import get_all_items_ozon  # noqa: E402
+from crawler import CrawlStats  # noqa: E402
+from common import get_report_path  # noqa: E402
+from metrics import RunMetrics, Histogram  # noqa: E402
+from requests_handler import CLIENT_POOL  # noqa: E402
+from writers import REPORT_FORMATS  # noqa: E402
+from stub_server import STUB_SELLER  # noqa: E402
+from sessions import Session, SessionPool, SESSION_STRATEGIES  # noqa: E402
+from parsing import make_parse_pool  # noqa: E402
+from sharding import SHARD_PAGES  # noqa: E402
+from cache import CategoryCache, PageFingerprints  # noqa: E402
+
+
+# мелкие корзины задержек (от 1 мс до 30 с), чтобы квантили на локальной заглушке были точнее стандартных
+FINE_BUCKETS = tuple(round(0.001 * 1.25 ** i, 4) for i in range(47))
+
+
+def peak_rss_mb() -> float | None:
+    """
+    Пиковая память текущего процесса, МБ (нет модуля resource - None)
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # в macOS значение в байтах, в Linux - в килобайтах
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+def start_stub_process(args: argparse.Namespace) -> tuple[subprocess.Popen, str]:
+    """
+    Запуск имитации Ozon отдельным процессом, возвращает процесс и адрес магазина
+    """
+    command = [sys.executable, str(Path(__file__).parent / 'stub_server.py'), '--port', '0',
+               '--pages', str(args.pages), '--items-per-page', str(args.items_per_page),
+               '--latency', str(args.latency), '--error-rate', str(args.error_rate),
+               '--rate-429', str(args.rate_429), '--retry-after', str(args.retry_after)]
+    if args.recorded:
+        command += ['--recorded', args.recorded]
+    if args.cookie_rps:
+        command += ['--cookie-rps', str(args.cookie_rps)]
+    if args.cookie_limit:
+        command += ['--cookie-limit', str(args.cookie_limit)]
+    if args.subcategories:
+        command += ['--subcategories', str(args.subcategories)]
+    if args.seller_latency:
+        command += ['--seller-latency', str(args.seller_latency)]
+    if args.http2:
+        command.append('--http2')
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    # первая строка вывода - адрес магазина, сервер к этому моменту уже слушает порт
+    seller_url = process.stdout.readline().split(': ', 1)[1].strip()
+    return process, seller_url
+
+
+def remove_reports():
+    """
+    Отчеты бенчмарка не нужны, удаляем их после каждого прогона
+    """
+    for path in get_report_path(STUB_SELLER).parent.glob(f'{STUB_SELLER}_*'):
+        os.remove(path)
+
+
+def make_sessions(count: int, strategy: str) -> SessionPool | None:
+    """
+    Пул синтетических сессий (у каждой свой набор куки) для проверки ротации на лимитах заглушки
+    """
+    if not count:
+        return None
+    return SessionPool([Session(name=f'session-{index}', cookies={'__Secure-ab-group': str(index)})
+                        for index in range(count)], strategy=strategy)
+
+
+async def run_once(seller_url: str, fmt: str, stream: bool, sessions: SessionPool = None,
+                   parse_workers: int = 0, shard_pages: int = SHARD_PAGES,
+                   category_cache: CategoryCache = None, fingerprints: PageFingerprints = None) -> dict:
+    metrics = RunMetrics(STUB_SELLER)
+    metrics.latency = Histogram(FINE_BUCKETS)
+    stats = CrawlStats()
+    # пул разбора создается до замера (старт процессов и загрузка pandas не относятся к сбору)
+    parse_executor = make_parse_pool(parse_workers) if parse_workers else None
+    if parse_executor is not None:
+        list(parse_executor.map(int, range(parse_workers)))
+    started = time.perf_counter()
+    try:
+        async with CLIENT_POOL:
+            await get_all_items_ozon(seller_url, stream=stream, stats=stats, metrics=metrics, fmt=fmt,
+                                     sessions=sessions, parse_executor=parse_executor, shard_pages=shard_pages,
+                                     category_cache=category_cache, fingerprints=fingerprints)
+    finally:
+        if parse_executor is not None:
+            parse_executor.shutdown()
+    spent = time.perf_counter() - started
+    return {
+        'seconds': spent,
+        'pages': stats.pages_requested,
+        'items': stats.items,
+        'pages_s': stats.pages_requested / spent,
+        'items_s': stats.items / spent,
+        'p50_ms': metrics.latency.quantile(0.5) * 1000,
+        'p99_ms': metrics.latency.quantile(0.99) * 1000,
+        'retries': metrics.retries,
+        'shards': stats.shards_summary(),
+        'categories': metrics.extra.get('categories'),
+        'unchanged': f'{stats.fingerprint_hits}/{stats.fingerprint_hits + stats.fingerprint_misses}',
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Сквозной бенчмарк сбора на локальной имитации Ozon')
+    parser.add_argument('--pages', type=int, default=50, help='страниц в каждой из 3 категорий')
+    parser.add_argument('--items-per-page', type=int, default=36)
+    parser.add_argument('--latency', type=float, default=0.02, help='средняя задержка ответа, с')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля ответов 503')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='доля ответов 429')
+    parser.add_argument('--retry-after', type=float, default=0.2, help='Retry-After для ответов 429, с')
+    parser.add_argument('--recorded', default=None, help='папка с сохраненными ответами')
+    parser.add_argument('--format', default='csv', choices=REPORT_FORMATS)
+    parser.add_argument('--no-stream', action='store_true', help='сбор всего каталога в памяти')
+    parser.add_argument('--repeat', type=int, default=3, help='число прогонов')
+    parser.add_argument('--sessions', type=int, default=0, help='число синтетических сессий (0 - без пула сессий)')
+    parser.add_argument('--session-strategy', default='round_robin', choices=SESSION_STRATEGIES)
+    parser.add_argument('--cookie-rps', type=float, default=None, help='лимит заглушки: запросов в секунду на сессию')
+    parser.add_argument('--cookie-limit', type=int, default=None, help='лимит заглушки: всего запросов на сессию')
+    parser.add_argument('--subcategories', type=int, default=0,
+                        help='подкатегорий у каждой категории заглушки (--pages страниц в каждой)')
+    parser.add_argument('--shard-pages', type=int, default=SHARD_PAGES,
+                        help='делить категории больше N страниц на подкатегории (0 - не делить)')
+    parser.add_argument('--seller-latency', type=float, default=0.0,
+                        help='доп. задержка страницы продавца в заглушке, с (самый тяжелый запрос)')
+    parser.add_argument('--category-cache', action='store_true',
+                        help='карта категорий из кэша со второго прогона (--categories-ttl 0 - с проверкой в фоне)')
+    parser.add_argument('--categories-ttl', type=float, default=3600.0)
+    parser.add_argument('--fingerprints', action='store_true',
+                        help='отпечатки страниц: со второго прогона неизменившиеся страницы не разбираются')
+    parser.add_argument('--parse-workers', type=int, default=0, help='процессов для разбора страниц (0 - в цикле событий)')
+    parser.add_argument('--http2', action='store_true',
+                        help='заглушка и пул клиентов по HTTP/2 без TLS (запросы - потоками одного соединения)')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    stub_process, url = start_stub_process(args)
+    # все запросы (и страница магазина, и api) уходят на имитацию
+    requests_handler.BASE_URL = url.split('/seller/')[0]
+    # по http:// httpx говорит на HTTP/2, только если HTTP/1.1 отключен
+    CLIENT_POOL.http1 = not args.http2
+    categories_dir = tempfile.TemporaryDirectory()
+    categories_cache = (CategoryCache(Path(categories_dir.name) / 'categories.sqlite', ttl=args.categories_ttl)
+                        if args.category_cache else None)
+    page_fingerprints = (PageFingerprints(Path(categories_dir.name) / 'pages.sqlite')
+                         if args.fingerprints else None)
+    try:
+        print(f'{"run":>3} {"seconds":>8} {"pages":>6} {"items":>7} {"pages/s":>8} {"items/s":>9} '
+              f'{"p50 ms":>7} {"p99 ms":>7} {"retries":>7}')
+        for run in range(1, args.repeat + 1):
+            session_pool = make_sessions(args.sessions, args.session_strategy)
+            result = asyncio.run(run_once(url, args.format, not args.no_stream, session_pool, args.parse_workers,
+                                          args.shard_pages, categories_cache, page_fingerprints))
+            remove_reports()
+            print(f'{run:>3} {result["seconds"]:>8.2f} {result["pages"]:>6} {result["items"]:>7} '
+                  f'{result["pages_s"]:>8.1f} {result["items_s"]:>9.0f} {result["p50_ms"]:>7.1f} '
+                  f'{result["p99_ms"]:>7.1f} {result["retries"]:>7}')
+            if categories_cache is not None:
+                print(f'    categories: {result["categories"]}')
+            if page_fingerprints is not None:
+                print(f'    unchanged pages: {result["unchanged"]}')
+            if result['shards']:
+                print(f'    shards: {result["shards"]}')
+            if session_pool is not None:
+                print('    sessions: ' + ', '.join(f'{row["name"]} {row["requests"]}/{row["throttled"]}/{row["blocked"]}'
+                                                  for row in session_pool.summary()) + ' (запросов/429/блокировок)')
+        peak_rss = peak_rss_mb()
+        if peak_rss is not None:
+            print(f'peak RSS: {peak_rss:.1f} MB')
+    finally:
+        stub_process.terminate()
+        stub_process.wait()
+        if categories_cache is not None:
+            categories_cache.close()
+        if page_fingerprints is not None:
+            page_fingerprints.close()
+        categories_dir.cleanup()
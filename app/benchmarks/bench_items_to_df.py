@@ -0,0 +1,90 @@
+"""
+Микро-бенчмарк сборки дата-фрейма: построчные вставки df.loc против колоночного edit_items_to_df.
+
+Запуск из папки app: python benchmarks/bench_items_to_df.py [число_товаров] [число_товаров_для_старой_версии]
+Старая версия квадратична, поэтому меряется на меньшей выборке и пересчитывается в товары/с.
+"""
+import sys
+import time
+import random
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from common import edit_items_to_df  # noqa: E402
+
+
+def make_items(count: int, categories: int = 20, seed: int = 1) -> dict:
+    """
+    Синтетические товары в формате mainState ответа entrypoint-api
+    """
+    rnd = random.Random(seed)
+    main_items_dict = {f'Категория {i}': [] for i in range(categories)}
+    names = list(main_items_dict)
+    for i in range(count):
+        price_promo = rnd.randint(100, 200_000)
+        price_reg = price_promo + rnd.randint(0, 50_000)
+        main_items_dict[names[i % categories]].append({
+            'skuId': str(100_000_000 + i),
+            'mainState': [
+                {'id': 'atom', 'atom': {'priceV2': {'price': [
+                    {'text': f'{price_promo:,}'.replace(',', '\u2009') + ' ₽'},
+                    {'text': f'{price_reg:,}'.replace(',', '\u2009') + ' ₽'},
+                ]}}},
+                {'id': 'name', 'atom': {'textAtom': {'text': f'Товар {i}'}}},
+            ],
+        })
+    return main_items_dict
+
+
+def legacy_items_to_df(main_items_dict: dict, llc_info: str, seller_id: str) -> pd.DataFrame:
+    """
+    Прежняя реализация: строка за строкой через df.loc[len(df)]
+    """
+    dt = '2025-01-01 00:00:00'
+    df = pd.DataFrame({'shop': [], 'datetime': [], 'price_reg': [], 'price_promo': [],
+                       'article': [], 'name': [], 'category_path': []})
+    for name_cat, items_list in main_items_dict.items():
+        for item in items_list:
+            article = item.get('skuId')
+            main_state = item.get('mainState')
+            price_promo, price_reg, name = None, None, None
+            try:
+                for row in main_state:
+                    if row.get('id') == 'atom':
+                        prices_data = row['atom']['priceV2']['price']
+                        maketrans = str.maketrans({'₽': '', '₾': '', '\u2009': '', ' ': '', ',': '.'})
+                        price_promo = int(float(prices_data[0]['text'].translate(maketrans)))
+                        price_reg = int(float(prices_data[1]['text'].translate(maketrans)))
+                        break
+            except Exception:
+                pass
+            try:
+                for row in main_state:
+                    if row.get('id') == 'name':
+                        name = row['atom']['textAtom']['text']
+                        break
+            except Exception:
+                pass
+            df.loc[len(df)] = [llc_info or seller_id, dt, price_reg, price_promo, article, name, name_cat]
+    return df.sort_values(by=['category_path', 'price_promo'], ascending=[True, False])
+
+
+def measure(label: str, func, items: dict) -> float:
+    count = sum(len(items_list) for items_list in items.values())
+    start = time.perf_counter()
+    df = func(items, 'ООО Тест', 'test-1')
+    spent = time.perf_counter() - start
+    rate = count / spent
+    print(f'{label:<12} {count} товаров за {spent:.3f} с -> {rate:,.0f} товаров/с ({len(df)} строк)')
+    return rate
+
+
+if __name__ == '__main__':
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    legacy_total = int(sys.argv[2]) if len(sys.argv) > 2 else 5_000
+    new_rate = measure('колоночная', edit_items_to_df, make_items(total))
+    legacy_rate = measure('df.loc', legacy_items_to_df, make_items(legacy_total))
+    print(f'ускорение: x{new_rate / legacy_rate:.1f} (старая версия на {legacy_total} товаров)')
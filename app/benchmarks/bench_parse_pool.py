@@ -0,0 +1,109 @@
+"""
+Бенчмарк разбора страниц в пуле процессов: страницы/с и товары/с в зависимости от числа процессов
+против разбора прямо в цикле событий, а также наибольшая задержка цикла событий (насколько разбор
+мешал бы держать запросы в полете).
+
+Страницы - байты ответов локальной имитации Ozon, сеть не участвует.
+
+Запуск из папки app:
+python benchmarks/bench_parse_pool.py --pages 400 --items-per-page 36 --workers 0 1 2 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from parsing import PageParser, parse_page, make_parse_pool  # noqa: E402
+from stub_server import OzonStubConfig, make_stub_page, STUB_SELLER  # noqa: E402
+
+# страниц, разбираемых одновременно (как пачка страниц категории в crawler)
+IN_FLIGHT = 8
+# период замера задержки цикла событий, с
+TICK = 0.001
+
+
+def make_bodies(pages: int, items_per_page: int, categories: int = 4) -> list[tuple[str, bytes]]:
+    """
+    Байты ответов entrypoint-api по нескольким категориям
+    """
+    config = OzonStubConfig(categories={f'cat-{index}': pages // categories + 1 for index in range(categories)},
+                            items_per_page=items_per_page)
+    bodies = []
+    for page in range(1, pages // categories + 2):
+        for category in config.categories:
+            bodies.append((category, json.dumps(make_stub_page(config, category, page), ensure_ascii=False).encode()))
+    return bodies[:pages]
+
+
+async def measure_lag(stop: asyncio.Event) -> float:
+    """
+    Наибольшее опоздание пробуждения цикла событий относительно TICK, с
+    """
+    worst = 0.0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK)
+        worst = max(worst, time.perf_counter() - started - TICK)
+    return worst
+
+
+async def run_once(bodies: list[tuple[str, bytes]], workers: int) -> dict:
+    dt = '2024-01-01 00:00:00'
+    executor = make_parse_pool(workers) if workers else None
+    parser = PageParser(executor, 'stub', STUB_SELLER, dt) if executor is not None else None
+    if executor is not None:
+        # прогрев: процессы пула стартуют и загружают pandas до замера
+        await asyncio.gather(*(parser.parse(body, name_cat) for name_cat, body in bodies[:workers * 2]))
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_lag(stop))
+    items = 0
+    started = time.perf_counter()
+    try:
+        for offset in range(0, len(bodies), IN_FLIGHT):
+            batch = bodies[offset:offset + IN_FLIGHT]
+            if parser is not None:
+                parsed_list = await asyncio.gather(*(parser.parse(body, name_cat) for name_cat, body in batch))
+            else:
+                parsed_list = [parse_page(body, name_cat, 'stub', STUB_SELLER, dt) for name_cat, body in batch]
+                # отдаем управление, как цикл событий между пачками запросов
+                await asyncio.sleep(0)
+            items += sum(len(parsed.frame) for parsed in parsed_list if parsed.frame is not None)
+        spent = time.perf_counter() - started
+    finally:
+        stop.set()
+        worst_lag = await lag_task
+        if executor is not None:
+            executor.shutdown()
+    return {'seconds': spent, 'pages_s': len(bodies) / spent, 'items_s': items / spent, 'lag_ms': worst_lag * 1000}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Масштабирование разбора страниц по процессам')
+    parser.add_argument('--pages', type=int, default=400)
+    parser.add_argument('--items-per-page', type=int, default=36)
+    parser.add_argument('--workers', type=int, nargs='+', default=None,
+                        help='числа процессов для замера (0 - разбор в цикле событий), по умолчанию 0, 1, 2, 4... до числа ядер')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    workers_list = args.workers
+    if workers_list is None:
+        cores = os.cpu_count() or 1
+        workers_list = [0] + [2 ** power for power in range(cores.bit_length()) if 2 ** power <= cores]
+    page_bodies = make_bodies(args.pages, args.items_per_page)
+    size_mb = sum(len(body) for _, body in page_bodies) / 2**20
+    print(f'{len(page_bodies)} страниц, {size_mb:.1f} MB, ядер: {os.cpu_count()}')
+    print(f'{"workers":>7} {"seconds":>8} {"pages/s":>8} {"items/s":>9} {"speedup":>7} {"max lag ms":>10}')
+    baseline = None
+    for workers_count in workers_list:
+        result = asyncio.run(run_once(page_bodies, workers_count))
+        baseline = baseline or result['pages_s']
+        print(f'{workers_count:>7} {result["seconds"]:>8.2f} {result["pages_s"]:>8.1f} {result["items_s"]:>9.0f} '
+              f'{result["pages_s"] / baseline:>6.2f}x {result["lag_ms"]:>10.1f}')
@@ -0,0 +1,531 @@
+"""
+Локальные заглушки для бенчмарков: простой json-ответ и имитация Ozon (страница продавца, данные ЮЛ,
+страницы товаров) с настраиваемой задержкой, долей ошибок и ответов 429.
+
+Имитацию Ozon можно запустить отдельным процессом (из папки app):
+python benchmarks/stub_server.py --port 8081 --latency 0.05 --error-rate 0.01 --rate-429 0.01
+
+С --http2 заглушки отвечают по HTTP/2 без TLS (prior knowledge, как h2c): клиенту нужен
+httpx.AsyncClient(http1=False, http2=True) или ClientPool(http1=False)
+"""
+import argparse
+import asyncio
+import html
+import json
+import random
+import socket
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import NamedTuple
+from urllib.parse import urlparse, parse_qs
+import h2.config
+import h2.connection
+import h2.events
+import h2.exceptions
+from pydantic import BaseModel, Field
+
+
+# блок страницы продавца с деревом категорий (как CATEGORIES_ELEMENT_ID в common.py)
+CATEGORIES_ELEMENT_ID = 'state-filtersDesktop-3124459-default-1'
+# адрес магазина, который обслуживает имитация (в пути должен быть ozon - так проверяет URLModel)
+STUB_SELLER = 'ozon-1'
+
+
+class StubResponse(NamedTuple):
+    """
+    Ответ заглушки, общий для серверов HTTP/1.1 и HTTP/2
+    """
+    status: int
+    body: bytes
+    content_type: str = 'application/json'
+    headers: dict = {}
+    # задержка перед ответом, с
+    delay: float = 0.0
+
+
+def simple_stub_response() -> StubResponse:
+    """
+    Небольшой json в формате entrypoint-api
+    """
+    return StubResponse(200, json.dumps({'layout': [], 'widgetStates': {}}).encode())
+
+
+class StubHandlerMixin:
+    """
+    Отправка StubResponse сервером HTTP/1.1
+    """
+    # keep-alive между запросами, как у настоящего сервера
+    protocol_version = 'HTTP/1.1'
+
+    def send_stub_response(self, response: StubResponse):
+        if response.delay:
+            time.sleep(response.delay)
+        self.send_response(response.status)
+        self.send_header('Content-Type', response.content_type)
+        self.send_header('Content-Length', str(len(response.body)))
+        for name, value in response.headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(response.body)
+
+    def log_message(self, format, *args):
+        # не засоряем вывод бенчмарка логами каждого запроса
+        pass
+
+
+class StubHandler(StubHandlerMixin, BaseHTTPRequestHandler):
+    """
+    Обработчик локальной заглушки: на любой GET отдает небольшой json в формате entrypoint-api
+    """
+
+    def do_GET(self):
+        self.send_stub_response(simple_stub_response())
+
+
+class H2StubConnection:
+    """
+    Соединение HTTP/2: запросы приходят потоками одного соединения, каждый ответ отправляется отдельной задачей
+    по мере готовности (с учетом окон управления потоком клиента)
+    """
+
+    def __init__(self, server: 'H2StubServer', reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.conn = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False,
+                                                                         header_encoding='utf-8'))
+        # событие пересоздается при каждом расширении окна, ответы ждут текущее
+        self.window_updated = asyncio.Event()
+        self.streams: set[asyncio.Task] = set()
+
+    async def run(self):
+        self.conn.initiate_connection()
+        self.flush()
+        try:
+            while data := await self.reader.read(65536):
+                for event in self.conn.receive_data(data):
+                    self.handle_event(event)
+                self.flush()
+                await self.writer.drain()
+        except (h2.exceptions.ProtocolError, ConnectionError):
+            pass
+        finally:
+            for task in self.streams:
+                task.cancel()
+            self.writer.close()
+
+    def handle_event(self, event: h2.events.Event):
+        if isinstance(event, h2.events.RequestReceived):
+            task = asyncio.create_task(self.respond(event.stream_id, event.headers))
+            self.streams.add(task)
+            task.add_done_callback(self.streams.discard)
+        elif isinstance(event, h2.events.DataReceived):
+            self.conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+        elif isinstance(event, (h2.events.WindowUpdated, h2.events.RemoteSettingsChanged)):
+            self.window_updated.set()
+            self.window_updated = asyncio.Event()
+
+    async def respond(self, stream_id: int, raw_headers: list[tuple[str, str]]):
+        headers = {}
+        for name, value in raw_headers:
+            # клиент может разбить cookie на несколько заголовков
+            headers[name] = f'{headers[name]}{"; " if name == "cookie" else ", "}{value}' if name in headers else value
+        response = self.server.respond(headers.get(':path', '/'), headers)
+        if response.delay:
+            await asyncio.sleep(response.delay)
+        body = response.body
+        response_headers = [(':status', str(response.status)), ('content-type', response.content_type),
+                            ('content-length', str(len(body)))]
+        response_headers += [(name.lower(), value) for name, value in response.headers.items()]
+        try:
+            self.conn.send_headers(stream_id, response_headers, end_stream=not body)
+            self.flush()
+            while body:
+                size = min(self.conn.local_flow_control_window(stream_id), self.conn.max_outbound_frame_size)
+                if size <= 0:
+                    await self.window_updated.wait()
+                    continue
+                self.conn.send_data(stream_id, body[:size], end_stream=size >= len(body))
+                body = body[size:]
+                self.flush()
+        except h2.exceptions.StreamClosedError:
+            # клиент сбросил поток, не дождавшись ответа
+            pass
+
+    def flush(self):
+        data = self.conn.data_to_send()
+        if data and not self.writer.is_closing():
+            self.writer.write(data)
+
+
+class H2StubServer:
+    """
+    Сервер HTTP/2 без TLS с заранее известным протоколом (prior knowledge): в отличие от HTTP/1.1 все запросы
+    клиента идут одним соединением, задержка одного ответа не держит остальные. Ответ на запрос дает respond,
+    интерфейс запуска и остановки - как у socketserver
+    """
+
+    def __init__(self, address: tuple):
+        self.socket = socket.create_server(address)
+        self.server_address = self.socket.getsockname()[:2]
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._stopped: asyncio.Event | None = None
+        self._started = threading.Event()
+        self._finished = threading.Event()
+        self._connections: set[H2StubConnection] = set()
+
+    def respond(self, path: str, headers: dict) -> StubResponse:
+        raise NotImplementedError
+
+    def serve_forever(self):
+        try:
+            asyncio.run(self._serve())
+        finally:
+            self._finished.set()
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        server = await asyncio.start_server(self._handle_connection, sock=self.socket)
+        self._started.set()
+        try:
+            await self._stopped.wait()
+        finally:
+            server.close()
+            for connection in list(self._connections):
+                connection.writer.close()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        connection = H2StubConnection(self, reader, writer)
+        self._connections.add(connection)
+        try:
+            await connection.run()
+        finally:
+            self._connections.discard(connection)
+
+    def shutdown(self):
+        """
+        Остановка serve_forever из другого потока (как у socketserver, ждет его завершения)
+        """
+        self._started.wait()
+        self._loop.call_soon_threadsafe(self._stopped.set)
+        self._finished.wait()
+
+    def server_close(self):
+        self.socket.close()
+
+
+class SimpleH2StubServer(H2StubServer):
+    """
+    Заглушка с небольшим json по HTTP/2
+    """
+
+    def respond(self, path: str, headers: dict) -> StubResponse:
+        return simple_stub_response()
+
+
+def start_stub_server(host: str = '127.0.0.1', port: int = 0,
+                      http2: bool = False) -> ThreadingHTTPServer | SimpleH2StubServer:
+    """
+    Запуск заглушки в фоновом потоке, адрес доступен через server.server_address
+    """
+    if http2:
+        server = SimpleH2StubServer((host, port))
+    else:
+        server = ThreadingHTTPServer((host, port), StubHandler)
+        server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+class OzonStubConfig(BaseModel):
+    """
+    Настройки имитации Ozon
+    """
+    categories: dict[str, int] = Field(
+        default={'elektronika-15500': 30, 'odezhda-obuv-i-aksessuary-7500': 12, 'dom-i-sad-14500': 50},
+        description='Категории продавца и число страниц товаров в каждой')
+    items_per_page: int = Field(default=36, description='Товаров на странице')
+    latency: float = Field(default=0.0, description='Средняя задержка ответа, с (равномерно от 0.5 до 1.5 от нее)')
+    error_rate: float = Field(default=0.0, description='Доля ответов 503')
+    rate_429: float = Field(default=0.0, description='Доля ответов 429')
+    retry_after: float | None = Field(default=1.0, description='Заголовок Retry-After для ответов 429')
+    recorded_dir: str | None = Field(
+        default=None, description='Папка с сохраненными ответами: seller.html, llc.json, <категория>/<страница>.json '
+                                  '(если файла нет - ответ генерируется)')
+    cookie_rps: float | None = Field(default=None, description='Лимит запросов в секунду на набор куки (сверх - 429)')
+    cookie_limit: int | None = Field(default=None, description='Всего запросов на набор куки (сверх - 403)')
+    seller_latency: float = Field(default=0.0, description='Дополнительная задержка страницы продавца, с '
+                                                           '(самый тяжелый ответ)')
+    subcategories: int = Field(default=0, description='Подкатегорий у каждой категории (по categories страниц в '
+                                                      'каждой); выдача категории - ее подкатегории подряд')
+
+
+def stub_subcategories(config: OzonStubConfig, category: str) -> list[str]:
+    return [f'{category}-sub-{index}' for index in range(config.subcategories)]
+
+
+def resolve_stub_listing(config: OzonStubConfig, category: str, page: int) -> tuple[str, int, int]:
+    """
+    Какая страница какой (под)категории отдается по запросу: (категория товаров, ее страница, всего страниц в выдаче)
+    """
+    for parent, pages in config.categories.items():
+        children = stub_subcategories(config, parent)
+        if category == parent and children:
+            # выдача категории - товары подкатегорий подряд, те же skuId, что и в самих подкатегориях
+            return children[min((page - 1) // pages, len(children) - 1)], (page - 1) % pages + 1, pages * len(children)
+        if category in children:
+            return category, page, pages
+    return category, page, config.categories.get(category, 0)
+
+
+def make_stub_items(category: str, page: int, count: int) -> list[dict]:
+    """
+    Товары страницы в формате состояния виджета выдачи
+    """
+    items = []
+    for index in range(count):
+        number = (page - 1) * count + index
+        main_state = [
+            {'id': 'atom', 'atom': {'type': 'priceV2', 'priceV2': {'price': [
+                {'text': f'{1000 + number % 5000}\u2009₽'}, {'text': f'{1500 + number % 7000}\u2009₽'}]}}},
+            {'id': 'name', 'atom': {'type': 'textAtom', 'textAtom': {'text': f'Товар {category} {number}'}}},
+            {'id': 'atom', 'atom': {'type': 'labelList', 'labelList': {'items': [
+                {'title': f'{4 + number % 10 / 10:.1f}'}, {'title': f'{number * 7 % 3000} отзывов'}]}}},
+            {'id': 'deliveryInfo', 'atom': {'type': 'textAtom', 'textAtom': {'text': f'{number % 9 + 1} дней'}}},
+        ]
+        # бейджи есть не у всех товаров
+        if number % 3 == 0:
+            main_state.append({'id': 'badges', 'atom': {'type': 'labelList', 'labelList': {'items': [
+                {'title': 'Оригинал'}, {'title': 'Распродажа'}]}}})
+        items.append({'skuId': str(zlib.crc32(category.encode()) % 10**6 * 10**5 + number), 'mainState': main_state})
+    return items
+
+
+def make_stub_page(config: OzonStubConfig, category: str, page: int) -> dict:
+    """
+    Ответ entrypoint-api со страницей товаров и данными пагинации (за последней страницей - пустой layout)
+    """
+    items_category, items_page, pages = resolve_stub_listing(config, category, page)
+    if page > pages:
+        return {'layout': None}
+    items_state = json.dumps({'items': make_stub_items(items_category, items_page, config.items_per_page)},
+                             ensure_ascii=False)
+    paginator = json.dumps({'currentPage': page, 'totalPages': pages, 'nextPage': page < pages})
+    return {'layout': [{'stateId': 'searchResultsV2-226897-default-1'}],
+            'widgetStates': {'searchResultsV2-226897-default-1': items_state,
+                             'megaPaginator-1932838-default-1': paginator}}
+
+
+def make_stub_seller_page(config: OzonStubConfig) -> str:
+    """
+    Страница магазина с деревом категорий в атрибуте data-state (плоский список: за категорией - ее подкатегории)
+    """
+    categories = []
+    for category in config.categories:
+        categories.append({'title': category, 'level': 0, 'urlValue': f'/seller/{STUB_SELLER}/{category}/'})
+        categories += [{'title': child, 'level': 1, 'urlValue': f'/seller/{STUB_SELLER}/{child}/'}
+                       for child in stub_subcategories(config, category)]
+    state = {'sections': [{'filters': [{'categoryFilter': {'categories': categories}}]}]}
+    data_state = html.escape(json.dumps(state, ensure_ascii=False), quote=True)
+    return f'<html><body><div id="{CATEGORIES_ELEMENT_ID}" data-state="{data_state}"></div></body></html>'
+
+
+def make_stub_llc_info() -> dict:
+    text = json.dumps({'body': [{'textAtom': {'text': 'ООО «Заглушка»<br>ОГРН 1000000000000'}}]}, ensure_ascii=False)
+    return {'widgetStates': {'textBlock-3252445-default-1': text}}
+
+
+class OzonStub:
+    """
+    Имитация Ozon: страница продавца /seller/..., данные ЮЛ и страницы товаров через entrypoint-api.
+    Сохраненные ответы берутся из recorded_dir, остальные генерируются и кэшируются в памяти
+    """
+
+    def __init__(self, config: OzonStubConfig):
+        self.config = config
+        self.counters = Counter()
+        # по каждому набору куки: всего запросов и отметки времени запросов за последнюю секунду
+        self.cookie_requests = Counter()
+        self._cookie_window = {}
+        self._payloads = {}
+        self._lock = threading.Lock()
+
+    def respond(self, path: str, headers: dict) -> StubResponse:
+        """
+        Ответ на GET-запрос; headers - заголовки запроса с именами в нижнем регистре
+        """
+        config = self.config
+        delay = config.latency * random.uniform(0.5, 1.5) if config.latency else 0.0
+        # лимиты на сессию (набор куки), как у антибот-защиты
+        verdict = self.check_cookie(headers.get('cookie', ''))
+        if verdict is not None:
+            self.count(str(verdict))
+            return StubResponse(verdict, b'{}', headers={'Retry-After': '1'} if verdict == 429 else {}, delay=delay)
+        roll = random.random()
+        if roll < config.rate_429:
+            self.count('429')
+            retry_after = {'Retry-After': str(config.retry_after)} if config.retry_after is not None else {}
+            return StubResponse(429, b'{}', headers=retry_after, delay=delay)
+        if roll < config.rate_429 + config.error_rate:
+            self.count('503')
+            return StubResponse(503, b'{}', delay=delay)
+        url = urlparse(path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path.startswith('/seller/'):
+            body = self.payload('seller.html')
+            # страница не менялась - условный запрос получает 304 без тела и без задержки тяжелой страницы
+            etag = f'"{zlib.crc32(body):08x}"'
+            if headers.get('if-none-match') == etag:
+                self.count('seller 304')
+                return StubResponse(304, b'', 'text/html; charset=utf-8', {'ETag': etag}, delay)
+            self.count('seller')
+            return StubResponse(200, body, 'text/html; charset=utf-8', {'ETag': etag}, delay + config.seller_latency)
+        page_url = query.get('url', '')
+        if page_url.startswith('/modal/shop-in-shop-info'):
+            self.count('llc')
+            return StubResponse(200, self.payload('llc.json'), delay=delay)
+        if page_url.startswith('/seller/'):
+            self.count('page')
+            category = page_url.strip('/').split('/')[-1]
+            return StubResponse(200, self.payload(f'{category}/{query.get("page", "1")}.json'), delay=delay)
+        self.count('404')
+        return StubResponse(404, b'{}', delay=delay)
+
+    def count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def check_cookie(self, cookie: str) -> int | None:
+        """
+        Проверка лимитов набора куки: код ответа-отказа (403, 429) или None
+        """
+        config = self.config
+        if config.cookie_limit is None and config.cookie_rps is None:
+            return None
+        with self._lock:
+            self.cookie_requests[cookie] += 1
+            if config.cookie_limit is not None and self.cookie_requests[cookie] > config.cookie_limit:
+                return 403
+            if config.cookie_rps is not None:
+                now = time.monotonic()
+                window = [moment for moment in self._cookie_window.get(cookie, ()) if moment > now - 1.0]
+                window.append(now)
+                self._cookie_window[cookie] = window
+                if len(window) > config.cookie_rps:
+                    return 429
+        return None
+
+    def payload(self, name: str) -> bytes:
+        body = self._payloads.get(name)
+        if body is None:
+            body = self._payloads[name] = self.load_payload(name)
+        return body
+
+    def load_payload(self, name: str) -> bytes:
+        if self.config.recorded_dir:
+            path = Path(self.config.recorded_dir) / name
+            if path.exists():
+                return path.read_bytes()
+        if name == 'seller.html':
+            return make_stub_seller_page(self.config).encode()
+        if name == 'llc.json':
+            data = make_stub_llc_info()
+        else:
+            category, page = name.removesuffix('.json').split('/')
+            data = make_stub_page(self.config, category, int(page) if page.isdigit() else 1)
+        return json.dumps(data, ensure_ascii=False).encode()
+
+
+class OzonStubHandler(StubHandlerMixin, BaseHTTPRequestHandler):
+    server: 'OzonStubServer'
+
+    def do_GET(self):
+        headers = {name.lower(): value for name, value in self.headers.items()}
+        self.send_stub_response(self.server.respond(self.path, headers))
+
+
+class OzonStubServer(OzonStub, ThreadingHTTPServer):
+    """
+    Имитация Ozon по HTTP/1.1 (поток на соединение)
+    """
+    daemon_threads = True
+
+    def __init__(self, address: tuple, config: OzonStubConfig):
+        ThreadingHTTPServer.__init__(self, address, OzonStubHandler)
+        OzonStub.__init__(self, config)
+
+
+class OzonStubH2Server(OzonStub, H2StubServer):
+    """
+    Имитация Ozon по HTTP/2 без TLS
+    """
+
+    def __init__(self, address: tuple, config: OzonStubConfig):
+        H2StubServer.__init__(self, address)
+        OzonStub.__init__(self, config)
+
+
+def make_ozon_stub(config: OzonStubConfig = None, host: str = '127.0.0.1', port: int = 0,
+                   http2: bool = False) -> OzonStubServer | OzonStubH2Server:
+    server_class = OzonStubH2Server if http2 else OzonStubServer
+    return server_class((host, port), config or OzonStubConfig())
+
+
+def start_ozon_stub(config: OzonStubConfig = None, host: str = '127.0.0.1', port: int = 0,
+                    http2: bool = False) -> OzonStubServer | OzonStubH2Server:
+    """
+    Запуск имитации Ozon в фоновом потоке
+    """
+    server = make_ozon_stub(config, host, port, http2)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def stub_seller_url(server_address: tuple) -> str:
+    return f'http://{server_address[0]}:{server_address[1]}/seller/{STUB_SELLER}/products/'
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Локальная имитация Ozon для бенчмарков')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--pages', type=int, default=None, help='страниц в каждой из категорий по умолчанию')
+    parser.add_argument('--items-per-page', type=int, default=36)
+    parser.add_argument('--latency', type=float, default=0.0, help='средняя задержка ответа, с')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля ответов 503')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='доля ответов 429')
+    parser.add_argument('--retry-after', type=float, default=1.0, help='Retry-After для ответов 429, с')
+    parser.add_argument('--recorded', default=None, help='папка с сохраненными ответами')
+    parser.add_argument('--cookie-rps', type=float, default=None, help='лимит запросов в секунду на набор куки')
+    parser.add_argument('--cookie-limit', type=int, default=None, help='всего запросов на набор куки до 403')
+    parser.add_argument('--seller-latency', type=float, default=0.0, help='доп. задержка страницы продавца, с')
+    parser.add_argument('--subcategories', type=int, default=0,
+                        help='подкатегорий у каждой категории (страниц в категории - --pages на каждую подкатегорию)')
+    parser.add_argument('--http2', action='store_true', help='HTTP/2 без TLS (prior knowledge) вместо HTTP/1.1')
+    return parser.parse_args()
+
+
+def config_from_args(args: argparse.Namespace) -> OzonStubConfig:
+    config = OzonStubConfig(items_per_page=args.items_per_page, latency=args.latency, error_rate=args.error_rate,
+                            rate_429=args.rate_429, retry_after=args.retry_after, recorded_dir=args.recorded,
+                            cookie_rps=args.cookie_rps, cookie_limit=args.cookie_limit,
+                            subcategories=args.subcategories, seller_latency=args.seller_latency)
+    if args.pages:
+        config.categories = {category: args.pages for category in config.categories}
+    return config
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    stub = make_ozon_stub(config_from_args(args), args.host, args.port, args.http2)
+    print(f'stub seller: {stub_seller_url(stub.server_address)}', flush=True)
+    try:
+        stub.serve_forever()
+    except KeyboardInterrupt:
+        print(dict(stub.counters))
@@ -0,0 +1,325 @@
+import hashlib
+import json
+import sqlite3
+import time
+import uuid
+import zlib
+from pathlib import Path
+from pydantic import BaseModel, Field
+
+
+# расположение и ограничения дискового кэша ответов
+CACHE_PATH = Path(__file__).parent / "cache" / "responses.sqlite"
+CACHE_TTL = 15 * 60
+CACHE_MAX_BYTES = 512 * 2 ** 20
+# незавершенный запуск можно продолжить (--resume) в течение этого времени, потом он закрывается
+# и его ответы удаляются по TTL
+RESUME_TTL = 24 * 60 * 60
+# отметки использования ответов копятся в памяти и записываются пачками короткими транзакциями:
+# чтение из кэша не держит блокировку записи (базу могут использовать несколько процессов)
+ACCESS_FLUSH_EVERY = 200
+# карта категорий продавца меняется редко: в пределах TTL страница продавца не запрашивается,
+# после - карта используется сразу и проверяется в фоне условным запросом
+CATEGORIES_PATH = Path(__file__).parent / "cache" / "categories.sqlite"
+CATEGORIES_TTL = 24 * 60 * 60
+# отпечатки страниц выдачи и извлеченные из них поля; страницы, не встречавшиеся дольше TTL, удаляются
+PAGES_PATH = Path(__file__).parent / "cache" / "pages.sqlite"
+PAGES_TTL = 7 * 24 * 60 * 60
+# изменения отпечатков фиксируются пачками, а не на каждой странице
+PAGES_COMMIT_EVERY = 200
+
+
+def make_cache_key(url: str, params: dict | None) -> str:
+    """
+    Ключ кэша: адрес (домен) + нормализованные параметры запроса
+    """
+    normalized = sorted((str(key), str(value)) for key, value in (params or {}).items())
+    raw = json.dumps([url, normalized], ensure_ascii=False)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    Дисковый кэш ответов в SQLite с TTL и вытеснением давно не использованных записей по общему размеру
+    """
+
+    def __init__(self, path: Path = CACHE_PATH, ttl: float = CACHE_TTL, max_bytes: int = CACHE_MAX_BYTES,
+                 resume_ttl: float = RESUME_TTL):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY, run_id TEXT, body BLOB, size INTEGER, created REAL, accessed REAL
+            );
+            CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+            CREATE INDEX IF NOT EXISTS responses_run ON responses (run_id);
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id TEXT PRIMARY KEY, seller_id TEXT, started REAL, finished REAL
+            );
+        ''')
+        now = time.time()
+        # запуски, прерванные слишком давно, продолжать не будут - закрываем их
+        self._db.execute('UPDATE runs SET finished = ? WHERE finished IS NULL AND started < ?',
+                         (now, now - resume_ttl))
+        # устаревшие ответы завершенных запусков больше не нужны
+        self._db.execute('''
+            DELETE FROM responses WHERE created < ?
+            AND run_id NOT IN (SELECT run_id FROM runs WHERE finished IS NULL)
+        ''', (now - ttl,))
+        # как и завершенные запуски, от которых не осталось ответов
+        self._db.execute('''
+            DELETE FROM runs WHERE finished IS NOT NULL AND run_id NOT IN (SELECT run_id FROM responses)
+        ''')
+        self._db.commit()
+        self._total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        # ключ -> время последнего использования, еще не записанное в базу
+        self._accessed = {}
+
+    def start_run(self, seller_id: str, resume: bool = False) -> 'CacheRun':
+        """
+        Начало запуска; при resume продолжается последний незавершенный запуск продавца
+        """
+        if resume:
+            row = self._db.execute('''
+                SELECT run_id FROM runs WHERE seller_id = ? AND finished IS NULL ORDER BY started DESC LIMIT 1
+            ''', (seller_id,)).fetchone()
+            if row is not None:
+                return CacheRun(self, row[0], resumed=True)
+        run_id = uuid.uuid4().hex
+        self._db.execute('INSERT INTO runs (run_id, seller_id, started) VALUES (?, ?, ?)',
+                         (run_id, seller_id, time.time()))
+        self._db.commit()
+        return CacheRun(self, run_id, resumed=False)
+
+    def finish_run(self, run_id: str):
+        self._db.execute('UPDATE runs SET finished = ? WHERE run_id = ?', (time.time(), run_id))
+        self._db.commit()
+
+    def get(self, key: str, run_id: str) -> bytes | None:
+        """
+        Ответ из кэша: свежий по TTL или сохраненный в рамках того же запуска (для продолжения)
+        """
+        now = time.time()
+        row = self._db.execute('''
+            SELECT body FROM responses WHERE key = ? AND (created >= ? OR run_id = ?)
+        ''', (key, now - self.ttl, run_id)).fetchone()
+        if row is None:
+            return None
+        self._accessed[key] = now
+        if len(self._accessed) >= ACCESS_FLUSH_EVERY:
+            self.flush_accessed()
+        return row[0]
+
+    def flush_accessed(self):
+        """
+        Запись накопленных отметок использования одной транзакцией
+        """
+        self._write_accessed()
+        self._db.commit()
+
+    def _write_accessed(self):
+        if self._accessed:
+            self._db.executemany('UPDATE responses SET accessed = ? WHERE key = ?',
+                                 [(accessed, key) for key, accessed in self._accessed.items()])
+            self._accessed.clear()
+
+    def set(self, key: str, run_id: str, body: bytes):
+        now = time.time()
+        old = self._db.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+        self._db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                         (key, run_id, body, len(body), now, now))
+        self._total += len(body) - (old[0] if old else 0)
+        if self._total > self.max_bytes:
+            self.evict()
+        self._db.commit()
+
+    def evict(self):
+        """
+        Вытеснение давно не использованных ответов, пока общий размер не уложится в лимит
+        """
+        # вытеснение идет по времени использования, поэтому сначала записываем накопленные отметки
+        self._write_accessed()
+        while self._total > self.max_bytes:
+            rows = self._db.execute('SELECT key, size FROM responses ORDER BY accessed LIMIT 100').fetchall()
+            if not rows:
+                self._total = 0
+                break
+            self._db.executemany('DELETE FROM responses WHERE key = ?', [(key,) for key, _ in rows])
+            self._total -= sum(size for _, size in rows)
+
+    def close(self):
+        self._write_accessed()
+        self._db.commit()
+        self._db.close()
+
+
+class CacheRun:
+    """
+    Кэш в рамках одного запуска сбора по продавцу
+    """
+
+    def __init__(self, cache: ResponseCache, run_id: str, resumed: bool):
+        self.cache = cache
+        self.run_id = run_id
+        self.resumed = resumed
+
+    def get(self, url: str, params: dict | None) -> bytes | None:
+        return self.cache.get(make_cache_key(url, params), self.run_id)
+
+    def set(self, url: str, params: dict | None, body: bytes):
+        self.cache.set(make_cache_key(url, params), self.run_id, body)
+
+    def finish(self):
+        self.cache.finish_run(self.run_id)
+
+
+class CachedCategories(BaseModel):
+    """
+    Сохраненная карта категорий продавца с валидаторами для условного запроса
+    """
+    categories: list[dict] = Field(description='Плоский список categoryFilter.categories')
+    etag: str | None = Field(default=None, description='ETag страницы продавца')
+    last_modified: str | None = Field(default=None, description='Last-Modified страницы продавца')
+    checked: float = Field(description='Когда карта последний раз получена или подтверждена (304)')
+
+    def is_fresh(self, ttl: float) -> bool:
+        return time.time() - self.checked < ttl
+
+    def conditional_headers(self) -> dict:
+        """
+        Заголовки условного запроса: сервер ответит 304, если страница не изменилась
+        """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class CategoryCache:
+    """
+    Карты категорий продавцов в SQLite: повторные запуски начинают обход страниц сразу,
+    не дожидаясь самого тяжелого запроса - html страницы продавца
+    """
+
+    def __init__(self, path: Path = CATEGORIES_PATH, ttl: float = CATEGORIES_TTL):
+        self.ttl = ttl
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS categories (
+                seller_id TEXT PRIMARY KEY, data TEXT, etag TEXT, last_modified TEXT, checked REAL
+            )
+        ''')
+        self._db.commit()
+
+    def get(self, seller_id: str) -> CachedCategories | None:
+        row = self._db.execute('''
+            SELECT data, etag, last_modified, checked FROM categories WHERE seller_id = ?
+        ''', (seller_id,)).fetchone()
+        if row is None:
+            return None
+        return CachedCategories(categories=json.loads(row[0]), etag=row[1], last_modified=row[2], checked=row[3])
+
+    def set(self, seller_id: str, categories: list[dict], validators: dict = None):
+        validators = validators or {}
+        self._db.execute('INSERT OR REPLACE INTO categories VALUES (?, ?, ?, ?, ?)',
+                         (seller_id, json.dumps(categories, ensure_ascii=False), validators.get('etag'),
+                          validators.get('last-modified'), time.time()))
+        self._db.commit()
+
+    def touch(self, seller_id: str):
+        """
+        Карта подтверждена сервером (304) - продлеваем ее свежесть
+        """
+        self._db.execute('UPDATE categories SET checked = ? WHERE seller_id = ?', (time.time(), seller_id))
+        self._db.commit()
+
+    def close(self):
+        self._db.commit()
+        self._db.close()
+
+
+def page_digest(items_state: str | bytes, schema: str = '') -> str:
+    """
+    Отпечаток состояния виджета товаров страницы (строка json как есть, без разбора) вместе с версией
+    извлекаемых полей: после изменения разбора прежние строки страницы не совпадают по отпечатку
+    """
+    if isinstance(items_state, str):
+        items_state = items_state.encode()
+    digest = hashlib.blake2b(schema.encode(), digest_size=16)
+    digest.update(items_state)
+    return digest.hexdigest()
+
+
+class PageFingerprints:
+    """
+    Отпечатки страниц выдачи по продавцу, категории и номеру страницы вместе с извлеченными полями:
+    страница, не изменившаяся с прошлого запуска, не разбирается заново.
+    Новые строки и отметки использования копятся в памяти и записываются пачками короткими транзакциями
+    """
+
+    def __init__(self, path: Path = PAGES_PATH, ttl: float = PAGES_TTL):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS pages (
+                seller_id TEXT, category TEXT, page INTEGER, digest TEXT, rows BLOB, updated REAL,
+                PRIMARY KEY (seller_id, category, page)
+            )
+        ''')
+        self._db.execute('DELETE FROM pages WHERE updated < ?', (time.time() - ttl,))
+        self._db.commit()
+        # (продавец, категория, страница) -> (отпечаток, сжатые строки), еще не записанные в базу
+        self._pending = {}
+        # (продавец, категория, страница) -> время использования сохраненных строк
+        self._touched = {}
+
+    def get(self, seller_id: str, category: str, page: int, digest: str) -> dict | None:
+        """
+        Сохраненные поля страницы, если ее отпечаток не изменился
+        """
+        key = (seller_id, category, page)
+        if key in self._pending:
+            pending_digest, rows = self._pending[key]
+        else:
+            row = self._db.execute('''
+                SELECT digest, rows FROM pages WHERE seller_id = ? AND category = ? AND page = ?
+            ''', key).fetchone()
+            if row is None:
+                return None
+            pending_digest, rows = row
+            if pending_digest == digest:
+                self._touched[key] = time.time()
+                self._changed()
+        if pending_digest != digest:
+            return None
+        return json.loads(zlib.decompress(rows))
+
+    def set(self, seller_id: str, category: str, page: int, digest: str, stored: dict):
+        rows = zlib.compress(json.dumps(stored, ensure_ascii=False).encode())
+        self._pending[(seller_id, category, page)] = (digest, rows)
+        self._changed()
+
+    def _changed(self):
+        if len(self._pending) + len(self._touched) >= PAGES_COMMIT_EVERY:
+            self.commit()
+
+    def commit(self):
+        if not self._pending and not self._touched:
+            return
+        now = time.time()
+        with self._db:
+            self._db.executemany('UPDATE pages SET updated = ? WHERE seller_id = ? AND category = ? AND page = ?',
+                                 [(updated, *key) for key, updated in self._touched.items()])
+            self._db.executemany('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)',
+                                 [(*key, digest, rows, now) for key, (digest, rows) in self._pending.items()])
+        self._pending.clear()
+        self._touched.clear()
+
+    def close(self):
+        self.commit()
+        self._db.close()
@@ -1,14 +1,23 @@
-import json
+import hashlib
+import html
+import logging
+import re
 import traceback
 import datetime
-import pandas as pd
-import numpy as np
-from bs4 import BeautifulSoup
+from typing import TYPE_CHECKING
 from pydantic import BaseModel, HttpUrl, model_validator
 from errors import InputValidationError
+from decoder import loads, decode_items_state
+from extractor import ItemExtractor, ITEM_FIELDS
 import os
 from pathlib import Path
 
+# pandas и numpy импортируются при первой сборке дата-фрейма: запуск и сетевая часть сбора их не ждут
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
 
 class URLModel(BaseModel):
     """
@@ -24,14 +33,6 @@ class URLModel(BaseModel):
         return self
 
 
-def generate_list_pages(from_: int, to_: int, chunk_size: int) -> [int]:
-    """
-    Генерация списка запросов
-    """
-    numbers = list(range(from_, to_))
-    return [numbers[i:i + chunk_size] for i in range(0, len(numbers), chunk_size)]
-
-
 def cookies_str_to_dict(cookies_str: str) -> dict:
     """
     Конвертация куки в формат словаря
@@ -47,19 +48,6 @@ def cookies_str_to_dict(cookies_str: str) -> dict:
         return {}
 
 
-def change_category_in_url(url: str, category: str) -> str | bool:
-    """
-    Изменение категории в переменной адреса
-    """
-    url_splitted = url.split('/')
-    url_splitted.pop(5)
-    url_splitted.insert(5, category)
-    url_str = ''
-    for i in url_splitted:
-        url_str += i + '/'
-    return url_str[:-1]
-
-
 def check_domain_in_url(url: str):
     """
     Извлечение домена
@@ -76,9 +64,9 @@ def get_seller_id_from_url(url: str) -> str | bool:
     return url_splitted[4]
 
 
-def edit_get_items_list(data: dict) -> list | bool | None:
+def edit_get_items_state(data: dict) -> str | bool | None:
     """
-    Первичное редактирование (извлечение) сырых данных по товарам + проверка на успешный сбор
+    Состояние виджета товаров страницы как есть (строка json) + проверка на успешный сбор
     """
     # проверка на успешный сбор
     success = data.get('layout')
@@ -86,64 +74,185 @@ def edit_get_items_list(data: dict) -> list | bool | None:
         return None
     try:
         key_data = data['layout'][0]['stateId']
-        items_str = data['widgetStates'][key_data]
-        items_object = json.loads(items_str)
-        items_list = items_object['items']
-        return items_list
+        return data['widgetStates'][key_data]
+    except Exception:
+        traceback.print_exc()
+        return False
+
+
+def edit_get_items_list(data: dict) -> list | bool | None:
+    """
+    Первичное редактирование (извлечение) сырых данных по товарам + проверка на успешный сбор
+    """
+    items_str = edit_get_items_state(data)
+    if items_str is None or items_str is False:
+        return items_str
+    try:
+        # декодируем только нужное состояние виджета, остальные остаются строками
+        return decode_items_state(items_str)
     except Exception:
         traceback.print_exc()
         return False
 
 
-def edit_items_to_df(main_items_dict: dict, llc_info: str, seller_id: str) -> pd.DataFrame | bool:
+def edit_paging_info(data: dict) -> tuple[bool | None, int | None]:
+    """
+    Извлечение данных пагинации из ответа: (есть ли следующая страница, всего страниц)
+    """
+    has_next, total_pages = None, None
+    try:
+        if 'nextPage' in data:
+            has_next = bool(data.get('nextPage'))
+        # ищем виджет пагинатора среди состояний страницы
+        for key, state_str in data.get('widgetStates', {}).items():
+            if 'aginator' not in key:
+                continue
+            state = loads(state_str)
+            if 'nextPage' in state:
+                has_next = bool(state.get('nextPage'))
+            total = state.get('totalPages') or state.get('pagesCount')
+            if total:
+                total_pages = int(total)
+    except Exception:
+        pass
+    return has_next, total_pages
+
+
+# блок страницы продавца, в атрибуте data-state которого лежит дерево категорий
+CATEGORIES_ELEMENT_ID = 'state-filtersDesktop-3124459-default-1'
+# имя тега и атрибуты тега для быстрого сканирования html
+TAG_NAME_PATTERN = re.compile(r'<[A-Za-z][^\s/>]*')
+ATTRIBUTE_PATTERN = re.compile(r'\s+([^\s=/>]+)(?:\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+)))?')
+
+# колонки итогового отчета
+REPORT_COLUMNS = ['shop', 'datetime', 'price_reg', 'price_promo', 'article', 'name', 'category_path',
+                  'rating', 'reviews', 'delivery', 'badges']
+# извлеченные из страницы колонки отчета и их типы (остальные колонки задает запуск)
+STORED_COLUMNS = {'price_reg': 'Int64', 'price_promo': 'Int64', 'article': 'string', 'name': 'string',
+                  'rating': 'Float64', 'reviews': 'Int64', 'delivery': 'string', 'badges': 'string'}
+# символы, удаляемые из текста цены перед преобразованием в число
+PRICE_JUNK_PATTERN = '[₽₾\u2009 ]'
+# версия сохраненных полей: при изменении описаний полей, колонок или разбора цен
+# строки, сохраненные прежним разбором, не используются
+STORED_SCHEMA = hashlib.blake2b(repr((STORED_COLUMNS, ITEM_FIELDS, PRICE_JUNK_PATTERN)).encode(),
+                                digest_size=8).hexdigest()
+
+
+def edit_items_to_columns(main_items_dict: dict, extractor: ItemExtractor = None) -> dict[str, list]:
+    """
+    Извлечение сырых полей товаров за один проход в заранее подготовленные списки-колонки
+    (поля mainState описаны декларативно в extractor.ITEM_FIELDS)
+    """
+    if extractor is None:
+        extractor = ItemExtractor()
+    columns = {'article': [], 'category_path': [], **{field: [] for field in extractor.fields}}
+    article_col, cat_col = columns['article'], columns['category_path']
+    field_cols = [columns[field] for field in extractor.fields]
+    extract = extractor.extract
+    # перебор категорий с подготовленными списками словарей
+    for name_cat, items_list in main_items_dict.items():
+        # перебор товаров
+        for item in items_list:
+            # один проход по блокам товара: цены (текстом, очистка далее векторно), наименование и прочие поля
+            for column, value in zip(field_cols, extract(item.get('mainState'))):
+                column.append(value)
+            # определение артикула
+            article_col.append(item.get('skuId'))
+            cat_col.append(name_cat)
+    return columns
+
+
+def edit_prices(prices: 'pd.Series') -> 'pd.Series':
     """
-    Финальный сбор данных в дата-фрейм с сортировкой
+    Векторная очистка цен ('1 234,5 ₽' -> 1234) в целочисленную колонку с пропусками
     """
+    import numpy as np
+    import pandas as pd
+    cleaned = prices.astype('string').str.replace(PRICE_JUNK_PATTERN, '', regex=True).str.replace(',', '.')
+    return np.trunc(pd.to_numeric(cleaned, errors='coerce')).astype('Int64')
+
+
+def edit_numbers(texts: 'pd.Series', dtype: str) -> 'pd.Series':
+    """
+    Векторное извлечение первого числа из текста ('4,9' -> 4.9, '1 234 отзыва' -> 1234)
+    """
+    import pandas as pd
+    cleaned = texts.astype('string').str.replace(PRICE_JUNK_PATTERN, '', regex=True).str.replace(',', '.')
+    return pd.to_numeric(cleaned.str.extract(r'(\d+(?:\.\d+)?)', expand=False), errors='coerce').astype(dtype)
+
+
+def edit_items_to_df(main_items_dict: dict, llc_info: str, seller_id: str, dt: str = None,
+                     sort: bool = True) -> 'pd.DataFrame | bool':
+    """
+    Финальный сбор данных в дата-фрейм с сортировкой (колонки строятся целиком, без построчных вставок)
+    """
+    import pandas as pd
     # формирование даты сбора
-    dt = str(datetime.datetime.now().replace(microsecond=0))
-    # создание дата-фрейма с нужными полями
-    df = pd.DataFrame({'shop': [], 'datetime': [], 'price_reg': [], 'price_promo': [],
-                       'article': [], 'name': [], 'category_path': []})
+    if dt is None:
+        dt = str(datetime.datetime.now().replace(microsecond=0))
+    # в случае если не были собраны данные по ЮЛ, вставляем идентификатор продавца
+    if llc_info == False:
+        llc_info = seller_id
     try:
-        # перебор категорий с подготовленными списками словарей
-        for name_cat, items_list in main_items_dict.items():
-            # перебор товаров
-            for item in items_list:
-                # определение артикула
-                article = item.get('skuId')
-                main_state = item.get('mainState')
-                price_promo, price_reg, name = None, None, None
-                try:
-
-                    # перебор нужных данных для извлечения цен
-                    for row in main_state:
-                        if row.get('id') == 'atom':
-                            prices_data = row['atom']['priceV2']['price']
-                            # редактирование для нужного формата целого числа
-                            maketrans = str.maketrans({'₽': '', '₾': '', '\u2009': '', ' ': '', ',': '.'})
-                            price_promo = int(float(prices_data[0]['text'].translate(maketrans)))
-                            price_reg = int(float(prices_data[1]['text'].translate(maketrans)))
-                            break
-                except Exception:
-                    pass
-                try:
-                    # перебор для извлечения наименования
-                    for row in main_state:
-                        if row.get('id') == 'name':
-                            name = row['atom']['textAtom']['text']
-                            break
-                except Exception:
-                    pass
-                # в случае если не были собраны данные по ЮЛ, вставляем идентификатор продавца
-                if llc_info == False:
-                    llc_info = seller_id
-                # добавляем строку с данными по товару
-                df.loc[len(df)] = [llc_info, dt, price_reg, price_promo, article, name, name_cat]
+        extractor = ItemExtractor()
+        columns = edit_items_to_columns(main_items_dict, extractor)
+        size = len(columns['article'])
+        # создание дата-фрейма с нужными полями и типами
+        df = pd.DataFrame({
+            'shop': pd.Categorical([llc_info] * size),
+            'datetime': pd.Series(pd.Timestamp(dt), index=range(size), dtype='datetime64[ns]'),
+            'price_reg': edit_prices(pd.Series(columns['price_reg'], dtype=object)),
+            'price_promo': edit_prices(pd.Series(columns['price_promo'], dtype=object)),
+            'article': pd.Series(columns['article'], dtype='string'),
+            'name': pd.Series(columns['name'], dtype='string'),
+            'category_path': pd.Categorical(columns['category_path']),
+            'rating': edit_numbers(pd.Series(columns['rating'], dtype=object), 'Float64'),
+            'reviews': edit_numbers(pd.Series(columns['reviews'], dtype=object), 'Int64'),
+            'delivery': pd.Series(columns['delivery'], dtype='string'),
+            'badges': pd.Series(columns['badges'], dtype='string'),
+        }, columns=REPORT_COLUMNS)
+        # промахи по полям едут вместе с дата-фреймом (в том числе из пула процессов) в метрики запуска
+        df.attrs['field_misses'] = dict(extractor.misses)
         # сортируем по категориям и цене
-        df = df.sort_values(by=['category_path', 'price_promo'], ascending=[True, False])
-        print(df.to_string())
+        if sort:
+            df = df.sort_values(by=['category_path', 'price_promo'], ascending=[True, False])
     except Exception:
+        traceback.print_exc()
+        return False
+    return df
+
+
+def edit_df_to_stored(df: 'pd.DataFrame') -> dict:
+    """
+    Извлеченные поля страницы для повторного использования (без полей запуска: магазин, дата, категория)
+    """
+    columns = {}
+    for column in STORED_COLUMNS:
+        series = df[column]
+        columns[column] = series.astype(object).where(series.notna(), None).tolist()
+    return {'columns': columns, 'misses': df.attrs.get('field_misses', {})}
+
+
+def edit_stored_to_df(stored: dict, name_cat: str, llc_info: str, seller_id: str,
+                      dt: str) -> 'pd.DataFrame | bool':
+    """
+    Дата-фрейм страницы из сохраненных полей (страница не изменилась с прошлого запуска).
+    Сохраненные строки без какой-либо из колонок не используются (False - страница разбирается заново)
+    """
+    import pandas as pd
+    columns = stored.get('columns', {})
+    if any(column not in columns for column in STORED_COLUMNS):
         return False
+    if llc_info == False:
+        llc_info = seller_id
+    size = len(columns['article'])
+    df = pd.DataFrame({
+        'shop': pd.Categorical([llc_info] * size),
+        'datetime': pd.Series(pd.Timestamp(dt), index=range(size), dtype='datetime64[ns]'),
+        'category_path': pd.Categorical([name_cat] * size),
+        **{column: pd.Series(columns[column], dtype=dtype) for column, dtype in STORED_COLUMNS.items()},
+    }, columns=REPORT_COLUMNS)
+    df.attrs['field_misses'] = dict(stored.get('misses', {}))
     return df
 
 
@@ -153,7 +262,7 @@ def edit_llc_info(data: dict) -> str | bool:
     """
     try:
         info_str = data['widgetStates']['textBlock-3252445-default-1']
-        info_object = json.loads(info_str)
+        info_object = loads(info_str)
         info = info_object['body'][0]['textAtom']['text']
         info_formatted = info.replace('<br>', ' ')
         return info_formatted
@@ -161,42 +270,70 @@ def edit_llc_info(data: dict) -> str | bool:
         return False
 
 
-def edit_categories(response_text: str) -> dict | bool:
+def find_attribute_fast(html_text: str, element_id: str, attribute: str) -> str | None:
     """
-    Редактируем категории
+    Поиск значения атрибута у элемента с заданным id прямым сканированием текста (без построения дерева)
     """
-    try:
-        soup = BeautifulSoup(response_text, "html.parser")
-        # находим нужный блок коде страницы
-        div = soup.find("div", {"id": "state-filtersDesktop-3124459-default-1"})
-        data_state = div.get("data-state")
+    for quote in ('"', "'"):
+        pos = html_text.find(f'id={quote}{element_id}{quote}')
+        if pos != -1:
+            break
+    else:
+        return None
+    # от начала тега перебираем атрибуты до его закрытия
+    index = html_text.rfind('<', 0, pos)
+    if index == -1:
+        return None
+    match = TAG_NAME_PATTERN.match(html_text, index)
+    if match is None:
+        return None
+    index = match.end()
+    while (match := ATTRIBUTE_PATTERN.match(html_text, index)) is not None:
+        if match.group(1).lower() == attribute:
+            value = match.group(2) if match.group(2) is not None else match.group(3)
+            if value is None:
+                value = match.group(4) or ''
+            return html.unescape(value)
+        index = match.end()
+    return None
+
+
+def find_attribute_soup(html_text: str, element_id: str, attribute: str) -> str | None:
+    """
+    Поиск значения атрибута через полный разбор страницы BeautifulSoup (запасной вариант)
+    """
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html_text, "html.parser")
+    div = soup.find("div", {"id": element_id})
+    return div.get(attribute) if div is not None else None
+
+
+def edit_categories_data(response_text: str) -> list[dict]:
+    """
+    Плоский список категорий продавца (categoryFilter.categories) из блока фильтров страницы
+    """
+    # находим нужный блок коде страницы: сначала быстрым сканированием, при неудаче полным разбором
+    parsed_data = None
+    for find_attribute in (find_attribute_fast, find_attribute_soup):
+        data_state = find_attribute(response_text, CATEGORIES_ELEMENT_ID, "data-state")
+        if not data_state:
+            continue
         data_state = data_state.replace("\'", '')
-        # загружаем текст как объект и берем нужный ключ
-        parsed_data = json.loads(data_state)
-        categories_data = parsed_data['sections'][0]['filters'][0]['categoryFilter']['categories']
-        cat_dict = {}
-        # перебираем категории которые являются основными
-        for category in categories_data:
-            if category['level'] == 0:
-                cat_dict[category['title']] = category['urlValue'].split('/')[3]
-        return cat_dict
-    except Exception:
-        traceback.print_exc()
-        return False
+        try:
+            # загружаем текст как объект
+            parsed_data = loads(data_state)
+            break
+        except Exception:
+            continue
+    # берем нужный ключ
+    return parsed_data['sections'][0]['filters'][0]['categoryFilter']['categories']
 
 
-def save_csv(df: pd.DataFrame, seller_id: str) -> bool:
+def get_report_path(seller_id: str, extension: str = 'csv') -> Path:
     """
-    Сохранение документа csv
+    Путь к файлу отчета (папка reports создается при необходимости)
     """
-    try:
-        # Создаем директорию для отчетов, если её нет
-        reports_dir = Path(__file__).parent / "reports"
-        reports_dir.mkdir(exist_ok=True)
-        
-        # Сохраняем отчет
-        df.to_csv(f'{reports_dir}/{seller_id}_{datetime.datetime.now().replace(microsecond=0)}.csv', index=False)
-        return True
-    except Exception as e:
-        print(f"Ошибка при сохранении CSV: {e}")
-        return False
+    # Создаем директорию для отчетов, если её нет
+    reports_dir = Path(__file__).parent / "reports"
+    reports_dir.mkdir(exist_ok=True)
+    return reports_dir / f'{seller_id}_{datetime.datetime.now().replace(microsecond=0)}.{extension}'
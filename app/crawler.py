@@ -0,0 +1,314 @@
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING
+from pydantic import BaseModel, Field
+from common import edit_get_items_list, edit_paging_info
+from requests_handler import send_request, RequestContext
+from errors import GetDataError
+from cache import CacheRun
+from metrics import current_metrics, stage_timer
+from parsing import PageParser
+from sharding import CategoryTree, Shard, SHARD_PAGES
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# общий бюджет одновременных запросов на все категории продавца
+CRAWL_CONCURRENCY = 12
+# границы и стартовое значение числа страниц, запрашиваемых за раз в одной категории
+# (после первой страницы: она запрашивается одна, чтобы узнать число страниц из пагинации)
+CHUNK_START = 3
+CHUNK_MIN = 1
+CHUNK_MAX = 8
+# целевое время ответа пачки страниц, выше которого пачка уменьшается
+CHUNK_LATENCY_TARGET = 2.0
+# сколько разобранных страниц может ждать записи (ограничивает потребление памяти)
+PIPELINE_QUEUE_PAGES = 8
+# страховочный предел страниц на категорию (если ответы не содержат данных пагинации)
+MAX_PAGES = 500
+
+
+class CrawlStats(BaseModel):
+    """
+    Статистика сбора за запуск
+    """
+    pages_requested: int = Field(default=0, description='Всего запрошено страниц')
+    pages_with_items: int = Field(default=0, description='Страниц, на которых были товары')
+    pages_failed: int = Field(default=0, description='Страниц, не полученных после всех повторов или не разобранных')
+    items: int = Field(default=0, description='Собрано товаров')
+    duplicates: int = Field(default=0, description='Отброшено повторов товаров')
+    early_stops: int = Field(default=0, description='Категорий, остановленных на странице из одних повторов')
+    shards: list[Shard] = Field(default=[], description='Разделенные категории и их подкатегории')
+    fingerprint_hits: int = Field(default=0, description='Страниц, не изменившихся с прошлого запуска')
+    fingerprint_misses: int = Field(default=0, description='Страниц, разобранных заново (новых или изменившихся)')
+
+    def summary(self) -> str:
+        return (f'PAGES requested: {self.pages_requested}, with items: {self.pages_with_items}, '
+                f'failed: {self.pages_failed}, '
+                f'items: {self.items}, duplicates: {self.duplicates}, early stops: {self.early_stops}, '
+                f'shards: {sum(shard.depth > 0 for shard in self.shards)}, '
+                f'unchanged pages: {self.fingerprint_hits}/{self.fingerprint_hits + self.fingerprint_misses}')
+
+    def shards_summary(self) -> str:
+        """
+        Товары по шардам разделенных категорий (у самой категории - только страницы до разделения)
+        """
+        return '; '.join(f'{shard.category}/{shard.slug}: {shard.items}'
+                         f'{f" (разделена, {shard.total_pages} стр.)" if shard.split else ""}'
+                         for shard in self.shards)
+
+
+class SkuDedup:
+    """
+    Множество уже собранных товаров продавца (по всем категориям и страницам).
+    Числовые skuId хранятся целыми числами, остальные - хэшами, чтобы не держать строки в памяти
+    """
+
+    def __init__(self):
+        self._seen = set()
+
+    @staticmethod
+    def key(sku_id) -> int | None:
+        """
+        Ключ товара в множестве; None - у товара нет skuId (None, NA дата-фрейма, пустая строка)
+        """
+        if not isinstance(sku_id, (int, str)) or sku_id == '':
+            return None
+        if isinstance(sku_id, int):
+            return sku_id
+        if isinstance(sku_id, str) and sku_id.isdigit():
+            return int(sku_id)
+        return hash(sku_id)
+
+    def fresh_mask(self, sku_ids) -> list[bool]:
+        """
+        Отметки товаров, которых еще не было (повторы внутри страницы тоже отбрасываются).
+        Товары без skuId не с чем сравнить, они проходят всегда
+        """
+        mask = []
+        for sku_id in sku_ids:
+            key = self.key(sku_id)
+            if key is None:
+                mask.append(True)
+                continue
+            fresh = key not in self._seen
+            if fresh:
+                self._seen.add(key)
+            mask.append(fresh)
+        return mask
+
+    def filter(self, items_list: 'list | pd.DataFrame') -> 'list | pd.DataFrame':
+        """
+        Товары страницы, которых еще не было: список словарей или дата-фрейм, разобранный в пуле процессов
+        """
+        if isinstance(items_list, list):
+            mask = self.fresh_mask(item.get('skuId') for item in items_list)
+            return [item for item, fresh in zip(items_list, mask) if fresh]
+        mask = self.fresh_mask(items_list['article'].tolist())
+        return items_list if all(mask) else items_list[mask]
+
+
+def next_chunk_size(chunk_size: int, elapsed: float) -> int:
+    """
+    Подстройка размера пачки под задержку: плавный рост при быстрых ответах, двукратное снижение при медленных
+    """
+    if elapsed <= CHUNK_LATENCY_TARGET:
+        return min(chunk_size + 1, CHUNK_MAX)
+    return max(chunk_size // 2, CHUNK_MIN)
+
+
+async def fetch_page(semaphore: asyncio.Semaphore, params: dict, context: RequestContext, cache: CacheRun = None,
+                     raw: bool = False) -> tuple:
+    """
+    Запрос одной страницы в рамках общего бюджета параллельности: ответ и время запроса
+    (без ожидания места в общем бюджете, иначе очередь других категорий уменьшала бы пачку)
+    """
+    async with semaphore:
+        started = time.monotonic()
+        response = await send_request(params=params, context=context, cache=cache, raw=raw)
+        return response, time.monotonic() - started
+
+
+async def iter_category_pages(context: RequestContext, url_cat: str, semaphore: asyncio.Semaphore,
+                              stats: CrawlStats, cache: CacheRun = None, dedup: SkuDedup = None,
+                              name_cat: str = None, parser: PageParser = None, shard: Shard = None,
+                              shard_pages: int = None):
+    """
+    Асинхронный генератор списков товаров по страницам одной категории.
+    Число страниц берется из данных пагинации ответа, если их нет - определяется пробными запросами
+    до первой пустой страницы. При переданном dedup повторы товаров отбрасываются, а страница
+    из одних повторов после уже отданных считается признаком конца категории (выдача сдвинулась
+    или сервер повторяет последнюю страницу).
+    При переданном parser страницы пачки разбираются в пуле процессов (или сверяются с отпечатками
+    прошлого запуска) и вместо списков товаров отдаются готовые дата-фреймы категории name_cat.
+    При переданном shard в нем копятся счетчики обхода, а категория с подкатегориями, в выдаче
+    которой больше shard_pages страниц, после первой страницы помечается разделенной (дальше ее обходят подкатегории)
+    """
+    yielded = False
+    # шаблон параметров категории, для каждой страницы меняется только номер
+    category_params = context.category_params(url_cat)
+    page, chunk_size, last_page = 1, CHUNK_START, MAX_PAGES
+    while page <= last_page:
+        # первая страница запрашивается одна: до ее данных пагинации число страниц неизвестно,
+        # дальше не запрашиваем страницы за известной границей
+        chunk = list(range(page, min(page + (chunk_size if page > 1 else 1), last_page + 1)))
+        # формируем параметры запросов
+        params_list = [context.page_params(category_params, page_num) for page_num in chunk]
+        # создание и получение данных асинхронно с замером задержки пачки (по самому долгому запросу)
+        tasks = (fetch_page(semaphore, params, context, cache, raw=parser is not None) for params in params_list)
+        fetched = await asyncio.gather(*tasks)
+        responses_list = [response for response, _ in fetched]
+        if page > 1:
+            chunk_size = next_chunk_size(chunk_size, max(elapsed for _, elapsed in fetched))
+        stats.pages_requested += len(chunk)
+        # проверка есть ли хоть в 1 запросе данные
+        if all(response.status is False for response in responses_list):
+            raise GetDataError()
+        if parser is not None:
+            # страницы пачки разбираются в пуле одновременно, цикл событий только ждет результаты
+            parsed_list = await asyncio.gather(*(parser.parse(response.object, name_cat, url_cat, page_num)
+                                                 for page_num, response in zip(chunk, responses_list)
+                                                 if response.status))
+            parsed_pages = iter(parsed_list)
+        # разбираем страницы по порядку
+        for page_num, response in zip(chunk, responses_list):
+            # неуспешный запрос не считаем концом категории, но обход уже неполный
+            if not response.status:
+                stats.pages_failed += 1
+                continue
+            if parser is not None:
+                parsed = next(parsed_pages)
+                items_list, has_next, total_pages = parsed.frame, parsed.has_next, parsed.total_pages
+                if parsed.reused is not None:
+                    if parsed.reused:
+                        stats.fingerprint_hits += 1
+                    else:
+                        stats.fingerprint_misses += 1
+            else:
+                with stage_timer('json'):
+                    items_list = edit_get_items_list(response.object)
+                has_next, total_pages = edit_paging_info(response.object)
+            # пустая страница - конец категории
+            if items_list is None:
+                return
+            # ошибка разбора - страница без товаров (дата-фрейм нельзя проверять на истинность, поэтому len)
+            if items_list is False:
+                stats.pages_failed += 1
+                items_list = []
+            if len(items_list) and dedup is not None:
+                fresh = dedup.filter(items_list)
+                stats.duplicates += len(items_list) - len(fresh)
+                if not len(fresh) and yielded:
+                    stats.early_stops += 1
+                    return
+                items_list = fresh
+            if len(items_list):
+                stats.pages_with_items += 1
+                stats.items += len(items_list)
+                if shard is not None:
+                    shard.pages += 1
+                    shard.items += len(items_list)
+                yielded = True
+                yield items_list
+            # уточняем границу по данным пагинации
+            if total_pages:
+                last_page = min(total_pages, MAX_PAGES)
+                if shard is not None and shard.total_pages is None:
+                    shard.total_pages = total_pages
+                    if shard.children and shard_pages and total_pages > shard_pages:
+                        # дочитываем уже полученную пачку, остальное обойдут подкатегории
+                        shard.split = True
+                    elif total_pages > MAX_PAGES:
+                        logger.warning(f'категория {name_cat}/{url_cat}: {total_pages} страниц без деления '
+                                       f'на подкатегории, собираются первые {MAX_PAGES}')
+                if shard is not None and shard.split:
+                    last_page = chunk[-1]
+            if has_next is False:
+                last_page = page_num
+            if page_num >= last_page:
+                return
+        page = chunk[-1] + 1
+
+
+async def iter_pages(context: RequestContext, categories_list: dict, concurrency: int = CRAWL_CONCURRENCY,
+                     stats: CrawlStats = None, queue_size: int = PIPELINE_QUEUE_PAGES, cache: CacheRun = None,
+                     parser: PageParser = None, tree: CategoryTree = None, shard_pages: int = SHARD_PAGES):
+    """
+    Асинхронный генератор пар (категория, список товаров страницы) по всем категориям сразу.
+    Категории обходятся параллельно под общим семафором, ограниченная очередь держит в памяти
+    лишь несколько страниц и притормаживает сбор, если обработка не успевает.
+    Повторы товаров отбрасываются по всему продавцу.
+    При переданном parser вместо списков товаров идут дата-фреймы страниц, разобранные в пуле процессов.
+    При переданном дереве категорий большие категории (больше shard_pages страниц) делятся на подкатегории,
+    которые обходятся параллельно, а их товары идут под исходной категорией
+    """
+    if stats is None:
+        stats = CrawlStats()
+    dedup = SkuDedup()
+    semaphore = asyncio.Semaphore(concurrency)
+    queue = asyncio.Queue(maxsize=queue_size)
+    finished = object()
+
+    metrics = current_metrics()
+
+    async def produce(name_cat: str, url_cat: str, depth: int = 0):
+        children = tree.subcategories(url_cat) if tree is not None and shard_pages else []
+        shard = Shard(category=name_cat, slug=url_cat, depth=depth, children=children)
+        async for items_list in iter_category_pages(context, url_cat, semaphore, stats, cache, dedup,
+                                                    name_cat, parser, shard, shard_pages):
+            if metrics is not None:
+                metrics.pages_per_category[name_cat] += 1
+            await queue.put((name_cat, items_list))
+        if depth or shard.split:
+            stats.shards.append(shard)
+        if shard.split:
+            # подкатегории обходятся параллельно (и сами делятся, если велики), повторы с уже
+            # собранными страницами категории отбрасывает общий dedup
+            await asyncio.gather(*(produce(name_cat, child, depth + 1) for child in shard.children))
+
+    async def produce_all():
+        tasks = [asyncio.create_task(produce(name_cat, url_cat)) for name_cat, url_cat in categories_list.items()]
+        cancelled = False
+        try:
+            await asyncio.gather(*tasks)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            # при ошибке одной категории останавливаем остальные
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # отмена приходит, когда потребитель закрыл генератор: ждать места в очереди для признака
+            # конца некому (очередь больше не читается)
+            if not cancelled:
+                await queue.put(finished)
+
+    producer = asyncio.create_task(produce_all())
+    try:
+        while (page := await queue.get()) is not finished:
+            yield page
+        # пробрасываем ошибку сбора, если она была
+        await producer
+    finally:
+        # при закрытии генератора дожидаемся остановки обхода, чтобы запросы не шли после выхода
+        producer.cancel()
+        await asyncio.gather(producer, return_exceptions=True)
+
+
+async def crawl_categories(context: RequestContext, categories_list: dict,
+                           concurrency: int = CRAWL_CONCURRENCY, stats: CrawlStats = None,
+                           cache: CacheRun = None, tree: CategoryTree = None,
+                           shard_pages: int = SHARD_PAGES) -> dict:
+    """
+    Параллельный обход всех категорий продавца с накоплением сырых данных в словаре
+    """
+    # сохраняем порядок категорий как на странице продавца
+    main_items_dict = {name_cat: [] for name_cat in categories_list}
+    async for name_cat, items_list in iter_pages(context, categories_list, concurrency, stats, cache=cache,
+                                                 tree=tree, shard_pages=shard_pages):
+        main_items_dict[name_cat].extend(items_list)
+    return main_items_dict
@@ -0,0 +1,304 @@
+import argparse
+import asyncio
+import json
+import logging
+import random
+import sqlite3
+import time
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+from main import setup_logging
+from batch import scrape_seller, SellerResult
+from cache import ResponseCache, CACHE_TTL, CategoryCache, PageFingerprints
+from requests_handler import CLIENT_POOL
+from writers import REPORT_FORMATS
+from snapshots import SnapshotStore, SNAPSHOTS_PATH
+from sessions import SessionPool, SESSION_STRATEGIES
+
+logger = logging.getLogger(__name__)
+
+# расположение очереди заданий и расписаний
+DAEMON_DB_PATH = Path(__file__).parent / "daemon.sqlite"
+# адрес http api
+DAEMON_HOST = '127.0.0.1'
+DAEMON_PORT = 8765
+# продавцов, собираемых одновременно
+DAEMON_WORKERS = 2
+# как часто проверяются расписания и очередь (если не было сигнала о новом задании), с
+SCHEDULER_TICK = 5.0
+# статусы заданий
+JOB_STATUSES = ('queued', 'running', 'done', 'failed')
+HTTP_REASONS = {200: 'OK', 201: 'Created', 400: 'Bad Request', 404: 'Not Found'}
+
+
+class JobQueue:
+    """
+    Постоянная очередь заданий и расписаний повторных сборов в SQLite
+    """
+
+    def __init__(self, path: Path = DAEMON_DB_PATH):
+        self._db = sqlite3.connect(path)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT, schedule_id INTEGER, status TEXT,
+                created REAL, started REAL, finished REAL, items INTEGER, pages INTEGER, error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+            CREATE TABLE IF NOT EXISTS schedules (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT UNIQUE, interval REAL, jitter REAL, next_run REAL
+            );
+        ''')
+        # задания, прерванные остановкой службы, возвращаем в очередь
+        self._db.execute("UPDATE jobs SET status = 'queued', started = NULL WHERE status = 'running'")
+        self._db.commit()
+
+    def enqueue(self, url: str, schedule_id: int = None) -> int:
+        cursor = self._db.execute("INSERT INTO jobs (url, schedule_id, status, created) VALUES (?, ?, 'queued', ?)",
+                                  (url, schedule_id, time.time()))
+        self._db.commit()
+        return cursor.lastrowid
+
+    def claim(self) -> dict | None:
+        """
+        Взять самое старое задание из очереди в работу
+        """
+        row = self._db.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+        if row is None:
+            return None
+        self._db.execute("UPDATE jobs SET status = 'running', started = ? WHERE id = ?", (time.time(), row['id']))
+        self._db.commit()
+        return dict(row)
+
+    def finish(self, job_id: int, result: SellerResult):
+        self._db.execute('''
+            UPDATE jobs SET status = ?, finished = ?, items = ?, pages = ?, error = ? WHERE id = ?
+        ''', ('done' if result.status else 'failed', time.time(), result.items, result.pages, result.error, job_id))
+        self._db.commit()
+
+    def get(self, job_id: int) -> dict | None:
+        row = self._db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def list_jobs(self, status: str = None, limit: int = 50) -> list[dict]:
+        query, params = 'SELECT * FROM jobs', []
+        if status is not None:
+            query += ' WHERE status = ?'
+            params.append(status)
+        return [dict(row) for row in self._db.execute(query + ' ORDER BY id DESC LIMIT ?', (*params, limit))]
+
+    def counts(self) -> dict:
+        counts = dict.fromkeys(JOB_STATUSES, 0)
+        counts.update(self._db.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+        return counts
+
+    def add_schedule(self, url: str, interval: float, jitter: float = 0.0) -> int:
+        """
+        Повторный сбор продавца каждые interval секунд со случайным сдвигом до jitter секунд
+        (первый сбор - сразу; для существующего расписания меняется интервал)
+        """
+        self._db.execute('''
+            INSERT INTO schedules (url, interval, jitter, next_run) VALUES (?, ?, ?, ?)
+            ON CONFLICT (url) DO UPDATE SET interval = excluded.interval, jitter = excluded.jitter
+        ''', (url, interval, jitter, time.time()))
+        self._db.commit()
+        return self._db.execute('SELECT id FROM schedules WHERE url = ?', (url,)).fetchone()[0]
+
+    def remove_schedule(self, schedule_id: int) -> bool:
+        cursor = self._db.execute('DELETE FROM schedules WHERE id = ?', (schedule_id,))
+        self._db.commit()
+        return cursor.rowcount > 0
+
+    def list_schedules(self) -> list[dict]:
+        return [dict(row) for row in self._db.execute('SELECT * FROM schedules ORDER BY id')]
+
+    def enqueue_due(self, now: float = None) -> list[int]:
+        """
+        Постановка в очередь продавцов, чей срок подошел (если по продавцу нет незавершенного задания)
+        """
+        now = now or time.time()
+        job_ids = []
+        for row in self._db.execute('SELECT * FROM schedules WHERE next_run <= ?', (now,)).fetchall():
+            pending = self._db.execute("SELECT 1 FROM jobs WHERE url = ? AND status IN ('queued', 'running')",
+                                       (row['url'],)).fetchone()
+            if pending is None:
+                job_ids.append(self.enqueue(row['url'], row['id']))
+            # случайный сдвиг разводит сборы продавцов с одинаковым интервалом во времени
+            next_run = now + row['interval'] + random.uniform(0, row['jitter'])
+            self._db.execute('UPDATE schedules SET next_run = ? WHERE id = ?', (next_run, row['id']))
+        self._db.commit()
+        return job_ids
+
+    def close(self):
+        self._db.close()
+
+
+class Daemon:
+    """
+    Служба сбора: расписания, ограниченное число одновременных сборов и http api в одном цикле событий
+    с общим пулом соединений, кэшем и пулом сессий на все задания
+    """
+
+    def __init__(self, queue: JobQueue, workers: int = DAEMON_WORKERS, cache: ResponseCache = None,
+                 fmt: str = 'csv', snapshots: SnapshotStore = None, sessions: SessionPool = None,
+                 category_cache: CategoryCache = None, fingerprints: PageFingerprints = None):
+        self.queue = queue
+        self.workers = workers
+        self.cache = cache
+        self.category_cache = category_cache
+        self.fingerprints = fingerprints
+        self.fmt = fmt
+        self.snapshots = snapshots
+        self.sessions = sessions
+        self._wakeup = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(workers)
+
+    async def serve(self, host: str = DAEMON_HOST, port: int = DAEMON_PORT):
+        server = await asyncio.start_server(self.handle_http, host, port)
+        logger.info(f'daemon api on http://{host}:{port}, workers {self.workers}')
+        tasks = [asyncio.create_task(self.scheduler())]
+        tasks += [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+        try:
+            async with server, CLIENT_POOL:
+                await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def scheduler(self):
+        while True:
+            if self.queue.enqueue_due():
+                self._wakeup.set()
+            await asyncio.sleep(SCHEDULER_TICK)
+
+    async def worker(self):
+        while True:
+            job = self.queue.claim()
+            if job is None:
+                # ждем нового задания (сигнал от api или расписания), но не дольше такта планировщика
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), SCHEDULER_TICK)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            logger.info(f'job {job["id"]} started: {job["url"]}')
+            result = await scrape_seller(job['url'], self._semaphore, self.cache, fmt=self.fmt,
+                                         snapshots=self.snapshots, sessions=self.sessions,
+                                         category_cache=self.category_cache, fingerprints=self.fingerprints)
+            self.queue.finish(job['id'], result)
+            logger.info(f'job {job["id"]} {"done" if result.status else "failed"}: items {result.items}, '
+                        f'{result.seconds:.1f} s{", " + result.error if result.error else ""}')
+
+    async def handle_http(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Минимальный http/1.1: один запрос на соединение, тело - json
+        """
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            status, payload = self.route(request_line[0], request_line[1], body)
+        except Exception as e:
+            status, payload = 400, {'error': f'{type(e).__name__}: {e}'}
+        data = json.dumps(payload, ensure_ascii=False).encode()
+        writer.write(f'HTTP/1.1 {status} {HTTP_REASONS.get(status, "")}\r\nContent-Type: application/json\r\n'
+                     f'Content-Length: {len(data)}\r\nConnection: close\r\n\r\n'.encode() + data)
+        await writer.drain()
+        writer.close()
+
+    def route(self, method: str, target: str, body: bytes) -> tuple[int, dict | list]:
+        """
+        POST /jobs {"url"} - поставить продавца в очередь, GET /jobs[?status=&limit=], GET /jobs/<id>,
+        POST /schedules {"url", "interval", "jitter"}, GET /schedules, DELETE /schedules/<id>, GET /health
+        """
+        url = urlparse(target)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        parts = url.path.strip('/').split('/')
+        data = json.loads(body) if body else {}
+        if method == 'GET' and parts == ['health']:
+            return 200, {'jobs': self.queue.counts(), 'schedules': len(self.queue.list_schedules())}
+        if parts[0] == 'jobs':
+            if method == 'POST' and len(parts) == 1:
+                job_id = self.queue.enqueue(data['url'])
+                self._wakeup.set()
+                return 201, {'id': job_id}
+            if method == 'GET' and len(parts) == 1:
+                return 200, self.queue.list_jobs(query.get('status'), int(query.get('limit', 50)))
+            if method == 'GET' and len(parts) == 2:
+                job = self.queue.get(int(parts[1]))
+                return (200, job) if job is not None else (404, {'error': 'задание не найдено'})
+        if parts[0] == 'schedules':
+            if method == 'POST' and len(parts) == 1:
+                schedule_id = self.queue.add_schedule(data['url'], float(data['interval']),
+                                                      float(data.get('jitter', 0)))
+                return 201, {'id': schedule_id}
+            if method == 'GET' and len(parts) == 1:
+                return 200, self.queue.list_schedules()
+            if method == 'DELETE' and len(parts) == 2:
+                if self.queue.remove_schedule(int(parts[1])):
+                    return 200, {'id': int(parts[1])}
+                return 404, {'error': 'расписание не найдено'}
+        return 404, {'error': 'не найдено'}
+
+
+async def run_daemon(host: str = DAEMON_HOST, port: int = DAEMON_PORT, workers: int = DAEMON_WORKERS,
+                     db_path: str = DAEMON_DB_PATH, rate_limit: float = None, use_cache: bool = True,
+                     cache_ttl: float = CACHE_TTL, fmt: str = 'csv', snapshots_path: str = None,
+                     session_files: list[str] = None, session_strategy: str = 'round_robin'):
+    CLIENT_POOL.set_rate_limit(rate_limit)
+    queue = JobQueue(db_path)
+    cache = ResponseCache(ttl=cache_ttl) if use_cache else None
+    # карты категорий: плановые сборы начинают обход сразу, страница продавца проверяется в фоне
+    category_cache = CategoryCache() if use_cache else None
+    # отпечатки страниц: неизменившиеся страницы плановых сборов не разбираются заново
+    fingerprints = PageFingerprints() if use_cache else None
+    snapshots = SnapshotStore(snapshots_path) if snapshots_path else None
+    sessions = SessionPool.from_files(session_files, strategy=session_strategy) if session_files else None
+    try:
+        await Daemon(queue, workers, cache, fmt, snapshots, sessions, category_cache,
+                     fingerprints).serve(host, port)
+    finally:
+        queue.close()
+        if cache is not None:
+            cache.close()
+        if category_cache is not None:
+            category_cache.close()
+        if fingerprints is not None:
+            fingerprints.close()
+        if snapshots is not None:
+            snapshots.close()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Служба сбора: очередь заданий, расписания и http api')
+    parser.add_argument('--host', default=DAEMON_HOST)
+    parser.add_argument('--port', type=int, default=DAEMON_PORT)
+    parser.add_argument('--workers', type=int, default=DAEMON_WORKERS, help='продавцов одновременно')
+    parser.add_argument('--db', default=str(DAEMON_DB_PATH), help='файл очереди заданий и расписаний')
+    parser.add_argument('--rate', type=float, default=None, help='общий лимит запросов в секунду')
+    parser.add_argument('--no-cache', action='store_true', help='не использовать дисковый кэш ответов')
+    parser.add_argument('--cache-ttl', type=float, default=CACHE_TTL, help='время жизни кэша ответов, с')
+    parser.add_argument('--format', default='csv', choices=REPORT_FORMATS, help='формат отчетов')
+    parser.add_argument('--snapshots', nargs='?', const=str(SNAPSHOTS_PATH), default=None,
+                        help='вести историю цен в базе снимков (по умолчанию app/snapshots.sqlite)')
+    parser.add_argument('--sessions', nargs='+', default=None, metavar='FILE',
+                        help='файлы с curl-командами для общего пула сессий (вместо settings.txt)')
+    parser.add_argument('--session-strategy', default='round_robin', choices=SESSION_STRATEGIES,
+                        help='выбор сессии: по кругу или дольше всех не получавшая 429')
+    parser.add_argument('--log-level', default='INFO', help='уровень логирования (DEBUG - с каждым запросом)')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    setup_logging(args.log_level)
+    try:
+        asyncio.run(run_daemon(args.host, args.port, args.workers, args.db, args.rate, not args.no_cache,
+                               args.cache_ttl, args.format, args.snapshots, args.sessions, args.session_strategy))
+    except KeyboardInterrupt:
+        # прерванные задания вернутся в очередь при следующем запуске
+        pass
@@ -0,0 +1,59 @@
+import json
+
+# быстрые декодеры json подключаются, если установлены (pip install orjson msgspec)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+if orjson is not None:
+    DECODER_NAME = 'orjson'
+    _loads = orjson.loads
+elif msgspec is not None:
+    DECODER_NAME = 'msgspec'
+    _loads = msgspec.json.decode
+else:
+    DECODER_NAME = 'json'
+    _loads = json.loads
+
+
+def loads(data: bytes | str):
+    """
+    Декодирование json сразу из байтов ответа (без промежуточного текста) самым быстрым доступным декодером
+    """
+    return _loads(data)
+
+
+if msgspec is not None:
+    class ItemStruct(msgspec.Struct):
+        """
+        Типизированная форма товара: из всего объекта создаются только нужные обработке поля
+        """
+        skuId: str | int | None = None
+        mainState: list[dict] | None = None
+
+    class ItemsStateStruct(msgspec.Struct):
+        """
+        Типизированная форма состояния виджета со списком товаров
+        """
+        items: list[ItemStruct]
+
+    _items_state_decoder = msgspec.json.Decoder(ItemsStateStruct)
+
+    def decode_items_state(data: bytes | str) -> list[dict]:
+        """
+        Декодирование состояния виджета товаров в список словарей (только skuId и mainState)
+        """
+        state = _items_state_decoder.decode(data)
+        return [{'skuId': item.skuId, 'mainState': item.mainState} for item in state.items]
+else:
+    def decode_items_state(data: bytes | str) -> list[dict]:
+        """
+        Декодирование состояния виджета товаров в список словарей
+        """
+        return loads(data)['items']
@@ -0,0 +1,138 @@
+import re
+from collections import Counter
+from functools import cache
+from typing import NamedTuple
+
+
+class FieldSpec(NamedTuple):
+    """
+    Описание поля товара: по какому ключу искать строку mainState и путь к значению внутри нее
+    """
+    # ('id', значение id строки) или ('type', тип атома строки, например priceV2)
+    key: tuple[str, str]
+    # путь внутри строки: ключи словарей и индексы списков, '*' - все элементы списка
+    path: tuple
+    # регулярное выражение: из списка значений берется первое подходящее
+    pick: str | None = None
+    # разделитель, которым склеивается список значений
+    join: str | None = None
+    # поля нет у части товаров: отсутствие строки, короткий список или пустое значение - не промах,
+    # промахом считается только изменившаяся структура строки (нет ключа, другой тип)
+    optional: bool = False
+
+
+# поля товара в порядке колонок; ключи и пути - по наблюдаемым ответам выдачи, при изменении
+# формата ответа правится только эта таблица, а рост счетчиков промахов показывает, что формат поменялся
+ITEM_FIELDS = {
+    'price_promo': FieldSpec(('type', 'priceV2'), ('atom', 'priceV2', 'price', 0, 'text')),
+    # цены без скидки в списке нет (одна цена)
+    'price_reg': FieldSpec(('type', 'priceV2'), ('atom', 'priceV2', 'price', 1, 'text'), optional=True),
+    'name': FieldSpec(('id', 'name'), ('atom', 'textAtom', 'text')),
+    'rating': FieldSpec(('type', 'labelList'), ('atom', 'labelList', 'items', '*', 'title'),
+                        pick=r'^\s*\d+(?:[.,]\d+)?\s*$'),
+    'reviews': FieldSpec(('type', 'labelList'), ('atom', 'labelList', 'items', '*', 'title'), pick='отзыв'),
+    'delivery': FieldSpec(('id', 'deliveryInfo'), ('atom', 'textAtom', 'text')),
+    'badges': FieldSpec(('id', 'badges'), ('atom', 'labelList', 'items', '*', 'title'), join='; ', optional=True),
+}
+
+
+def compile_path(spec: FieldSpec, row: str) -> str:
+    """
+    Выражение python для пути поля внутри строки row: прямые обращения по ключам, '*' - генератор списка
+    """
+    path = list(spec.path)
+    star = path.index('*') if '*' in path else None
+    expression = row + ''.join(f'[{step!r}]' for step in path[:star])
+    if star is None:
+        return expression
+    tail = ''.join(f'[{step!r}]' for step in path[star + 1:])
+    expression = f'[value{tail} for value in {expression}]'
+    if spec.pick is not None:
+        return f'next((value for value in {expression} if patterns[{spec.pick!r}].search(value)), None)'
+    if spec.join is not None:
+        return f'({spec.join!r}.join({expression}) or None)'
+    return expression
+
+
+def compile_extractor(fields: dict[str, FieldSpec]):
+    """
+    Описания полей компилируются в одну функцию разбора товара: один проход по строкам mainState
+    с раскладкой нужных строк по переменным и прямые обращения по путям (без цикла по описаниям на каждом товаре)
+    """
+    slots = {}
+    for spec in fields.values():
+        slots.setdefault(spec.key, f'slot{len(slots)}')
+    id_slots = {value: slot for (kind, value), slot in slots.items() if kind == 'id'}
+    type_slots = {value: slot for (kind, value), slot in slots.items() if kind == 'type'}
+    lines = ['def extract(main_state, misses):',
+             f'    {" = ".join(slots.values())} = None',
+             '    for row in main_state or ():']
+    # строки индексируются по id и по типу атома, берется первая подходящая строка
+    for title, kind_slots, key_expression in (('id', id_slots, "row.get('id')"),
+                                              ('type', type_slots, "atom.get('type') or next(iter(atom), None)")):
+        if not kind_slots:
+            continue
+        indent = '        '
+        if title == 'type':
+            lines += ["        atom = row.get('atom')", '        if atom.__class__ is dict:']
+            indent += '    '
+        lines.append(f'{indent}key = {key_expression}')
+        for number, (value, slot) in enumerate(kind_slots.items()):
+            lines += [f'{indent}{"if" if number == 0 else "elif"} key == {value!r}:',
+                      f'{indent}    if {slot} is None:',
+                      f'{indent}        {slot} = row']
+    names = []
+    for number, (name, spec) in enumerate(fields.items()):
+        slot, value = slots[spec.key], f'value{number}'
+        names.append(value)
+        lines += [f'    {value} = None',
+                  f'    if {slot} is not None:',
+                  '        try:',
+                  f'            {value} = {compile_path(spec, slot)}']
+        if spec.optional:
+            # у необязательного поля промах - только найденная строка другой структуры
+            lines += ['        except IndexError:',
+                      '            pass',
+                      '        except (KeyError, TypeError):',
+                      f'            misses[{name!r}] += 1']
+        else:
+            lines += ['        except (KeyError, IndexError, TypeError):',
+                      '            pass',
+                      f'    if {value} is None:',
+                      f'        misses[{name!r}] += 1']
+    lines.append(f'    return [{", ".join(names)}]')
+    namespace = {'patterns': {spec.pick: re.compile(spec.pick) for spec in fields.values() if spec.pick}}
+    exec('\n'.join(lines), namespace)
+    return namespace['extract']
+
+
+@cache
+def default_extractor():
+    """
+    Скомпилированная функция разбора для ITEM_FIELDS (одна на процесс: дата-фреймы строятся постранично)
+    """
+    return compile_extractor(ITEM_FIELDS)
+
+
+class ItemExtractor:
+    """
+    Извлечение полей товаров по скомпилированным описаниям: строки mainState индексируются
+    по id и типу атома за один проход, промахи считаются по каждому полю
+    """
+
+    def __init__(self, fields: dict[str, FieldSpec] = None):
+        if fields is None:
+            self.fields = list(ITEM_FIELDS)
+            self._extract = default_extractor()
+        else:
+            self.fields = list(fields)
+            self._extract = compile_extractor(fields)
+        self.items = 0
+        self.misses = Counter()
+
+    def extract(self, main_state: list | None) -> list:
+        """
+        Значения полей одного товара в порядке self.fields (нет поля - None и промах в счетчике)
+        """
+        self.items += 1
+        return self._extract(main_state, self.misses)
@@ -1,13 +1,28 @@
+import argparse
+import contextlib
 import datetime
+import logging
 import os
+from concurrent.futures import Executor
 # Удаляем загрузку переменных окружения
 # from dotenv import load_dotenv
-from common import edit_llc_info, edit_items_to_df, edit_get_items_list, edit_categories, generate_list_pages, \
-    change_category_in_url, get_seller_id_from_url, save_csv, check_domain_in_url, URLModel
-from requests_handler import gen_params_for_llc_info, send_request, gen_params_for_items
+from common import edit_llc_info, edit_items_to_df, edit_categories_data, get_seller_id_from_url, \
+    check_domain_in_url, get_report_path, URLModel
+from requests_handler import send_request, RequestContext, CLIENT_POOL
+from crawler import crawl_categories, iter_pages, CrawlStats
+from pipeline import stream_items_to_report
+from parsing import PageParser, make_parse_pool, default_parse_workers
+from sharding import CategoryTree, SHARD_PAGES
+from writers import save_report, get_writer_class, REPORT_FORMATS
+from cache import ResponseCache, CACHE_TTL, CategoryCache, CachedCategories, CATEGORIES_TTL, PageFingerprints
+from snapshots import SnapshotStore, SNAPSHOTS_PATH
+from sessions import SessionPool, SESSION_STRATEGIES
+from metrics import RunMetrics, CURRENT_METRICS, stage_timer
 import asyncio
 from errors import GetDataError, EditDataError
 
+logger = logging.getLogger(__name__)
+
 # загрузка переменных для окружения больше не нужна
 # load_dotenv()
 
@@ -15,91 +30,306 @@ from errors import GetDataError, EditDataError
 # COOKIES = os.getenv('COOKIES')
 
 
-async def get_all_items_ozon(input_url: str) -> bool:
+async def fetch_category_tree(input_url: str, seller_id: str, context: RequestContext, cache_run=None,
+                              category_cache: CategoryCache = None,
+                              cached: CachedCategories = None) -> CategoryTree | bool:
+    """
+    Запрос страницы продавца и разбор дерева категорий. При переданной сохраненной карте запрос условный:
+    ответ 304 только продлевает ее свежесть. Новая карта сохраняется в category_cache
+    """
+    headers = cached.conditional_headers() if cached is not None else None
+    response = await send_request(url=input_url, json_loads=False, context=context, cache=cache_run,
+                                  headers=headers or None)
+    if cached is not None and response.status_code == 304:
+        category_cache.touch(seller_id)
+        return CategoryTree(cached.categories)
+    if not response.status:
+        raise GetDataError()
+    try:
+        categories_data = edit_categories_data(response.object)
+    except Exception as e:
+        logger.error(f'не удалось разобрать категории {seller_id}: {e}')
+        return False
+    category_tree = CategoryTree(categories_data)
+    if category_cache is not None and category_tree.roots:
+        category_cache.set(seller_id, categories_data, response.validators)
+    return category_tree
+
+
+async def refresh_category_tree(input_url: str, seller_id: str, context: RequestContext,
+                                category_cache: CategoryCache, cached: CachedCategories) -> str:
+    """
+    Фоновая проверка сохраненной карты категорий, пока идет обход страниц по ней
+    """
+    try:
+        category_tree = await fetch_category_tree(input_url, seller_id, context, category_cache=category_cache,
+                                                  cached=cached)
+    except Exception as e:
+        logger.warning(f'карта категорий {seller_id} не обновлена: {type(e).__name__} {e}')
+        return 'failed'
+    if not category_tree:
+        return 'failed'
+    if category_cache.get(seller_id).categories == cached.categories:
+        return 'not modified'
+    logger.info(f'карта категорий {seller_id} изменилась, новая будет использована со следующего запуска')
+    return 'updated'
+
+
+async def get_all_items_ozon(input_url: str, stream: bool = True, sort_output: bool = True,
+                             cache: ResponseCache = None, resume: bool = False, stats: CrawlStats = None,
+                             executor: Executor = None, metrics: RunMetrics = None,
+                             prometheus_path: str = None, fmt: str = 'csv', snapshots: SnapshotStore = None,
+                             sessions: SessionPool = None, parse_executor: Executor = None,
+                             shard_pages: int = SHARD_PAGES, category_cache: CategoryCache = None,
+                             refresh_categories: bool = False, fingerprints: PageFingerprints = None) -> bool:
     """
     Основная функция полного цикла сбора
+    :param input_url: адрес магазина продавца
+    :param stream: потоковая запись отчета по мере разбора страниц (иначе сбор всего каталога в памяти)
+    :param sort_output: сортировка итогового файла по категориям и цене
+    :param cache: дисковый кэш ответов (None - без кэша)
+    :param resume: продолжить последний незавершенный запуск по продавцу, не запрашивая уже полученные страницы
+    :param stats: статистика сбора, заполняемая по ходу запуска (для внешнего учета)
+    :param executor: пул процессов для сборки дата-фреймов (None - в текущем потоке)
+    :param metrics: метрики запуска (по умолчанию создаются новые), отчет сохраняется в json рядом с csv
+    :param prometheus_path: файл для метрик в формате Prometheus
+    :param fmt: формат отчета: csv, csv.gz, csv.zst, parquet, feather
+    :param snapshots: хранилище снимков цен для учета новых, изменившихся и пропавших товаров
+    :param sessions: пул сессий (куки и заголовки из нескольких curl-команд) вместо единственной из settings.txt
+    :param parse_executor: пул процессов для разбора страниц из байтов ответа (только при потоковой записи)
+    :param shard_pages: категории с подкатегориями, в выдаче которых больше страниц, обходятся по подкатегориям
+        (0 - не делить)
+    :param category_cache: сохраненные карты категорий: повторный запуск не ждет страницу продавца
+    :param refresh_categories: запросить карту категорий заново, не глядя на сохраненную
+    :param fingerprints: отпечатки страниц выдачи: не изменившиеся с прошлого запуска страницы не разбираются
+        (только при потоковой записи)
+    :return: отчет сохранен (False - неверная ссылка или ошибка сохранения)
     """
     # запуск
     start_dt = datetime.datetime.now()
-    print(f'{start_dt} START!')
+    logger.info('START!')
 
     # проверка ссылки
     try:
         validate_url = URLModel(**{'text': input_url})
     except Exception as e:
-        print(e)
+        logger.error(e)
         return False
 
     # взятие домена для запросов
     domain = check_domain_in_url(input_url)
+    # получаем идентификатор продавца
+    seller_id = get_seller_id_from_url(input_url)
+    # метрики запуска доступны всем вызовам через контекст (у каждой задачи asyncio своя копия)
+    if metrics is None:
+        metrics = RunMetrics(seller_id)
+    CURRENT_METRICS.set(metrics)
+    # запуск в рамках дискового кэша (новый или продолжение прерванного)
+    cache_run = cache.start_run(seller_id, resume=resume) if cache is not None else None
+    if cache_run is not None and cache_run.resumed:
+        logger.info(f'RESUME run {cache_run.run_id}')
 
-    # формирование параметров для запроса ЮЛ
-    params_llc = gen_params_for_llc_info(input_url)
-    # создание и получение 2 задач: данные по ЮЛ, данные по категориям
-    tasks = (send_request(params=params_llc, domain=domain),
-             send_request(url=input_url, json_loads=False))
-    responses_list = await asyncio.gather(*tasks)
-    # если данных по категориям нет, то далее выполнение невозможно
-    # (можно сделать Намного более гибкие обработчики ошибок)
-    if not responses_list[0].status or not responses_list[1].status:
-        raise GetDataError()
+    # адрес api, параметры и куки готовятся один раз на продавца, запросы страниц их только копируют
+    context = RequestContext(input_url, domain, sessions=sessions)
+    # сохраненная карта категорий: в пределах TTL страница продавца не запрашивается,
+    # устаревшая используется сразу и проверяется в фоне
+    cached = None
+    if category_cache is not None and not refresh_categories:
+        cached = category_cache.get(seller_id)
+    refresh_task = None
+    if cached is not None:
+        llc_response = await send_request(params=context.llc_params, context=context, cache=cache_run)
+        category_tree = CategoryTree(cached.categories)
+        if cached.is_fresh(category_cache.ttl):
+            metrics.extra['categories'] = 'cache'
+        else:
+            refresh_task = asyncio.create_task(refresh_category_tree(input_url, seller_id, context,
+                                                                     category_cache, cached))
+    else:
+        # создание и получение 2 задач: данные по ЮЛ, данные по категориям
+        # (полное дерево категорий нужно для деления больших категорий, в отчет идут только основные)
+        tasks = (send_request(params=context.llc_params, context=context, cache=cache_run),
+                 fetch_category_tree(input_url, seller_id, context, cache_run, category_cache))
+        llc_response, category_tree = await asyncio.gather(*tasks)
+        metrics.extra['categories'] = 'page'
+    try:
+        # если данных по ЮЛ нет, то далее выполнение невозможно
+        # (можно сделать Намного более гибкие обработчики ошибок)
+        if not llc_response.status:
+            raise GetDataError()
 
-    # редактирование данных по ЮЛ и категориям
-    llc_info = edit_llc_info(responses_list[0].object)
-    categories_list = edit_categories(responses_list[1].object)
-    if not categories_list:
-        raise EditDataError()
-
-    # общий словарь для наполнения сырыми данными
-    main_items_dict = {}
-    # перебираем категории ЮЛ
-    for name_cat, url_cat in categories_list.items():
-        main_items_dict[name_cat] = []
-        # флаг сбора данных включен
-        cat_parse = True
-        # меняем категорию в адресе
-        input_url_upd_cat = change_category_in_url(input_url, url_cat)
-        # формируем список числа запросов, по 3 за раз по умолчанию
-        list_pages = generate_list_pages(1, 20, 3)
-        # проверка флага парсинга
-        for chunk in list_pages:
-            if cat_parse is False:
-                break
-            # формируем параметры запросов
-            # (универсальный способ)
-            params_list = [gen_params_for_items(input_url_upd_cat, page) for page in chunk]
-            # создание и получение данных асинхронно
-            tasks = (send_request(params=params, domain=domain) for params in params_list)
-            responses_list = await asyncio.gather(*tasks)
-            # проверка есть ли хоть в 1 запросе данные
-            if all(response.status is False for response in responses_list):
-                raise GetDataError()
-            # первично обрабатываем и определяем наличие нужных данных
-            items_lists = [edit_get_items_list(response.object) for response in responses_list]
-            # если нигде нет данных убираем флаг дальнейших запросов
-            if any(item is None for item in items_lists):
-                cat_parse = False
-            # обновляем общий список с первичными данными
-            main_items_dict[name_cat].extend([item for sublist in items_lists if sublist is not None for item in sublist])
+        # редактирование данных по ЮЛ и категориям
+        llc_info = edit_llc_info(llc_response.object)
+        if not category_tree or not category_tree.roots:
+            raise EditDataError()
+        categories_list = category_tree.roots
 
-    # получаем идентификатор продавца
-    seller_id = get_seller_id_from_url(input_url)
-    # финально обрабатываем данные и формируем дата-фрейм
-    df = edit_items_to_df(main_items_dict, llc_info, seller_id)
-    # сохраняем csv
-    status = save_csv(df, seller_id)
+        if stats is None:
+            stats = CrawlStats()
+        snapshot = snapshots.start(seller_id) if snapshots is not None else None
+        if stream:
+            # параллельный обход категорий с дозаписью строк в отчет по мере поступления страниц
+            dt = str(datetime.datetime.now().replace(microsecond=0))
+            parser = None
+            if parse_executor is not None or fingerprints is not None:
+                # страницы, разбираемые заново, собираются в пуле дата-фреймов, если нет отдельного пула разбора
+                parser = PageParser(parse_executor, llc_info, seller_id, dt, fingerprints, frame_executor=executor)
+            pages = iter_pages(context, categories_list, stats=stats, cache=cache_run, parser=parser,
+                               tree=category_tree, shard_pages=shard_pages)
+            report_path = await stream_items_to_report(pages, llc_info, seller_id, sort_output=sort_output,
+                                                       executor=executor, fmt=fmt, snapshot=snapshot, dt=dt)
+            logger.info(f'saved {report_path}')
+            if fingerprints is not None:
+                fingerprints.commit()
+            status = True
+        else:
+            # параллельный обход всех категорий ЮЛ с общим бюджетом запросов
+            main_items_dict = await crawl_categories(context, categories_list, stats=stats, cache=cache_run,
+                                                     tree=category_tree, shard_pages=shard_pages)
+            # финально обрабатываем данные и формируем дата-фрейм
+            with stage_timer('dataframe'):
+                if executor is not None:
+                    loop = asyncio.get_running_loop()
+                    df = await loop.run_in_executor(executor, edit_items_to_df, main_items_dict, llc_info, seller_id)
+                else:
+                    df = edit_items_to_df(main_items_dict, llc_info, seller_id)
+            if df is not False:
+                metrics.field_misses.update(df.attrs.get('field_misses', {}))
+            # сохраняем отчет
+            report_path = get_report_path(seller_id, get_writer_class(fmt).extension)
+            with stage_timer('save'):
+                status = save_report(df, seller_id, fmt, report_path)
+            if snapshot is not None and df is not False:
+                with stage_timer('snapshot'):
+                    snapshot.add_frame(df)
+
+        # фоновая проверка карты категорий к этому моменту обычно уже завершена
+        if refresh_task is not None:
+            metrics.extra['categories'] = f'cache, {await refresh_task}'
+    finally:
+        # при ошибке обхода фоновая проверка карты прерывается: пул клиентов и кэш карт закрываются после выхода
+        if refresh_task is not None and not refresh_task.done():
+            refresh_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await refresh_task
+    # запуск завершен, продолжать его больше не нужно
+    if cache_run is not None and status:
+        cache_run.finish()
+    # снимок цен фиксируем только после обхода; если часть страниц не получена, товары с них
+    # не считаются пропавшими (цены полученных товаров записываются)
+    if snapshot is not None and status:
+        if stats.pages_failed:
+            logger.warning(f'snapshot: {stats.pages_failed} pages failed, removed items are not marked')
+        with stage_timer('snapshot'):
+            metrics.extra['snapshot'] = snapshot.finish(mark_removed=not stats.pages_failed)
+        logger.info(f'snapshot {metrics.extra["snapshot"]}')
+
+    # сохраняем отчет по метрикам запуска
+    metrics.finished = datetime.datetime.now().timestamp()
+    metrics.extra['crawl'] = stats.model_dump()
+    # отчет запуска - рядом с отчетом и с тем же временем в имени
+    extension = get_writer_class(fmt).extension
+    metrics.save_json(report_path.with_name(f'{report_path.name.removesuffix(extension)}metrics.json'))
+    if prometheus_path:
+        metrics.save_prometheus(prometheus_path)
 
     # отображаем цикл завершения и подсчитываем время
     end_dt = datetime.datetime.now()
+    logger.info(stats.summary())
+    if stats.shards:
+        logger.info(f'shards {stats.shards_summary()}')
+    if metrics.field_misses:
+        logger.info(f'field misses (of {stats.items} items): {dict(metrics.field_misses)}')
     if status:
-        print(f'{end_dt} DONE!\nSPENT {end_dt - start_dt}')
+        logger.info(f'DONE! SPENT {end_dt - start_dt}')
     else:
-        print(f'{end_dt} ERROR!')
-    return True
+        logger.error('ERROR!')
+    return status
+
+
+async def run(input_url: str, resume: bool = False, use_cache: bool = True, cache_ttl: float = CACHE_TTL,
+              prometheus_path: str = None, fmt: str = 'csv', snapshots_path: str = None,
+              session_files: list[str] = None, session_strategy: str = 'round_robin',
+              parse_workers: int = 0, shard_pages: int = SHARD_PAGES, categories_ttl: float = CATEGORIES_TTL,
+              refresh_categories: bool = False) -> bool:
+    """
+    Запуск сбора с управлением жизненным циклом пула клиентов, кэшей, хранилища снимков и пула разбора
+    """
+    cache = ResponseCache(ttl=cache_ttl) if use_cache or resume else None
+    category_cache = CategoryCache(ttl=categories_ttl) if use_cache else None
+    fingerprints = PageFingerprints() if use_cache else None
+    snapshots = SnapshotStore(snapshots_path) if snapshots_path else None
+    sessions = SessionPool.from_files(session_files, strategy=session_strategy) if session_files else None
+    parse_executor = make_parse_pool(parse_workers) if parse_workers else None
+    try:
+        # клиенты пула привязаны к циклу событий, поэтому закрываем их по завершении запуска
+        async with CLIENT_POOL:
+            return await get_all_items_ozon(input_url, cache=cache, resume=resume, prometheus_path=prometheus_path,
+                                            fmt=fmt, snapshots=snapshots, sessions=sessions,
+                                            parse_executor=parse_executor, shard_pages=shard_pages,
+                                            category_cache=category_cache, refresh_categories=refresh_categories,
+                                            fingerprints=fingerprints)
+    finally:
+        if parse_executor is not None:
+            parse_executor.shutdown()
+        if sessions is not None:
+            logger.info(f'sessions {sessions.summary()}')
+        if cache is not None:
+            cache.close()
+        if category_cache is not None:
+            category_cache.close()
+        if fingerprints is not None:
+            fingerprints.close()
+        if snapshots is not None:
+            snapshots.close()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Сбор товаров продавца Ozon в csv')
+    parser.add_argument('url', nargs='?', help='адрес магазина (без него - ввод адресов в интерактивном режиме)')
+    parser.add_argument('--resume', action='store_true',
+                        help='продолжить прерванный запуск, не запрашивая уже полученные страницы')
+    parser.add_argument('--no-cache', action='store_true', help='не использовать дисковый кэш ответов')
+    parser.add_argument('--cache-ttl', type=float, default=CACHE_TTL, help='время жизни кэша ответов, с')
+    parser.add_argument('--categories-ttl', type=float, default=CATEGORIES_TTL,
+                        help='сколько секунд сохраненная карта категорий не проверяется')
+    parser.add_argument('--refresh-categories', action='store_true',
+                        help='запросить карту категорий заново, не используя сохраненную')
+    parser.add_argument('--format', default='csv', choices=REPORT_FORMATS, help='формат отчета')
+    parser.add_argument('--prometheus', default=None, help='файл для метрик запуска в формате Prometheus')
+    parser.add_argument('--snapshots', nargs='?', const=str(SNAPSHOTS_PATH), default=None,
+                        help='вести историю цен в базе снимков (по умолчанию app/snapshots.sqlite)')
+    parser.add_argument('--sessions', nargs='+', default=None, metavar='FILE',
+                        help='файлы с curl-командами для пула сессий (вместо settings.txt)')
+    parser.add_argument('--session-strategy', default='round_robin', choices=SESSION_STRATEGIES,
+                        help='выбор сессии: по кругу или дольше всех не получавшая 429')
+    parser.add_argument('--parse-workers', type=int, nargs='?', const=default_parse_workers(), default=0,
+                        help='процессов для разбора страниц (без числа - по числу ядер минус одно, 0 - в цикле событий)')
+    parser.add_argument('--shard-pages', type=int, default=SHARD_PAGES,
+                        help='делить категории больше N страниц на подкатегории (0 - не делить)')
+    parser.add_argument('--log-level', default='INFO', help='уровень логирования (DEBUG - с каждым запросом)')
+    return parser.parse_args()
+
+
+def setup_logging(level: str):
+    logging.basicConfig(level=level.upper(), format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    # построчный лог каждого запроса httpx только в режиме отладки
+    if logging.getLogger().level > logging.DEBUG:
+        logging.getLogger('httpx').setLevel(logging.WARNING)
 
 
 if __name__ == '__main__':
-    # запускаем бесконечный цикл (для удобства ручного тестирования)
-    while True:
-        input_url = input('Введите url формата "https://www.ozon.ru/seller/webmarket-150120/products/?miniapp=seller_150120"\n')
-        asyncio.run(get_all_items_ozon(input_url))
+    args = parse_args()
+    setup_logging(args.log_level)
+    run_options = {'resume': args.resume, 'use_cache': not args.no_cache, 'cache_ttl': args.cache_ttl,
+                   'prometheus_path': args.prometheus, 'fmt': args.format, 'snapshots_path': args.snapshots,
+                   'session_files': args.sessions, 'session_strategy': args.session_strategy,
+                   'parse_workers': args.parse_workers, 'shard_pages': args.shard_pages,
+                   'categories_ttl': args.categories_ttl, 'refresh_categories': args.refresh_categories}
+    if args.url:
+        asyncio.run(run(args.url, **run_options))
+    else:
+        # запускаем бесконечный цикл (для удобства ручного тестирования)
+        while True:
+            input_url = input('Введите url формата "https://www.ozon.ru/seller/webmarket-150120/products/?miniapp=seller_150120"\n')
+            asyncio.run(run(input_url, **run_options))
@@ -0,0 +1,182 @@
+import json
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+
+# границы корзин гистограммы задержек запросов, с
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными корзинами (в формате Prometheus: накопительные счетчики по границам)
+    """
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float | None:
+        """
+        Оценка квантиля по верхней границе корзины
+        """
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        result, seen = [], 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            result.append(('+Inf' if bound == float('inf') else str(bound), seen))
+        return result
+
+
+class RunMetrics:
+    """
+    Метрики одного запуска: запросы, задержки, объем, повторы, страницы по категориям и время по этапам
+    """
+
+    def __init__(self, seller_id: str = None):
+        self.seller_id = seller_id
+        self.started = time.time()
+        self.finished = None
+        self.requests = 0
+        self.retries = 0
+        self.bytes_received = 0
+        self.status_codes = Counter()
+        self.latency = Histogram()
+        self.pages_per_category = Counter()
+        # суммарное время по этапам: network, json, dataframe, save (запросы идут параллельно,
+        # поэтому network - сумма времени запросов, а не отрезок на часах)
+        self.stage_seconds = Counter()
+        # товаров без значения по каждому полю mainState (рост - признак изменения формата ответа)
+        self.field_misses = Counter()
+        self.extra = {}
+
+    def observe_request(self, latency: float, status_code: int | None, size: int, attempt: int):
+        self.requests += 1
+        if attempt > 1:
+            self.retries += 1
+        self.bytes_received += size
+        self.status_codes[str(status_code) if status_code is not None else 'error'] += 1
+        self.latency.observe(latency)
+        self.stage_seconds['network'] += latency
+
+    @contextmanager
+    def timer(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds[stage] += time.perf_counter() - started
+
+    def to_report(self) -> dict:
+        """
+        Отчет запуска в виде словаря (для сохранения в json)
+        """
+        finished = self.finished or time.time()
+        return {
+            'seller_id': self.seller_id,
+            'started': self.started,
+            'seconds': round(finished - self.started, 3),
+            'requests': self.requests,
+            'retries': self.retries,
+            'bytes_received': self.bytes_received,
+            'status_codes': dict(self.status_codes),
+            'latency': {
+                'count': self.latency.count,
+                'sum': round(self.latency.sum, 3),
+                'p50': self.latency.quantile(0.5),
+                'p99': self.latency.quantile(0.99),
+                'buckets': dict(self.latency.cumulative()),
+            },
+            'pages_per_category': dict(self.pages_per_category),
+            'stage_seconds': {stage: round(value, 3) for stage, value in self.stage_seconds.items()},
+            'field_misses': dict(self.field_misses),
+            **self.extra,
+        }
+
+    def save_json(self, path: Path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_report(), f, ensure_ascii=False, indent=2)
+
+    def to_prometheus(self) -> str:
+        """
+        Метрики в текстовом формате Prometheus (для textfile-коллектора node_exporter)
+        """
+        label = f'seller="{self.seller_id}"'
+        lines = [
+            '# TYPE ozon_requests_total counter',
+            f'ozon_requests_total{{{label}}} {self.requests}',
+            '# TYPE ozon_retries_total counter',
+            f'ozon_retries_total{{{label}}} {self.retries}',
+            '# TYPE ozon_bytes_received_total counter',
+            f'ozon_bytes_received_total{{{label}}} {self.bytes_received}',
+            '# TYPE ozon_responses_total counter',
+        ]
+        lines += [f'ozon_responses_total{{{label},code="{code}"}} {count}'
+                  for code, count in self.status_codes.items()]
+        lines.append('# TYPE ozon_request_seconds histogram')
+        lines += [f'ozon_request_seconds_bucket{{{label},le="{bound}"}} {count}'
+                  for bound, count in self.latency.cumulative()]
+        lines += [f'ozon_request_seconds_sum{{{label}}} {self.latency.sum}',
+                  f'ozon_request_seconds_count{{{label}}} {self.latency.count}',
+                  '# TYPE ozon_stage_seconds_total counter']
+        lines += [f'ozon_stage_seconds_total{{{label},stage="{stage}"}} {value}'
+                  for stage, value in self.stage_seconds.items()]
+        lines.append('# TYPE ozon_category_pages_total counter')
+        lines += [f'ozon_category_pages_total{{{label},category="{escape_label(category)}"}} {count}'
+                  for category, count in self.pages_per_category.items()]
+        lines.append('# TYPE ozon_field_misses_total counter')
+        lines += [f'ozon_field_misses_total{{{label},field="{field}"}} {count}'
+                  for field, count in self.field_misses.items()]
+        return '\n'.join(lines) + '\n'
+
+    def save_prometheus(self, path: Path):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+
+
+def escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# метрики текущего запуска: задачи asyncio наследуют контекст, поэтому в пакетном режиме
+# у каждого продавца свои метрики без явной передачи через все вызовы
+CURRENT_METRICS: ContextVar[RunMetrics | None] = ContextVar('CURRENT_METRICS', default=None)
+
+
+def current_metrics() -> RunMetrics | None:
+    return CURRENT_METRICS.get()
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """
+    Замер этапа в метриках текущего запуска (если метрики не включены - ничего не делает)
+    """
+    metrics = CURRENT_METRICS.get()
+    if metrics is None:
+        yield
+        return
+    with metrics.timer(stage):
+        yield
@@ -0,0 +1,145 @@
+import asyncio
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import NamedTuple, TYPE_CHECKING
+from common import edit_get_items_list, edit_get_items_state, edit_paging_info, edit_items_to_df, \
+    edit_df_to_stored, edit_stored_to_df, STORED_SCHEMA
+from decoder import loads
+from cache import PageFingerprints, page_digest
+from metrics import stage_timer
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+class ParsedPage(NamedTuple):
+    """
+    Итог разбора страницы выдачи: готовый дата-фрейм страницы и данные пагинации
+    """
+    # дата-фрейм товаров страницы; None - пустая страница (конец категории), False - ошибка разбора
+    frame: 'pd.DataFrame | bool | None'
+    has_next: bool | None
+    total_pages: int | None
+    # страница не изменилась с прошлого запуска и собрана из сохраненных полей (None - отпечатки не ведутся)
+    reused: bool | None = None
+
+
+def default_parse_workers() -> int:
+    """
+    Число процессов разбора по умолчанию: по ядру на процесс, одно ядро остается циклу событий
+    """
+    return max((os.cpu_count() or 2) - 1, 1)
+
+
+def warm_up_worker():
+    """
+    Импорт pandas при старте процесса пула, чтобы первая страница не ждала загрузки библиотеки
+    """
+    import pandas  # noqa: F401
+
+
+def make_parse_pool(workers: int) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=workers, initializer=warm_up_worker)
+
+
+def parse_data(data: dict, name_cat: str, llc_info: str | bool, seller_id: str, dt: str) -> ParsedPage:
+    """
+    Разбор уже декодированного ответа: состояние виджета товаров, пагинация и дата-фрейм страницы
+    """
+    items_list = edit_get_items_list(data)
+    has_next, total_pages = edit_paging_info(data)
+    if not items_list:
+        return ParsedPage(items_list, has_next, total_pages)
+    frame = edit_items_to_df({name_cat: items_list}, llc_info, seller_id, dt=dt, sort=False)
+    return ParsedPage(frame, has_next, total_pages)
+
+
+def parse_page(body: bytes, name_cat: str, llc_info: str | bool, seller_id: str, dt: str) -> ParsedPage:
+    """
+    Весь разбор страницы в процессе пула: декодирование json, состояние виджета товаров, пагинация
+    и дата-фрейм страницы. В процесс уходят только байты ответа, обратно - колонки дата-фрейма
+    """
+    try:
+        data = loads(body)
+    except Exception:
+        return ParsedPage(False, None, None)
+    return parse_data(data, name_cat, llc_info, seller_id, dt)
+
+
+class PageParser:
+    """
+    Разбор страниц выдачи из байтов ответа: в пуле процессов (цикл событий только отправляет байты
+    и получает дата-фреймы) или в текущем потоке. При переданных отпечатках страница, состояние виджета
+    товаров которой не изменилось с прошлого запуска, собирается из сохраненных полей без разбора.
+    При разборе в текущем потоке и переданном frame_executor сборка дата-фрейма уходит в этот пул
+    (как в stream_items_to_report)
+    """
+
+    def __init__(self, executor: Executor | None, llc_info: str | bool, seller_id: str, dt: str,
+                 fingerprints: PageFingerprints = None, frame_executor: Executor = None):
+        self.executor = executor
+        self.llc_info = llc_info
+        self.seller_id = seller_id
+        self.dt = dt
+        self.fingerprints = fingerprints
+        self.frame_executor = frame_executor
+
+    async def parse(self, body: bytes, name_cat: str, url_cat: str = None, page: int = None) -> ParsedPage:
+        data, digest = None, None
+        if self.fingerprints is not None:
+            # для отпечатка декодируется только верхний уровень ответа: состояния виджетов остаются строками
+            with stage_timer('json'):
+                try:
+                    data = loads(body)
+                except Exception:
+                    return ParsedPage(False, None, None, reused=False)
+                items_state = edit_get_items_state(data)
+            if isinstance(items_state, (str, bytes)):
+                digest = page_digest(items_state, STORED_SCHEMA)
+                stored = self.fingerprints.get(self.seller_id, url_cat, page, digest)
+                if stored is not None:
+                    with stage_timer('dataframe'):
+                        frame = edit_stored_to_df(stored, name_cat, self.llc_info, self.seller_id, self.dt)
+                    # неполные сохраненные строки - промах, страница разбирается и сохраняется заново
+                    if frame is not False:
+                        has_next, total_pages = edit_paging_info(data)
+                        return ParsedPage(frame, has_next, total_pages, reused=True)
+        if self.executor is not None:
+            loop = asyncio.get_running_loop()
+            # время ожидания пула (страницы пачки разбираются параллельно, поэтому это сумма, а не отрезок на часах)
+            with stage_timer('parse'):
+                parsed = await loop.run_in_executor(self.executor, parse_page, body, name_cat, self.llc_info,
+                                                    self.seller_id, self.dt)
+        elif self.frame_executor is not None:
+            parsed = await self.parse_offloaded(body if data is None else data, name_cat)
+        else:
+            with stage_timer('parse'):
+                if data is None:
+                    parsed = parse_page(body, name_cat, self.llc_info, self.seller_id, self.dt)
+                else:
+                    parsed = parse_data(data, name_cat, self.llc_info, self.seller_id, self.dt)
+        if self.fingerprints is None:
+            return parsed
+        if digest is not None and parsed.frame is not None and parsed.frame is not False:
+            self.fingerprints.set(self.seller_id, url_cat, page, digest, edit_df_to_stored(parsed.frame))
+        return parsed._replace(reused=False)
+
+    async def parse_offloaded(self, data: dict | bytes, name_cat: str) -> ParsedPage:
+        """
+        Разбор состояния виджета товаров в текущем потоке, сборка дата-фрейма - в пуле frame_executor
+        """
+        with stage_timer('json'):
+            if not isinstance(data, dict):
+                try:
+                    data = loads(data)
+                except Exception:
+                    return ParsedPage(False, None, None)
+            items_list = edit_get_items_list(data)
+        has_next, total_pages = edit_paging_info(data)
+        if not items_list:
+            return ParsedPage(items_list, has_next, total_pages)
+        loop = asyncio.get_running_loop()
+        with stage_timer('dataframe'):
+            frame = await loop.run_in_executor(self.frame_executor, edit_items_to_df, {name_cat: items_list},
+                                               self.llc_info, self.seller_id, self.dt, False)
+        return ParsedPage(frame, has_next, total_pages)
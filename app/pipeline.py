@@ -0,0 +1,147 @@
+import asyncio
+import contextlib
+import csv
+import heapq
+import tempfile
+import datetime
+from concurrent.futures import Executor
+from pathlib import Path
+from typing import TYPE_CHECKING
+from common import REPORT_COLUMNS, edit_items_to_df, get_report_path
+from metrics import stage_timer, current_metrics
+from writers import CsvReportWriter, get_writer_class
+from snapshots import SnapshotIngest
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+# число строк в одном отсортированном фрагменте внешней сортировки
+SORT_CHUNK_ROWS = 50_000
+
+
+def report_sort_key(row: list) -> tuple:
+    """
+    Ключ сортировки как в edit_items_to_df: категория по возрастанию, акционная цена по убыванию, пустые цены в конце
+    """
+    price = row[REPORT_COLUMNS.index('price_promo')]
+    return row[REPORT_COLUMNS.index('category_path')], price == '', -int(price or 0)
+
+
+def iter_sorted_rows(src: Path, chunk_rows: int = SORT_CHUNK_ROWS):
+    """
+    Внешняя сортировка csv: отсортированные фрагменты во временной папке + слияние без загрузки файла в память
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir, open(src, newline='', encoding='utf-8') as src_file:
+        reader = csv.reader(src_file)
+        next(reader)
+        # нарезаем исходный файл на отсортированные фрагменты
+        run_paths = []
+        while True:
+            chunk = [row for _, row in zip(range(chunk_rows), reader)]
+            if not chunk:
+                break
+            chunk.sort(key=report_sort_key)
+            run_path = Path(tmp_dir) / f'run_{len(run_paths)}.csv'
+            with open(run_path, 'w', newline='', encoding='utf-8') as run_file:
+                csv.writer(run_file).writerows(chunk)
+            run_paths.append(run_path)
+        # сливаем фрагменты
+        run_files = [open(run_path, newline='', encoding='utf-8') for run_path in run_paths]
+        try:
+            yield from heapq.merge(*(csv.reader(f) for f in run_files), key=report_sort_key)
+        finally:
+            for run_file in run_files:
+                run_file.close()
+
+
+def frame_from_rows(rows: list[list]) -> 'pd.DataFrame':
+    """
+    Восстановление типов колонок отчета для строк, прочитанных из промежуточного csv
+    """
+    import pandas as pd
+    df = pd.DataFrame(rows, columns=REPORT_COLUMNS, dtype='string').replace('', pd.NA)
+    return df.astype({'shop': 'category', 'datetime': 'datetime64[ns]', 'price_reg': 'Int64',
+                      'price_promo': 'Int64', 'category_path': 'category', 'rating': 'Float64',
+                      'reviews': 'Int64'})
+
+
+def write_sorted_report(src: Path, dst: Path, fmt: str, chunk_rows: int = SORT_CHUNK_ROWS):
+    """
+    Итоговый отчет выбранного формата из промежуточного csv через внешнюю сортировку
+    """
+    with get_writer_class(fmt)(dst) as writer:
+        batch = []
+        for row in iter_sorted_rows(src, chunk_rows):
+            batch.append(row)
+            if len(batch) >= chunk_rows:
+                writer.write_frame(frame_from_rows(batch))
+                batch = []
+        if batch:
+            writer.write_frame(frame_from_rows(batch))
+
+
+async def stream_items_to_report(pages, llc_info: str | bool, seller_id: str, sort_output: bool = True,
+                                 executor: Executor = None, fmt: str = 'csv', snapshot: SnapshotIngest = None,
+                                 dt: str = None) -> Path:
+    """
+    Потоковая запись: каждая страница из асинхронного генератора (категория, товары) сразу
+    превращается в дата-фрейм и дописывается в отчет, в памяти хранятся только страницы в очереди сбора.
+    Страницы, уже разобранные в пуле процессов (PageParser), приходят готовыми дата-фреймами.
+    При переданном executor (пул процессов) сборка дата-фреймов уходит из цикла событий.
+    При переданном snapshot каждая страница сверяется с прошлым снимком цен продавца
+    """
+    loop = asyncio.get_running_loop()
+    metrics = current_metrics()
+    # формирование даты сбора
+    if dt is None:
+        dt = str(datetime.datetime.now().replace(microsecond=0))
+    writer_class = get_writer_class(fmt)
+    report_path = get_report_path(seller_id, writer_class.extension)
+    # при сортировке пишем поток в промежуточный csv, итоговый отчет собираем внешней сортировкой
+    if sort_output:
+        stream_path = report_path.with_name(f'{report_path.name}.unsorted.csv')
+        stream_writer = CsvReportWriter(stream_path)
+    else:
+        stream_path = report_path
+        stream_writer = writer_class(report_path)
+    try:
+        # генератор страниц закрывается явно: при ошибке записи сбор останавливается сразу
+        async with contextlib.aclosing(pages):
+            with stream_writer:
+                async for name_cat, items_list in pages:
+                    if not isinstance(items_list, list):
+                        # дата-фрейм уже собран в пуле разбора
+                        df = items_list
+                    else:
+                        with stage_timer('dataframe'):
+                            if executor is not None:
+                                df = await loop.run_in_executor(executor, edit_items_to_df,
+                                                                {name_cat: items_list}, llc_info, seller_id, dt,
+                                                                False)
+                            else:
+                                df = edit_items_to_df({name_cat: items_list}, llc_info, seller_id, dt=dt,
+                                                      sort=False)
+                    if df is not False:
+                        if metrics is not None:
+                            metrics.field_misses.update(df.attrs.get('field_misses', {}))
+                        with stage_timer('save'):
+                            stream_writer.write_frame(df)
+                        if snapshot is not None:
+                            with stage_timer('snapshot'):
+                                snapshot.add_frame(df)
+        if sort_output:
+            with stage_timer('save'):
+                if executor is not None:
+                    await loop.run_in_executor(executor, write_sorted_report, stream_path, report_path, fmt)
+                else:
+                    write_sorted_report(stream_path, report_path, fmt)
+    except BaseException:
+        # недописанный отчет не оставляем
+        report_path.unlink(missing_ok=True)
+        raise
+    finally:
+        # промежуточный файл не нужен ни после сортировки, ни после ошибки
+        if sort_output:
+            stream_path.unlink(missing_ok=True)
+    return report_path
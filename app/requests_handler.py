@@ -1,4 +1,5 @@
-import datetime
+import logging
+import time
 import httpx
 from enum import Enum
 import asyncio
@@ -6,17 +7,33 @@ import json
 import os
 from pathlib import Path
 from common import cookies_str_to_dict
+from decoder import loads
+from cache import CacheRun
+from retry import RetryPolicy, ErrorAction, AdaptiveLimiter
+from metrics import current_metrics, stage_timer
+from sessions import SessionPool, NoSessionError
 from pydantic import BaseModel, Field
 import re
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
 
 # Удаляем загрузку переменных окружения, так как теперь будем использовать settings.txt
 # load_dotenv()
 
 
+# шаблоны разбора curl-команды (компилируются один раз, одинарные и двойные кавычки)
+CURL_URL_PATTERN = re.compile(r"curl '([^']+)'" r'|curl "([^"]+)"')
+CURL_HEADER_PATTERN = re.compile(r"-H '([^:']+): ([^']*)'" r'|-H "([^:"]+): ([^"]*)"')
+CURL_COOKIE_PATTERN = re.compile(r"-b '([^']+)'" r'|-b "([^"]+)"')
+
+
 # Функция для парсинга curl-команды из settings.txt
+@lru_cache(maxsize=None)
 def parse_curl_command(file_path=None):
     """
     Парсит curl-команду из текстового файла и извлекает URL, заголовки и cookies.
+    Результат запоминается: повторный вызов для того же файла не читает и не разбирает его заново.
     
     Args:
         file_path: Путь к файлу с curl-командой
@@ -37,14 +54,11 @@ def parse_curl_command(file_path=None):
             curl_text = f.read().strip()
         
         # Извлекаем URL
-        url_match = re.search(r"curl '([^']+)'", curl_text)
-        if not url_match:
-            url_match = re.search(r'curl "([^"]+)"', curl_text)
-        
+        url_match = CURL_URL_PATTERN.search(curl_text)
         if not url_match:
             raise ValueError("URL не найден в curl-команде")
             
-        url = url_match.group(1)
+        url = url_match.group(1) or url_match.group(2)
         
         # Извлекаем базовый URL API
         base_url_parts = url.split('/api/')
@@ -53,23 +67,17 @@ def parse_curl_command(file_path=None):
         
         # Извлекаем заголовки
         headers = {}
-        header_matches = re.finditer(r"-H '([^:]+): ([^']+)'", curl_text)
-        if not header_matches:
-            header_matches = re.finditer(r'-H "([^:]+): ([^"]+)"', curl_text)
-            
-        for match in re.finditer(r"-H '([^:]+): ([^']+)'", curl_text):
-            header_name = match.group(1)
-            header_value = match.group(2)
-            headers[header_name] = header_value
+        for match in CURL_HEADER_PATTERN.finditer(curl_text):
+            if match.group(1) is not None:
+                headers[match.group(1)] = match.group(2)
+            else:
+                headers[match.group(3)] = match.group(4)
             
         # Извлекаем cookies
         cookies = {}
-        cookie_match = re.search(r"-b '([^']+)'", curl_text)
-        if not cookie_match:
-            cookie_match = re.search(r'-b "([^"]+)"', curl_text)
-            
+        cookie_match = CURL_COOKIE_PATTERN.search(curl_text)
         if cookie_match:
-            cookie_string = cookie_match.group(1)
+            cookie_string = cookie_match.group(1) or cookie_match.group(2)
             cookies = dict(cookie.split('=', 1) for cookie in cookie_string.split('; '))
         
         return {
@@ -80,7 +88,7 @@ def parse_curl_command(file_path=None):
             'cookies': cookies
         }
     except Exception as e:
-        print(f"Ошибка при парсинге curl-команды: {e}")
+        logger.error(f"Ошибка при парсинге curl-команды: {e}")
         return None
 
 # Загружаем настройки из settings.txt
@@ -103,6 +111,122 @@ HEADERS = CURL_DATA['headers']
 COOKIES = CURL_DATA['cookies']
 
 
+# лимиты пула соединений (один долгоживущий клиент на домен)
+POOL_MAX_CONNECTIONS = 20
+POOL_MAX_KEEPALIVE = 10
+POOL_KEEPALIVE_EXPIRY = 30.0
+
+
+class RateLimiter:
+    """
+    Ограничитель частоты запросов (token bucket), общий для всех запросов цикла событий
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class ClientPool:
+    """
+    Пул долгоживущих асинхронных клиентов: один клиент (со своим пулом соединений) на домен
+    """
+
+    def __init__(self, max_connections: int = POOL_MAX_CONNECTIONS, max_keepalive: int = POOL_MAX_KEEPALIVE,
+                 keepalive_expiry: float = POOL_KEEPALIVE_EXPIRY, http2: bool = True, rate_limit: float = None,
+                 http1: bool = True):
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_keepalive,
+                                   keepalive_expiry=keepalive_expiry)
+        self.http2 = http2
+        # http1=False - только HTTP/2, в том числе по http:// без TLS (prior knowledge, для локальной имитации)
+        self.http1 = http1
+        self._clients: dict[tuple, httpx.AsyncClient] = {}
+        self.max_connections = max_connections
+        self.rate_limiter = None
+        self.set_rate_limit(rate_limit)
+        # адаптивный лимит одновременных запросов, общий для всех клиентов пула
+        self.congestion = AdaptiveLimiter(max_connections)
+
+    def set_rate_limit(self, rate_limit: float | None):
+        """
+        Общий лимит запросов в секунду для всех клиентов пула (None - без ограничения)
+        """
+        self.rate_limiter = RateLimiter(rate_limit) if rate_limit else None
+
+    async def acquire(self):
+        """
+        Ожидание разрешения на запрос в рамках адаптивного лимита параллельности и общего лимита частоты
+        """
+        await self.congestion.acquire()
+        if self.rate_limiter is not None:
+            try:
+                await self.rate_limiter.acquire()
+            except BaseException:
+                self.congestion.release()
+                raise
+
+    def release(self, throttled: bool = False):
+        """
+        Освобождение разрешения; throttled - сервер просил снизить нагрузку (429)
+        """
+        self.congestion.release(throttled=throttled)
+
+    def get_client(self, url: str, cookies: dict, headers: dict, profile: str = 'default') -> httpx.AsyncClient:
+        """
+        Получение (или создание) клиента для домена адреса и набора куки
+        """
+        key = (httpx.URL(url).host, profile)
+        client = self._clients.get(key)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(cookies=cookies, headers=headers, follow_redirects=True, timeout=30.0,
+                                       http1=self.http1, http2=self.http2, limits=self.limits)
+            self._clients[key] = client
+        return client
+
+    async def aclose(self):
+        """
+        Закрытие всех клиентов пула (клиенты привязаны к циклу событий, поэтому закрываем в конце цикла)
+        """
+        clients = list(self._clients.values())
+        self._clients.clear()
+        await asyncio.gather(*(client.aclose() for client in clients))
+        # примитивы синхронизации тоже привязаны к циклу событий, пересоздаем их для следующего
+        self.congestion = AdaptiveLimiter(self.max_connections)
+        if self.rate_limiter is not None:
+            self.set_rate_limit(self.rate_limiter.rate)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+
+# общий пул клиентов для всех вызовов send_request
+CLIENT_POOL = ClientPool()
+
+# политика повторов по умолчанию
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+# заголовки ответа, сохраняемые для условных запросов (If-None-Match / If-Modified-Since)
+VALIDATOR_HEADERS = ('etag', 'last-modified')
+
+
 # типы запросов (изначально было не ясно какие будут нужны)
 class RequestTypes(Enum):
     """
@@ -118,41 +242,53 @@ class Response(BaseModel):
     Модель ответа после опроса ресурса
     """
     status: bool = Field(description='Статус успешного или неуспешного выполнения')
-    object: str | dict | None = Field(description='Строка если возвращается страница или словарь если был обработан json')
+    object: str | dict | bytes | None = Field(description='Строка если возвращается страница, словарь если был '
+                                                          'обработан json, байты если запрошено тело без разбора')
+    status_code: int | None = Field(default=None, description='Код последнего ответа сервера (None - из кэша '
+                                                              'или без ответа)')
+    validators: dict = Field(default={}, description='Валидаторы ответа для условных запросов: etag, last-modified')
 
 
-def gen_params_for_items(input_url: str, page: int) -> dict| bool:
+class RequestContext:
     """
-    Формирование параметров запроса для получения товаров
+    Подготовленные один раз на продавца данные запросов: части адреса, адрес api, базовые параметры,
+    куки и заголовки. Запросы страниц только копируют шаблон параметров категории с номером страницы
     """
-    try:
+
+    def __init__(self, input_url: str, domain: str = None, cookies_str: str = None, headers: dict = None,
+                 sessions: SessionPool = None):
         url_splitted = input_url.split('/')
-        id_seller = url_splitted[4].split('-')[1]
-        return {
-            "url": f"/seller/{url_splitted[4]}/{url_splitted[5]}/",
+        self.input_url = input_url
+        self.domain = domain
+        self.seller_slug = url_splitted[4]
+        self.seller_num = self.seller_slug.split('-')[1]
+        self.api_url = get_url_api(domain)
+        # куки разбираются один раз; свой набор куки - отдельный клиент в пуле
+        self.cookies = cookies_str_to_dict(cookies_str) if cookies_str is not None else COOKIES
+        self.profile = cookies_str if cookies_str is not None else 'default'
+        self.headers = headers
+        # пул сессий: куки и заголовки выбираются на каждую попытку запроса
+        self.sessions = sessions
+        self.llc_params = {
+            "url": "/modal/shop-in-shop-info",
+            "seller_id": self.seller_num,
+            "page_changed": "true"
+        }
+        self._items_params = {
             "layout_container": "categorySearchMegapagination",
             "layout_page_index": "3",
-            "miniapp": f"seller_{id_seller}",
-            "page": str(page)
+            "miniapp": f"seller_{self.seller_num}",
         }
-    except Exception:
-        return False
 
+    def category_params(self, url_cat: str) -> dict:
+        """
+        Шаблон параметров запроса товаров категории (без номера страницы)
+        """
+        return {"url": f"/seller/{self.seller_slug}/{url_cat}/", **self._items_params}
 
-def gen_params_for_llc_info(input_url: str) -> dict | bool:
-    """
-    Формирование параметров запроса для получения информации ЮЛ
-    """
-    try:
-        url_splitted = input_url.split('/')
-        id_seller = url_splitted[4].split('-')[1]
-    except Exception:
-        return False
-    return {
-        "url": "/modal/shop-in-shop-info",
-        "seller_id": str(id_seller),
-        "page_changed": "true"
-    }
+    @staticmethod
+    def page_params(category_params: dict, page: int) -> dict:
+        return {**category_params, "page": str(page)}
 
 
 def get_url_api(domain: str) -> str:
@@ -167,9 +303,38 @@ def get_url_api(domain: str) -> str:
     return f"{base_url}{api_path}"
 
 
+def decode_body(body: bytes, json_loads: bool, raw: bool = False) -> str | dict | bytes | None:
+    """
+    Конвертация тела ответа: json в объект (сразу из байтов, без декодирования текста), текст страницы
+    или сами байты (разбор на стороне вызывающего, например в пуле процессов)
+    """
+    if raw:
+        return body
+    if json_loads is True:
+        try:
+            with stage_timer('json'):
+                return loads(body)
+        except Exception:
+            return None
+    return body.decode('utf-8', errors='replace')
+
+
+def is_valid_body(body: bytes, response_object, json_loads: bool, raw: bool) -> bool:
+    """
+    Тело ответа нужного формата: для json - разобранный объект, для байтов без разбора - начало документа json
+    """
+    if not json_loads:
+        return True
+    if raw:
+        return body.lstrip()[:1] in (b'{', b'[')
+    return response_object is not None
+
+
 async def send_request(cookies_str: str = None, headers=None, type_: RequestTypes = RequestTypes.GET,
                        url: str = None, params: dict = None, data: dict = None, json_loads: bool = True,
-                       max_attempts: int = 5, domain: str = None) -> Response | None:
+                       max_attempts: int = None, domain: str = None, pool: ClientPool = None,
+                       cache: CacheRun = None, retry_policy: RetryPolicy = None,
+                       context: RequestContext = None, raw: bool = False) -> Response | None:
     """
     Отправка запроса (дефолтная функция)
     :param cookies_str: куки в формате строки (если None, используются куки из settings.txt)
@@ -179,19 +344,32 @@ async def send_request(cookies_str: str = None, headers=None, type_: RequestType
     :param params: параметры
     :param data: тело запроса
     :param json_loads: флажок конвертации json в объект пайтон
-    :param max_attempts: число попыток
+    :param max_attempts: число попыток (по умолчанию из политики повторов)
     :param domain: домен для запросов по апи
+    :param pool: пул клиентов (по умолчанию общий CLIENT_POOL)
+    :param cache: дисковый кэш ответов текущего запуска (только для GET)
+    :param retry_policy: политика повторов (по умолчанию DEFAULT_RETRY_POLICY)
+    :param context: подготовленный контекст продавца (адрес api, куки и заголовки без повторного разбора)
+    :param raw: вернуть тело ответа байтами без разбора json
     :return: статус + данные
     """
     # предварительная подготовка заголовков, куки, тела запроса
-    if headers is None:
-        headers = HEADERS
-    
+    # (явно переданные заголовки отправляются с запросом поверх заголовков клиента из пула)
+    request_headers = headers
+    if context is not None:
+        # все уже подготовлено в контексте продавца
+        if request_headers is None:
+            request_headers = context.headers
+        cookies_dict, profile = context.cookies, context.profile
+        if url is None:
+            url = context.api_url
     # Используем куки из settings.txt, если не переданы явно
-    if cookies_str is not None:
+    elif cookies_str is not None:
         cookies_dict = cookies_str_to_dict(cookies_str)
+        profile = cookies_str
     else:
         cookies_dict = COOKIES
+        profile = 'default'
     
     if data is not None:
         data_json = json.dumps(data)
@@ -201,46 +379,104 @@ async def send_request(cookies_str: str = None, headers=None, type_: RequestType
     if url is None:
         url = get_url_api(domain)
     
-    # инициализация асинхронного клиента с настройками
-    client_params = {
-        'cookies': cookies_dict,
-        'headers': headers,
-        'follow_redirects': True,
-        'timeout': 30.0,
-        'http2': True,
-    }
-    
-    async with httpx.AsyncClient(**client_params) as client:
-        while True:
-            # проверка на число ошибок
-            max_attempts -= 1
-            if max_attempts <= 0:
-                return Response(status=False, object=None)
-            # запрос
+    # ответ из дискового кэша, если он есть
+    if cache is not None and type_ == RequestTypes.GET:
+        body = cache.get(url, params)
+        if body is not None:
+            response_object = decode_body(body, json_loads, raw)
+            # тело не того формата (сохранено до проверки ответов) запрашивается заново
+            if is_valid_body(body, response_object, json_loads, raw):
+                return Response(status=True, object=response_object)
+    else:
+        cache = None
+
+    # берем долгоживущий клиент из пула (соединения и TLS-сессии переиспользуются между запросами)
+    if pool is None:
+        pool = CLIENT_POOL
+    sessions = context.sessions if context is not None else None
+    session = None
+    if sessions is None:
+        client = pool.get_client(url, cookies=cookies_dict, headers=HEADERS, profile=profile)
+
+    if retry_policy is None:
+        retry_policy = DEFAULT_RETRY_POLICY
+    if max_attempts is None:
+        max_attempts = retry_policy.max_attempts
+
+    attempt = 0
+    while True:
+        attempt += 1
+        retry_after = None
+        # при пуле сессий клиент (куки и заголовки) выбирается на каждую попытку
+        if sessions is not None:
             try:
-                if type_ == RequestTypes.GET:
-                    r = await client.get(url, params=params, timeout=120)
-                elif type_ == RequestTypes.POST:
-                    r = await client.post(url, params=params, data=data_json, timeout=120)
-                print(f'{datetime.datetime.now()} status_code: {r.status_code}')
-            except Exception as e:
-                print(f"Ошибка запроса: {e}")
+                session = sessions.choose()
+            except NoSessionError as e:
+                logger.error(e)
                 return Response(status=False, object=None)
-            # распознавание кодов ответа сервера
-            if 200 <= r.status_code <= 299:
-                # конвертация json в объект
-                if json_loads is True:
-                    try:
-                        r_object = json.loads(r.text)
-                    except Exception:
-                        r_object = None
-                else:
-                    r_object = r.text
-                return Response(status=True, object=r_object)
-            elif 300 <= r.status_code <= 400:
-                return Response(status=False, object=None)
-            elif 500 <= r.status_code <= 599:
-                await asyncio.sleep(5)
+            if (cooldown := session.cooldown_until - time.monotonic()) > 0:
+                await asyncio.sleep(cooldown)
+            client = pool.get_client(url, cookies=session.cookies, headers=session.headers, profile=session.name)
+        # запрос в рамках общих лимитов пула
+        await pool.acquire()
+        throttled = False
+        started = time.perf_counter()
+        try:
+            if type_ == RequestTypes.GET:
+                r = await client.get(url, params=params, headers=request_headers, timeout=120)
+            elif type_ == RequestTypes.POST:
+                r = await client.post(url, params=params, headers=request_headers, content=data_json,
+                                      timeout=120)
+            throttled = r.status_code == 429
+            logger.debug(f'status_code: {r.status_code} {url}')
+        except Exception as e:
+            r = None
+            logger.warning(f"Ошибка запроса: {e}")
+        finally:
+            pool.release(throttled=throttled)
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.observe_request(time.perf_counter() - started, r.status_code if r is not None else None,
+                                    len(r.content) if r is not None else 0, attempt)
+        status_code = r.status_code if r is not None else None
+        if status_code is not None and status_code not in range(200, 300):
+            retry_after = r.headers.get('Retry-After')
+        # учет ответа по сессии: 403 или перенаправление запроса api (проверка на бота) - карантин сессии
+        # и сразу повтор с другой, 429 - пауза только этой сессии
+        if session is not None:
+            cooldown = retry_policy.delay(attempt, retry_after) if status_code == 429 else 0.0
+            redirected = r is not None and json_loads and bool(r.history)
+            if sessions.report(session, status_code, redirected, cooldown):
+                if attempt >= max_attempts:
+                    return Response(status=False, object=None)
                 continue
-            else:
-                return Response(status=False, object=None)
+        # распознавание кодов ответа сервера
+        if r is None:
+            action = retry_policy.action_for(None)
+        elif 200 <= r.status_code <= 299:
+            response_object = decode_body(r.content, json_loads, raw)
+            valid = is_valid_body(r.content, response_object, json_loads, raw)
+            if not json_loads or (valid and not r.history):
+                # в кэш попадают только ответы без перенаправлений и с телом нужного формата
+                # (иначе при продолжении запуска страница проверки на бота отдавалась бы из кэша)
+                if cache is not None and valid:
+                    cache.set(url, params, r.content)
+                validators = {name: r.headers[name] for name in VALIDATOR_HEADERS if name in r.headers}
+                return Response(status=True, object=response_object, status_code=r.status_code,
+                                validators=validators)
+            # запрос api перенаправлен (клиент следует перенаправлениям) или вместо json пришла страница
+            # (проверка на бота) - реакция как на перенаправление
+            action = retry_policy.action_for(r.history[0].status_code if r.history else '3xx')
+        else:
+            action = retry_policy.action_for(r.status_code)
+        # проверка на число ошибок и реакцию на ошибку
+        if action == ErrorAction.FAIL or attempt >= max_attempts:
+            return Response(status=False, object=None, status_code=status_code)
+        if action == ErrorAction.THROTTLE and session is not None:
+            # пауза уже назначена только этой сессии, повтор сразу с другой
+            continue
+        delay = retry_policy.delay(attempt, retry_after)
+        if action == ErrorAction.THROTTLE:
+            # сервер просит снизить нагрузку - замедляем все запросы, а не только этот
+            pool.congestion.pause(delay)
+        await asyncio.sleep(delay)
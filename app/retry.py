@@ -0,0 +1,110 @@
+import asyncio
+import datetime
+import random
+import time
+from email.utils import parsedate_to_datetime
+from enum import Enum
+from pydantic import BaseModel, Field
+
+
+class ErrorAction(Enum):
+    """
+    Реакция на ошибку запроса
+    """
+    RETRY = 'retry'
+    THROTTLE = 'throttle'
+    FAIL = 'fail'
+
+
+class RetryPolicy(BaseModel):
+    """
+    Политика повторов: экспоненциальная задержка со случайным разбросом и реакции по классам ошибок
+    """
+    max_attempts: int = Field(default=5, description='Всего попыток, включая первую')
+    base_delay: float = Field(default=0.5, description='Задержка перед первым повтором, с')
+    max_delay: float = Field(default=30.0, description='Верхняя граница задержки, с')
+    jitter: float = Field(default=0.5, description='Доля задержки, выбираемая случайно (0 - без разброса)')
+    max_retry_after: float = Field(default=120.0, description='Верхняя граница ожидания по Retry-After, с')
+    actions: dict[str, ErrorAction] = Field(
+        default={'network': ErrorAction.RETRY, '429': ErrorAction.THROTTLE, '5xx': ErrorAction.RETRY,
+                 '3xx': ErrorAction.FAIL, '4xx': ErrorAction.FAIL},
+        description='Реакция по классу ошибки: network, точный код (например 429) или класс кодов (5xx)')
+
+    def action_for(self, status_code: int | str | None) -> ErrorAction:
+        """
+        Реакция на ошибку: None - сетевая ошибка, строка - класс ошибки (например 3xx), иначе код ответа
+        """
+        if status_code is None:
+            return self.actions.get('network', ErrorAction.FAIL)
+        if isinstance(status_code, str):
+            return self.actions.get(status_code, ErrorAction.FAIL)
+        action = self.actions.get(str(status_code))
+        if action is None:
+            action = self.actions.get(f'{status_code // 100}xx', ErrorAction.FAIL)
+        return action
+
+    def delay(self, attempt: int, retry_after: str | None = None) -> float:
+        """
+        Задержка перед повтором номер attempt (с 1); заголовок Retry-After имеет приоритет
+        """
+        seconds = parse_retry_after(retry_after)
+        if seconds is not None:
+            return min(seconds, self.max_retry_after)
+        delay = min(self.base_delay * 2 ** (attempt - 1), self.max_delay)
+        return delay * (1 - self.jitter * random.random())
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """
+    Разбор заголовка Retry-After: число секунд или дата HTTP
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        moment = parsedate_to_datetime(value)
+        return max((moment - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0.0)
+    except Exception:
+        return None
+
+
+class AdaptiveLimiter:
+    """
+    Адаптивный лимит одновременных запросов (AIMD): плавный рост при успехах,
+    двукратное снижение и общая пауза при ответах 429 - для всех запросов сразу
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = 1, decrease: float = 0.5):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.decrease = decrease
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._changed = asyncio.Event()
+
+    async def acquire(self):
+        # общая пауза после ответа 429
+        while (pause := self.paused_until - time.monotonic()) > 0:
+            await asyncio.sleep(pause)
+        while self.in_flight >= int(self.limit):
+            self._changed.clear()
+            await self._changed.wait()
+        self.in_flight += 1
+
+    def release(self, throttled: bool = False):
+        self.in_flight -= 1
+        if throttled:
+            self.limit = max(self.min_limit, self.limit * self.decrease)
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self._changed.set()
+
+    def pause(self, seconds: float):
+        """
+        Общее замедление: новые запросы не начинаются, пока не пройдет пауза
+        """
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
@@ -0,0 +1,119 @@
+import itertools
+import logging
+import time
+from pathlib import Path
+from pydantic import BaseModel, Field
+
+
+logger = logging.getLogger(__name__)
+
+# время карантина сессии после 403 или перенаправления на проверку, с
+QUARANTINE_SECONDS = 600.0
+# стратегии выбора сессии
+SESSION_STRATEGIES = ('round_robin', 'least_throttled')
+
+
+class NoSessionError(RuntimeError):
+    """
+    Все сессии пула в карантине
+    """
+
+
+class Session(BaseModel):
+    """
+    Одна сессия браузера: куки и заголовки из curl-команды и счетчики запросов
+    """
+    name: str = Field(description='Имя сессии (ключ клиента в пуле соединений)')
+    cookies: dict = Field(default={}, description='Куки сессии')
+    headers: dict = Field(default={}, description='Заголовки сессии')
+    requests: int = Field(default=0, description='Отправлено запросов')
+    throttled: int = Field(default=0, description='Ответов 429')
+    blocked: int = Field(default=0, description='Ответов 403 и перенаправлений на проверку')
+    last_throttled: float = Field(default=0.0, description='Момент последнего 429 (time.monotonic)')
+    cooldown_until: float = Field(default=0.0, description='До какого момента сессию лучше не использовать')
+    quarantined_until: float = Field(default=0.0, description='До какого момента сессия в карантине')
+
+    def is_quarantined(self, now: float) -> bool:
+        return self.quarantined_until > now
+
+
+class SessionPool:
+    """
+    Пул сессий из нескольких curl-команд: запросы распределяются по сессиям по кругу или в пользу
+    сессии, дольше всех не получавшей 429; сессии, получившие 403 или перенаправление, уходят в карантин
+    """
+
+    def __init__(self, sessions: list[Session], strategy: str = 'round_robin',
+                 quarantine_seconds: float = QUARANTINE_SECONDS):
+        if not sessions:
+            raise ValueError('Пул сессий пуст')
+        if strategy not in SESSION_STRATEGIES:
+            raise ValueError(f'Неизвестная стратегия выбора сессии: {strategy}, доступны: {SESSION_STRATEGIES}')
+        self.sessions = sessions
+        self.strategy = strategy
+        self.quarantine_seconds = quarantine_seconds
+        self._order = itertools.cycle(range(len(sessions)))
+
+    @classmethod
+    def from_files(cls, paths: list[str], **kwargs) -> 'SessionPool':
+        """
+        Пул из файлов с curl-командами (формат как у settings.txt), имя сессии - имя файла
+        """
+        from requests_handler import parse_curl_command
+        sessions = []
+        for path in paths:
+            curl_data = parse_curl_command(Path(path))
+            if curl_data is None:
+                logger.warning(f'сессия {path} пропущена: не удалось разобрать curl-команду')
+                continue
+            sessions.append(Session(name=Path(path).name, cookies=curl_data['cookies'],
+                                    headers=curl_data['headers']))
+        return cls(sessions, **kwargs)
+
+    def choose(self) -> Session:
+        """
+        Выбор сессии для запроса; если все доступные сессии на паузе после 429, берется та, чья пауза
+        кончится раньше (ожидание - на стороне вызывающего)
+        """
+        now = time.monotonic()
+        available = [session for session in self.sessions if not session.is_quarantined(now)]
+        if not available:
+            raise NoSessionError('Все сессии в карантине')
+        ready = [session for session in available if session.cooldown_until <= now]
+        if not ready:
+            return min(available, key=lambda session: session.cooldown_until)
+        if self.strategy == 'least_throttled':
+            return min(ready, key=lambda session: (session.last_throttled, session.requests))
+        # по кругу, пропуская сессии в карантине и на паузе
+        ready_ids = {id(session) for session in ready}
+        for index in self._order:
+            if id(self.sessions[index]) in ready_ids:
+                return self.sessions[index]
+
+    def report(self, session: Session, status_code: int | None, redirected: bool = False,
+               cooldown: float = 0.0) -> bool:
+        """
+        Учет ответа сессии; возвращает True, если сессия ушла в карантин
+        """
+        now = time.monotonic()
+        session.requests += 1
+        if status_code == 429:
+            session.throttled += 1
+            session.last_throttled = now
+            session.cooldown_until = max(session.cooldown_until, now + cooldown)
+        elif status_code == 403 or redirected:
+            session.blocked += 1
+            # ответы запросов, начатых до карантина, его не продлевают
+            if session.is_quarantined(now):
+                return True
+            session.quarantined_until = now + self.quarantine_seconds
+            logger.warning(f'сессия {session.name} в карантине на {self.quarantine_seconds:.0f} с '
+                           f'({"перенаправление" if redirected else status_code})')
+            return True
+        return False
+
+    def summary(self) -> list[dict]:
+        now = time.monotonic()
+        return [{'name': session.name, 'requests': session.requests, 'throttled': session.throttled,
+                 'blocked': session.blocked, 'quarantined': session.is_quarantined(now)}
+                for session in self.sessions]
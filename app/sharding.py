@@ -0,0 +1,48 @@
+from pydantic import BaseModel, Field
+
+
+# категория, в выдаче которой больше страниц, делится на подкатегории (если они есть в дереве)
+SHARD_PAGES = 50
+
+
+class CategoryTree:
+    """
+    Дерево категорий продавца из плоского списка categoryFilter.categories: за категорией идут
+    ее подкатегории, вложенность задается полем level
+    """
+
+    def __init__(self, categories: list[dict]):
+        # основные категории (level 0): название -> часть адреса
+        self.roots = {}
+        self.titles = {}
+        self.children = {}
+        # путь от корня до текущей категории: (level, часть адреса)
+        path = []
+        for category in categories:
+            slug = category['urlValue'].split('/')[3]
+            level = category.get('level', 0)
+            while path and path[-1][0] >= level:
+                path.pop()
+            if path:
+                self.children.setdefault(path[-1][1], []).append(slug)
+            elif level == 0:
+                self.roots[category['title']] = slug
+            self.titles[slug] = category['title']
+            path.append((level, slug))
+
+    def subcategories(self, slug: str) -> list[str]:
+        return self.children.get(slug, [])
+
+
+class Shard(BaseModel):
+    """
+    Часть обхода категории: сама категория или одна из ее подкатегорий
+    """
+    category: str = Field(description='Категория отчета (category_path), под которой идут товары шарда')
+    slug: str = Field(description='Часть адреса обходимой (под)категории')
+    depth: int = Field(default=0, description='Глубина в дереве относительно категории отчета')
+    children: list[str] = Field(default=[], description='Подкатегории, на которые шард можно разделить')
+    total_pages: int | None = Field(default=None, description='Страниц в выдаче по данным пагинации')
+    pages: int = Field(default=0, description='Страниц с товарами')
+    items: int = Field(default=0, description='Собрано товаров (без повторов)')
+    split: bool = Field(default=False, description='Обход передан подкатегориям')
@@ -0,0 +1,178 @@
+import argparse
+import sqlite3
+import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+# расположение базы снимков по умолчанию
+SNAPSHOTS_PATH = Path(__file__).parent / "snapshots.sqlite"
+
+
+def column_values(series: 'pd.Series') -> list:
+    """
+    Значения колонки дата-фрейма в типах python для sqlite (пропуски pandas -> None)
+    """
+    return series.astype(object).where(series.notna(), None).tolist()
+
+
+class SnapshotStore:
+    """
+    Инкрементальное хранилище цен в SQLite: текущее состояние товаров продавца и журнал изменений
+    (новые, изменившиеся, пропавшие и вернувшиеся товары) с отметками времени
+    """
+
+    def __init__(self, path: Path = SNAPSHOTS_PATH):
+        self._db = sqlite3.connect(path)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS items (
+                seller_id TEXT, article TEXT, name TEXT, category_path TEXT,
+                price_reg INTEGER, price_promo INTEGER,
+                first_seen TEXT, last_seen TEXT, removed INTEGER DEFAULT 0,
+                PRIMARY KEY (seller_id, article)
+            );
+            CREATE TABLE IF NOT EXISTS changes (
+                seller_id TEXT, article TEXT, ts TEXT, kind TEXT,
+                price_reg INTEGER, price_promo INTEGER, old_price_reg INTEGER, old_price_promo INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS changes_article ON changes (article, ts);
+            CREATE INDEX IF NOT EXISTS changes_ts ON changes (ts);
+        ''')
+
+    def start(self, seller_id: str, ts: str = None) -> 'SnapshotIngest':
+        """
+        Начало приема снимка продавца (дата-фреймы можно добавлять по мере сбора)
+        """
+        if ts is None:
+            ts = str(datetime.datetime.now().replace(microsecond=0))
+        return SnapshotIngest(self._db, seller_id, ts)
+
+    def ingest(self, df: 'pd.DataFrame', seller_id: str, ts: str = None) -> dict:
+        """
+        Прием полного снимка (результат edit_items_to_df) одним вызовом
+        """
+        snapshot = self.start(seller_id, ts)
+        snapshot.add_frame(df)
+        return snapshot.finish()
+
+    def price_history(self, article: str, seller_id: str = None) -> list[dict]:
+        """
+        История цен товара по журналу изменений
+        """
+        query = 'SELECT * FROM changes WHERE article = ?'
+        params = [str(article)]
+        if seller_id is not None:
+            query += ' AND seller_id = ?'
+            params.append(seller_id)
+        return [dict(row) for row in self._db.execute(query + ' ORDER BY ts', params)]
+
+    def changes_since(self, ts: str, seller_id: str = None) -> list[dict]:
+        """
+        Все изменения начиная с момента ts (формат 'ГГГГ-ММ-ДД ЧЧ:ММ:СС')
+        """
+        query = 'SELECT * FROM changes WHERE ts >= ?'
+        params = [ts]
+        if seller_id is not None:
+            query += ' AND seller_id = ?'
+            params.append(seller_id)
+        return [dict(row) for row in self._db.execute(query + ' ORDER BY ts', params)]
+
+    def close(self):
+        self._db.close()
+
+
+class SnapshotIngest:
+    """
+    Прием одного снимка: изменения копятся в памяти и пишутся одной транзакцией в finish
+    (при сбое сбора снимок просто не завершается, и неполный обход не помечает товары пропавшими;
+    одновременные снимки разных продавцов в пакетном режиме не смешиваются в одной транзакции)
+    """
+
+    def __init__(self, db: sqlite3.Connection, seller_id: str, ts: str):
+        self._db = db
+        self.seller_id = seller_id
+        self.ts = ts
+        # текущее состояние товаров продавца: артикул -> (цена, акционная цена, пропал ли)
+        self._known = {row[0]: (row[1], row[2], row[3]) for row in db.execute(
+            'SELECT article, price_reg, price_promo, removed FROM items WHERE seller_id = ?', (seller_id,))}
+        self._seen = set()
+        self._changes = []
+        self._upserts = []
+        self.counts = {'new': 0, 'changed': 0, 'removed': 0, 'returned': 0, 'unchanged': 0}
+
+    def add_frame(self, df: 'pd.DataFrame'):
+        for article, name, category_path, price_reg, price_promo in zip(
+                *(column_values(df[column]) for column in ('article', 'name', 'category_path', 'price_reg',
+                                                           'price_promo'))):
+            article = str(article)
+            if article in self._seen:
+                continue
+            self._seen.add(article)
+            known = self._known.get(article)
+            if known is None:
+                kind, old = 'new', (None, None)
+            elif known[2]:
+                kind, old = 'returned', known[:2]
+            elif known[:2] != (price_reg, price_promo):
+                kind, old = 'changed', known[:2]
+            else:
+                self.counts['unchanged'] += 1
+                continue
+            self.counts[kind] += 1
+            self._changes.append((self.seller_id, article, self.ts, kind, price_reg, price_promo, *old))
+            self._upserts.append((self.seller_id, article, name, category_path,
+                                  price_reg, price_promo, self.ts, self.ts))
+
+    def finish(self, mark_removed: bool = True) -> dict:
+        """
+        Завершение снимка: запись изменений, товары, которых не было в снимке, помечаются пропавшими
+        (при mark_removed=False - неполный обход - пропавшие не отмечаются)
+        """
+        removed = []
+        if mark_removed:
+            removed = [article for article, known in self._known.items()
+                       if not known[2] and article not in self._seen]
+        self._changes += [(self.seller_id, article, self.ts, 'removed', None, None, *self._known[article][:2])
+                          for article in removed]
+        self.counts['removed'] = len(removed)
+        with self._db:
+            self._db.executemany('INSERT INTO changes VALUES (?, ?, ?, ?, ?, ?, ?, ?)', self._changes)
+            self._db.executemany('''
+                INSERT INTO items VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)
+                ON CONFLICT (seller_id, article) DO UPDATE SET name = excluded.name,
+                    category_path = excluded.category_path, price_reg = excluded.price_reg,
+                    price_promo = excluded.price_promo, last_seen = excluded.last_seen, removed = 0
+            ''', self._upserts)
+            self._db.executemany('UPDATE items SET last_seen = ? WHERE seller_id = ? AND article = ?',
+                                 [(self.ts, self.seller_id, article) for article in self._seen])
+            self._db.executemany('UPDATE items SET removed = 1 WHERE seller_id = ? AND article = ?',
+                                 [(self.seller_id, article) for article in removed])
+        return self.counts
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Запросы к хранилищу изменений цен')
+    parser.add_argument('--db', default=str(SNAPSHOTS_PATH), help='файл базы снимков')
+    parser.add_argument('--seller', default=None, help='идентификатор продавца (например webmarket-150120)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    history = subparsers.add_parser('history', help='история цен товара')
+    history.add_argument('article')
+    changes = subparsers.add_parser('changes', help='все изменения начиная с момента')
+    changes.add_argument('since', help='момент в формате "ГГГГ-ММ-ДД ЧЧ:ММ:СС" или дата')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    store = SnapshotStore(args.db)
+    if args.command == 'history':
+        rows = store.price_history(args.article, args.seller)
+    else:
+        rows = store.changes_since(args.since, args.seller)
+    store.close()
+    import pandas as pd
+    print(pd.DataFrame(rows).to_string(index=False) if rows else 'нет изменений')
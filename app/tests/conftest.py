@@ -0,0 +1,83 @@
+"""
+Общие фикстуры тестов: пути импорта как при запуске из папки app, локальная имитация Ozon и отчеты сбора
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+APP_DIR = Path(__file__).parent.parent
+sys.path[:0] = [str(APP_DIR), str(APP_DIR / 'benchmarks')]
+
+import requests_handler  # noqa: E402
+from common import get_report_path  # noqa: E402
+from main import get_all_items_ozon  # noqa: E402
+from requests_handler import CLIENT_POOL  # noqa: E402
+from stub_server import OzonStubConfig, start_ozon_stub, stub_seller_url, STUB_SELLER  # noqa: E402
+
+# небольшой магазин имитации: три категории по несколько страниц
+SMALL_CATEGORIES = {'elektronika-15500': 4, 'odezhda-obuv-i-aksessuary-7500': 2, 'dom-i-sad-14500': 5}
+
+
+@pytest.fixture
+def make_stub(monkeypatch):
+    """
+    Запуск имитации Ozon; все запросы сбора (страница продавца и api) уходят на нее
+    """
+    servers = []
+
+    def make(config: OzonStubConfig = None, http2: bool = False):
+        server = start_ozon_stub(config or OzonStubConfig(categories=SMALL_CATEGORIES, items_per_page=10),
+                                 http2=http2)
+        servers.append(server)
+        monkeypatch.setattr(requests_handler, 'BASE_URL', stub_seller_url(server.server_address).split('/seller/')[0])
+        # по http:// httpx говорит на HTTP/2, только если HTTP/1.1 отключен
+        monkeypatch.setattr(CLIENT_POOL, 'http1', not http2)
+        return server
+
+    yield make
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def stub_url(server) -> str:
+    return stub_seller_url(server.server_address)
+
+
+def collect(url: str, **kwargs) -> bool:
+    """
+    Полный сбор в отдельном цикле событий (клиенты пула привязаны к циклу, закрываем их в конце)
+    """
+    async def main():
+        async with CLIENT_POOL:
+            return await get_all_items_ozon(url, **kwargs)
+
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def take_report():
+    """
+    Чтение отчета последнего сбора (отчет и метрики запуска удаляются, следующий сбор пишет свой)
+    """
+    import pandas as pd
+
+    reports_dir = get_report_path(STUB_SELLER).parent
+
+    def remove_reports():
+        for path in reports_dir.glob(f'{STUB_SELLER}_*'):
+            path.unlink()
+
+    def take() -> pd.DataFrame:
+        paths = [path for path in reports_dir.glob(f'{STUB_SELLER}_*.csv')]
+        assert len(paths) == 1, paths
+        df = pd.read_csv(paths[0], dtype=str, keep_default_na=False)
+        remove_reports()
+        return df
+
+    yield take
+    remove_reports()
+    if not any(reports_dir.iterdir()):
+        reports_dir.rmdir()
@@ -0,0 +1,98 @@
+"""
+Кэш ответов (продолжение запуска, TTL, вытеснение), карты категорий и отпечатки страниц
+"""
+import time
+
+from cache import CategoryCache, PageFingerprints, ResponseCache, page_digest
+
+
+def test_resume_continues_unfinished_run(tmp_path):
+    cache = ResponseCache(tmp_path / 'cache.sqlite', ttl=0)
+    run = cache.start_run('seller')
+    run.set('url', {'page': 1}, b'{"page": 1}')
+    cache.close()
+
+    # ответы прерванного запуска доступны ему и после TTL, другим запускам - нет
+    cache = ResponseCache(tmp_path / 'cache.sqlite', ttl=0)
+    resumed = cache.start_run('seller', resume=True)
+    assert resumed.resumed and resumed.run_id == run.run_id
+    assert resumed.get('url', {'page': '1'}) == b'{"page": 1}'
+    fresh = cache.start_run('seller')
+    assert fresh.get('url', {'page': 1}) is None
+    fresh.finish()
+    assert not cache.start_run('other', resume=True).resumed
+    resumed.finish()
+    assert not cache.start_run('seller', resume=True).resumed
+    cache.close()
+
+
+def test_finished_runs_expire(tmp_path):
+    cache = ResponseCache(tmp_path / 'cache.sqlite', ttl=60)
+    run = cache.start_run('seller')
+    run.set('url', None, b'{}')
+    run.finish()
+    # в пределах TTL ответ завершенного запуска достается и следующим
+    assert cache.start_run('seller').get('url', None) == b'{}'
+    cache.close()
+
+    cache = ResponseCache(tmp_path / 'cache.sqlite', ttl=0)
+    assert cache.start_run('seller').get('url', None) is None
+    assert cache._db.execute('SELECT COUNT(*) FROM responses').fetchone()[0] == 0
+    cache.close()
+
+
+def test_stale_unfinished_runs_are_closed(tmp_path):
+    cache = ResponseCache(tmp_path / 'cache.sqlite', ttl=0)
+    run = cache.start_run('seller')
+    run.set('url', None, b'{}')
+    cache.close()
+
+    cache = ResponseCache(tmp_path / 'cache.sqlite', ttl=0, resume_ttl=0)
+    assert not cache.start_run('seller', resume=True).resumed
+    # закрытый запуск и его ответы удалены
+    assert cache._db.execute('SELECT COUNT(*) FROM responses').fetchone()[0] == 0
+    assert cache._db.execute('SELECT COUNT(*) FROM runs WHERE run_id = ?', (run.run_id,)).fetchone()[0] == 0
+    cache.close()
+
+
+def test_eviction_by_size(tmp_path):
+    cache = ResponseCache(tmp_path / 'cache.sqlite', max_bytes=250)
+    run = cache.start_run('seller')
+    for page in range(5):
+        run.set('url', {'page': page}, bytes(100))
+        time.sleep(0.01)
+    cached = [page for page in range(5) if run.get('url', {'page': page}) is not None]
+    # давно не использованные ответы вытесняются, последний остается
+    assert 0 < len(cached) < 5 and 4 in cached
+    cache.close()
+
+
+def test_category_cache(tmp_path):
+    cache = CategoryCache(tmp_path / 'categories.sqlite', ttl=60)
+    assert cache.get('seller') is None
+    cache.set('seller', [{'title': 'a'}], {'etag': '"1"'})
+    cached = cache.get('seller')
+    assert cached.categories == [{'title': 'a'}] and cached.is_fresh(cache.ttl)
+    assert cached.conditional_headers() == {'If-None-Match': '"1"'}
+    assert not cached.is_fresh(0)
+    cache.close()
+
+
+def test_page_fingerprints(tmp_path):
+    digest = page_digest('{"items": []}', 'schema-1')
+    assert digest != page_digest('{"items": []}', 'schema-2')
+    fingerprints = PageFingerprints(tmp_path / 'pages.sqlite')
+    fingerprints.set('seller', 'cat', 1, digest, {'article': ['1']})
+    # до записи в базу строки доступны из памяти
+    assert fingerprints.get('seller', 'cat', 1, digest) == {'article': ['1']}
+    fingerprints.close()
+
+    fingerprints = PageFingerprints(tmp_path / 'pages.sqlite')
+    assert fingerprints.get('seller', 'cat', 1, digest) == {'article': ['1']}
+    assert fingerprints.get('seller', 'cat', 1, page_digest('{"items": [1]}', 'schema-1')) is None
+    assert fingerprints.get('seller', 'cat', 2, digest) is None
+    fingerprints.close()
+    # страницы, не встречавшиеся дольше TTL, удаляются
+    fingerprints = PageFingerprints(tmp_path / 'pages.sqlite', ttl=-1)
+    assert fingerprints.get('seller', 'cat', 1, digest) is None
+    fingerprints.close()
@@ -0,0 +1,142 @@
+"""
+Полный сбор на локальной имитации Ozon: продолжение прерванного запуска, повторы товаров в подкатегориях,
+внешняя сортировка, отпечатки страниц и HTTP/2
+"""
+import asyncio
+import sqlite3
+
+import httpx
+import pytest
+
+from conftest import SMALL_CATEGORIES, collect, stub_url
+from cache import ResponseCache, PageFingerprints
+from crawler import CrawlStats, SkuDedup
+from main import get_all_items_ozon
+from requests_handler import CLIENT_POOL
+from stub_server import OzonStubConfig
+
+ITEMS_PER_PAGE = 10
+TOTAL_PAGES = sum(SMALL_CATEGORIES.values())
+TOTAL_ITEMS = TOTAL_PAGES * ITEMS_PER_PAGE
+
+
+def test_full_crawl(make_stub, take_report):
+    stub = make_stub()
+    stats = CrawlStats()
+    assert collect(stub_url(stub), stats=stats)
+    df = take_report()
+    assert len(df) == TOTAL_ITEMS
+    assert df['article'].is_unique
+    assert stats.items == TOTAL_ITEMS and stats.pages_with_items == TOTAL_PAGES and stats.pages_failed == 0
+    assert stub.counters['page'] == TOTAL_PAGES
+
+
+def test_resume_skips_cached_pages(make_stub, take_report, tmp_path):
+    stub = make_stub(OzonStubConfig(categories=SMALL_CATEGORIES, items_per_page=ITEMS_PER_PAGE, latency=0.02))
+    url = stub_url(stub)
+    cache = ResponseCache(tmp_path / 'cache.sqlite')
+
+    async def interrupted():
+        # прерываем сбор, когда часть страниц уже получена
+        async with CLIENT_POOL:
+            task = asyncio.create_task(get_all_items_ozon(url, cache=cache))
+            while stub.counters['page'] < TOTAL_PAGES // 2:
+                await asyncio.sleep(0.005)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+    try:
+        asyncio.run(interrupted())
+        cache.flush_accessed()
+        # ответы прерванного запуска: страницы выдачи, данные ЮЛ и страница продавца
+        cached = sqlite3.connect(tmp_path / 'cache.sqlite').execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        assert cached > 0
+        before = stub.counters.copy()
+
+        assert collect(url, cache=cache, resume=True)
+        requested = stub.counters - before
+        # каждый полученный ответ запрошен ровно один раз за оба запуска
+        assert requested.total() == TOTAL_PAGES + 2 - cached
+        assert requested['page'] < TOTAL_PAGES
+        assert len(take_report()) == TOTAL_ITEMS
+
+        # запуск завершен: следующий с resume начинается заново
+        assert not cache.start_run('ozon-1', resume=True).resumed
+    finally:
+        cache.close()
+
+
+def test_duplicates_across_subcategories(make_stub, take_report):
+    # выдача категории - товары ее подкатегорий: после деления первая страница категории повторяется в подкатегории
+    config = OzonStubConfig(categories=dict.fromkeys(SMALL_CATEGORIES, 3), items_per_page=ITEMS_PER_PAGE,
+                            subcategories=2)
+    stub = make_stub(config)
+    stats = CrawlStats()
+    assert collect(stub_url(stub), stats=stats, shard_pages=2)
+    unique = len(SMALL_CATEGORIES) * 2 * 3 * ITEMS_PER_PAGE
+    assert stats.duplicates == len(SMALL_CATEGORIES) * ITEMS_PER_PAGE
+    assert stats.items == unique
+    assert sum(shard.split for shard in stats.shards) == len(SMALL_CATEGORIES)
+    df = take_report()
+    assert len(df) == unique and df['article'].is_unique
+
+
+def test_dedup_keys():
+    dedup = SkuDedup()
+    assert dedup.fresh_mask(['1', 1, 'a', 'a', None, '', None]) == [True, False, True, False, True, True, True]
+    assert dedup.filter([{'skuId': '1'}, {'skuId': '2'}, {}]) == [{'skuId': '2'}, {}]
+
+
+def test_sorted_stream_matches_in_memory(make_stub, take_report):
+    stub = make_stub()
+    url = stub_url(stub)
+    assert collect(url, stream=True, sort_output=True)
+    streamed = take_report().drop(columns='datetime')
+    assert collect(url, stream=False)
+    in_memory = take_report().drop(columns='datetime')
+    assert list(streamed.columns) == list(in_memory.columns)
+    # порядок по ключу сортировки совпадает, товары с одинаковым ключом могут идти в другом порядке
+    key = ['category_path', 'price_promo']
+    assert streamed[key].values.tolist() == in_memory[key].values.tolist()
+    columns = list(streamed.columns)
+    assert (streamed.sort_values(columns).values.tolist() == in_memory.sort_values(columns).values.tolist())
+
+
+def test_unchanged_pages_are_reused(make_stub, take_report, tmp_path):
+    stub = make_stub()
+    url = stub_url(stub)
+    fingerprints = PageFingerprints(tmp_path / 'pages.sqlite')
+    try:
+        first, second = CrawlStats(), CrawlStats()
+        assert collect(url, stats=first, fingerprints=fingerprints)
+        parsed = take_report().drop(columns='datetime')
+        assert collect(url, stats=second, fingerprints=fingerprints)
+        reused = take_report().drop(columns='datetime')
+    finally:
+        fingerprints.close()
+    assert (first.fingerprint_hits, first.fingerprint_misses) == (0, TOTAL_PAGES)
+    assert (second.fingerprint_hits, second.fingerprint_misses) == (TOTAL_PAGES, 0)
+    assert reused.values.tolist() == parsed.values.tolist()
+
+
+@pytest.mark.parametrize('http2', [False, True])
+def test_protocol(make_stub, take_report, http2):
+    stub = make_stub(http2=http2)
+    url = stub_url(stub)
+
+    async def version():
+        async with CLIENT_POOL:
+            client = CLIENT_POOL.get_client(url, {}, {})
+            return (await client.get(url)).http_version
+
+    assert asyncio.run(version()) == ('HTTP/2' if http2 else 'HTTP/1.1')
+    assert collect(url)
+    assert len(take_report()) == TOTAL_ITEMS
+
+
+def test_http2_client_requires_prior_knowledge(make_stub):
+    # без отключения HTTP/1.1 клиент по http:// не договорится с сервером HTTP/2
+    stub = make_stub(http2=True)
+    with pytest.raises(httpx.HTTPError):
+        httpx.get(stub_url(stub), timeout=5.0)
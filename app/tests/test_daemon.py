@@ -0,0 +1,58 @@
+"""
+Очередь заданий и расписания службы
+"""
+import time
+
+from batch import SellerResult
+from daemon import JobQueue
+
+URL = 'https://www.ozon.ru/seller/ozon-1/products/'
+
+
+def test_jobs_lifecycle(tmp_path):
+    queue = JobQueue(tmp_path / 'daemon.sqlite')
+    first, second = queue.enqueue(URL), queue.enqueue(URL + '?page=2')
+    assert queue.claim()['id'] == first
+    queue.finish(first, SellerResult(url=URL, status=True, items=10, pages=2))
+    assert queue.get(first)['status'] == 'done' and queue.get(first)['items'] == 10
+    assert queue.claim()['id'] == second
+    queue.finish(second, SellerResult(url=URL, error='boom'))
+    assert queue.get(second)['status'] == 'failed' and queue.get(second)['error'] == 'boom'
+    assert queue.claim() is None
+    assert queue.counts() == {'queued': 0, 'running': 0, 'done': 1, 'failed': 1}
+    assert [job['id'] for job in queue.list_jobs(status='done')] == [first]
+    queue.close()
+
+
+def test_interrupted_jobs_are_requeued(tmp_path):
+    queue = JobQueue(tmp_path / 'daemon.sqlite')
+    job_id = queue.enqueue(URL)
+    queue.claim()
+    queue.close()
+    # служба остановлена во время сбора: задание снова в очереди
+    queue = JobQueue(tmp_path / 'daemon.sqlite')
+    assert queue.get(job_id)['status'] == 'queued'
+    assert queue.claim()['id'] == job_id
+    queue.close()
+
+
+def test_schedules(tmp_path):
+    queue = JobQueue(tmp_path / 'daemon.sqlite')
+    schedule_id = queue.add_schedule(URL, interval=60)
+    # повторное добавление меняет интервал существующего расписания
+    assert queue.add_schedule(URL, interval=120) == schedule_id
+    assert queue.list_schedules()[0]['interval'] == 120
+
+    now = time.time()
+    [job_id] = queue.enqueue_due(now)
+    assert queue.get(job_id)['schedule_id'] == schedule_id
+    assert queue.list_schedules()[0]['next_run'] == now + 120
+    # пока задание не завершено, следующее по расписанию не ставится
+    assert queue.enqueue_due(now + 120) == []
+    queue.finish(queue.claim()['id'], SellerResult(url=URL, status=True))
+    assert len(queue.enqueue_due(now + 240)) == 1
+    assert queue.enqueue_due(now + 241) == []
+
+    assert queue.remove_schedule(schedule_id) and not queue.remove_schedule(schedule_id)
+    assert queue.enqueue_due(now + 10_000) == []
+    queue.close()
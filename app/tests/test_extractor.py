@@ -0,0 +1,59 @@
+"""
+Извлечение полей товара из mainState и счетчики промахов
+"""
+import copy
+
+from extractor import FieldSpec, ItemExtractor, compile_extractor
+from stub_server import make_stub_items
+
+
+def stub_main_state(number: int = 0) -> list:
+    return copy.deepcopy(make_stub_items('cat', 1, number + 1)[number]['mainState'])
+
+
+def test_all_fields():
+    extractor = ItemExtractor()
+    values = dict(zip(extractor.fields, extractor.extract(stub_main_state())))
+    assert values == {'price_promo': '1000 ₽', 'price_reg': '1500 ₽', 'name': 'Товар cat 0',
+                      'rating': '4.0', 'reviews': '0 отзывов', 'delivery': '1 дней',
+                      'badges': 'Оригинал; Распродажа'}
+    assert not extractor.misses
+
+
+def test_optional_fields_are_not_misses():
+    # у товара одна цена и нет плашек
+    main_state = stub_main_state(1)
+    del main_state[0]['atom']['priceV2']['price'][1]
+    extractor = ItemExtractor()
+    values = dict(zip(extractor.fields, extractor.extract(main_state)))
+    assert values['price_reg'] is None and values['badges'] is None
+    assert not extractor.misses
+
+
+def test_changed_structure_is_a_miss():
+    main_state = stub_main_state()
+    # цены переименованы, у названия нет текста
+    main_state[0]['atom']['priceV2']['prices'] = main_state[0]['atom']['priceV2'].pop('price')
+    del main_state[1]['atom']['textAtom']['text']
+    extractor = ItemExtractor()
+    values = dict(zip(extractor.fields, extractor.extract(main_state)))
+    assert values['price_promo'] is None and values['price_reg'] is None and values['name'] is None
+    assert extractor.misses == {'price_promo': 1, 'price_reg': 1, 'name': 1}
+    assert extractor.extract(None) == [None] * len(extractor.fields)
+    assert extractor.items == 2
+
+
+def test_compiled_spec():
+    extract = compile_extractor({
+        'title': FieldSpec(('id', 'name'), ('atom', 'textAtom', 'text')),
+        'number': FieldSpec(('type', 'labelList'), ('atom', 'labelList', 'items', '*', 'title'), pick=r'^\d+$'),
+        'labels': FieldSpec(('type', 'labelList'), ('atom', 'labelList', 'items', '*', 'title'), join=', '),
+    })
+    main_state = [{'id': 'name', 'atom': {'type': 'textAtom', 'textAtom': {'text': 'a'}}},
+                  {'id': 'x', 'atom': {'type': 'labelList', 'labelList': {'items': [{'title': 'b'}, {'title': '7'}]}}},
+                  {'id': 'y', 'atom': {'type': 'labelList', 'labelList': {'items': [{'title': 'c'}]}}}]
+    misses = {'title': 0, 'number': 0, 'labels': 0}
+    # берется первая подходящая строка
+    assert extract(main_state, misses) == ['a', '7', 'b, 7']
+    assert extract(main_state[2:], misses) == [None, None, 'c']
+    assert misses == {'title': 1, 'number': 1, 'labels': 0}
@@ -0,0 +1,58 @@
+"""
+Внешняя сортировка промежуточного csv
+"""
+import csv
+import random
+
+from common import REPORT_COLUMNS
+from pipeline import iter_sorted_rows, report_sort_key, write_sorted_report
+
+
+def make_rows(count: int) -> list[list[str]]:
+    rng = random.Random(1)
+    rows = []
+    for number in range(count):
+        row = dict.fromkeys(REPORT_COLUMNS, '')
+        row.update(shop='shop', datetime='2025-01-01 00:00:00', article=str(number),
+                   category_path=rng.choice(['a', 'b', 'c']),
+                   price_promo=rng.choice(['', str(rng.randint(1, 50))]))
+        rows.append([row[column] for column in REPORT_COLUMNS])
+    return rows
+
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(REPORT_COLUMNS)
+        writer.writerows(rows)
+
+
+def test_external_sort_matches_in_memory(tmp_path):
+    rows = make_rows(200)
+    write_csv(tmp_path / 'report.csv', rows)
+    # фрагменты меньше файла: результат слияния совпадает с сортировкой в памяти (устойчивой)
+    assert list(iter_sorted_rows(tmp_path / 'report.csv', chunk_rows=7)) == sorted(rows, key=report_sort_key)
+
+
+def test_sort_order():
+    index = REPORT_COLUMNS.index
+    ordered = sorted(make_rows(50), key=report_sort_key)
+    categories = [row[index('category_path')] for row in ordered]
+    assert categories == sorted(categories)
+    for category in set(categories):
+        prices = [row[index('price_promo')] for row in ordered if row[index('category_path')] == category]
+        # цены по убыванию, пустые - в конце
+        filled = [int(price) for price in prices if price]
+        assert filled == sorted(filled, reverse=True)
+        assert prices[len(filled):] == [''] * (len(prices) - len(filled))
+
+
+def test_write_sorted_report(tmp_path):
+    import pandas as pd
+
+    rows = make_rows(30)
+    write_csv(tmp_path / 'report.unsorted.csv', rows)
+    write_sorted_report(tmp_path / 'report.unsorted.csv', tmp_path / 'report.csv', 'csv', chunk_rows=4)
+    df = pd.read_csv(tmp_path / 'report.csv', dtype=str, keep_default_na=False)
+    assert df['article'].tolist() == [row[REPORT_COLUMNS.index('article')]
+                                      for row in sorted(rows, key=report_sort_key)]
@@ -0,0 +1,123 @@
+"""
+Политика повторов и реакция send_request на ответы сервера (без сети: ответы дает httpx.MockTransport)
+"""
+import asyncio
+
+import httpx
+import pytest
+
+from cache import ResponseCache
+from requests_handler import ClientPool, send_request
+from retry import ErrorAction, RetryPolicy, parse_retry_after
+
+API_URL = 'https://www.ozon.ru/api/entrypoint-api.bx/page/json/v2'
+NO_DELAY = RetryPolicy(base_delay=0.0, jitter=0.0)
+
+
+class MockPool(ClientPool):
+    """
+    Пул клиентов, запросы которого обрабатывает handler; запросы сохраняются в requests
+    """
+
+    def __init__(self, handler):
+        super().__init__()
+        self.requests = []
+
+        def record(request: httpx.Request) -> httpx.Response:
+            self.requests.append(request)
+            return handler(request, len(self.requests))
+
+        self.transport = httpx.MockTransport(record)
+
+    def get_client(self, url: str, cookies: dict, headers: dict, profile: str = 'default') -> httpx.AsyncClient:
+        key = (httpx.URL(url).host, profile)
+        if key not in self._clients:
+            self._clients[key] = httpx.AsyncClient(transport=self.transport, follow_redirects=True)
+        return self._clients[key]
+
+
+def request(pool: MockPool, **kwargs):
+    async def main():
+        async with pool:
+            return await send_request(url=API_URL, pool=pool, **kwargs)
+
+    return asyncio.run(main())
+
+
+def test_action_for():
+    policy = RetryPolicy()
+    assert policy.action_for(None) == ErrorAction.RETRY
+    assert policy.action_for(429) == ErrorAction.THROTTLE
+    assert policy.action_for(503) == ErrorAction.RETRY
+    assert policy.action_for(404) == ErrorAction.FAIL
+    assert policy.action_for(302) == ErrorAction.FAIL
+    assert policy.action_for('3xx') == ErrorAction.FAIL
+    # точный код важнее класса кодов
+    policy = RetryPolicy(actions={'5xx': ErrorAction.RETRY, '501': ErrorAction.FAIL})
+    assert policy.action_for(501) == ErrorAction.FAIL
+    assert policy.action_for(418) == ErrorAction.FAIL
+
+
+def test_delay():
+    policy = RetryPolicy(base_delay=1.0, max_delay=5.0, jitter=0.0, max_retry_after=10.0)
+    assert [policy.delay(attempt) for attempt in range(1, 6)] == [1.0, 2.0, 4.0, 5.0, 5.0]
+    assert policy.delay(1, '3') == 3.0
+    assert policy.delay(1, '600') == 10.0
+    jittered = RetryPolicy(base_delay=1.0, jitter=0.5)
+    assert all(0.5 <= jittered.delay(1) <= 1.0 for _ in range(100))
+    assert parse_retry_after('abc') is None
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+
+
+def test_retries_server_errors():
+    pool = MockPool(lambda request, number: httpx.Response(503 if number < 3 else 200, json={'ok': number}))
+    response = request(pool, retry_policy=NO_DELAY)
+    assert response.status and response.object == {'ok': 3}
+    assert len(pool.requests) == 3
+
+
+def test_gives_up_after_max_attempts():
+    pool = MockPool(lambda request, number: httpx.Response(503, json={}))
+    response = request(pool, retry_policy=NO_DELAY.model_copy(update={'max_attempts': 4}))
+    assert not response.status and response.status_code == 503
+    assert len(pool.requests) == 4
+
+
+def test_client_error_is_not_retried():
+    pool = MockPool(lambda request, number: httpx.Response(404, json={}))
+    assert not request(pool, retry_policy=NO_DELAY).status
+    assert len(pool.requests) == 1
+
+
+@pytest.mark.parametrize('action', [ErrorAction.FAIL, ErrorAction.RETRY])
+def test_captcha_redirect_is_not_cached(tmp_path, action):
+    # запрос api перенаправлен на страницу проверки на бота: это не ответ, и в кэш он не попадает
+    def handler(request: httpx.Request, number: int) -> httpx.Response:
+        if request.url.path.startswith('/captcha'):
+            return httpx.Response(200, html='<html>captcha</html>')
+        return httpx.Response(302, headers={'Location': 'https://www.ozon.ru/captcha/'})
+
+    cache = ResponseCache(tmp_path / 'cache.sqlite')
+    try:
+        run = cache.start_run('seller')
+        policy = NO_DELAY.model_copy(update={'max_attempts': 2, 'actions': {**NO_DELAY.actions, '3xx': action}})
+        pool = MockPool(handler)
+        assert not request(pool, cache=run, retry_policy=policy).status
+        assert len(pool.requests) == (2 if action == ErrorAction.FAIL else 4)
+        assert run.get(API_URL, None) is None
+    finally:
+        cache.close()
+
+
+def test_invalid_cached_body_is_refetched(tmp_path):
+    cache = ResponseCache(tmp_path / 'cache.sqlite')
+    try:
+        run = cache.start_run('seller')
+        run.set(API_URL, None, b'<html>captcha</html>')
+        pool = MockPool(lambda request, number: httpx.Response(200, json={'fresh': True}))
+        assert request(pool, cache=run).object == {'fresh': True}
+        assert len(pool.requests) == 1
+        # исправленный ответ сохранен и повторно не запрашивается
+        assert request(MockPool(lambda request, number: httpx.Response(500)), cache=run).object == {'fresh': True}
+    finally:
+        cache.close()
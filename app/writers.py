@@ -0,0 +1,207 @@
+import gzip
+import logging
+from pathlib import Path
+from typing import TYPE_CHECKING
+from common import REPORT_COLUMNS, get_report_path
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# число строк, накапливаемых перед записью группы строк parquet / пакета arrow
+ROW_GROUP_ROWS = 50_000
+
+
+def get_report_schema():
+    """
+    Единая схема отчета для колоночных форматов (одинакова во всех снимках, поэтому их можно читать одним набором).
+    Категориальные колонки храним строками: parquet сам кодирует их словарем, а в файле arrow словарь
+    не может меняться между пакетами
+    """
+    import pyarrow as pa
+    return pa.schema([
+        ('shop', pa.string()),
+        ('datetime', pa.timestamp('s')),
+        ('price_reg', pa.int64()),
+        ('price_promo', pa.int64()),
+        ('article', pa.string()),
+        ('name', pa.string()),
+        ('category_path', pa.string()),
+        ('rating', pa.float64()),
+        ('reviews', pa.int64()),
+        ('delivery', pa.string()),
+        ('badges', pa.string()),
+    ])
+
+
+class ReportWriter:
+    """
+    Базовый потоковый писатель отчета: дата-фреймы дописываются по мере поступления
+    """
+    extension = ''
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.rows_written = 0
+
+    def write_frame(self, df: 'pd.DataFrame'):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class CsvReportWriter(ReportWriter):
+    """
+    Запись в csv без сжатия
+    """
+    extension = 'csv'
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+        self._file = self.open_file(path)
+        self._file.write(','.join(REPORT_COLUMNS) + '\n')
+
+    def open_file(self, path: Path):
+        return open(path, 'w', newline='', encoding='utf-8')
+
+    def write_frame(self, df: 'pd.DataFrame'):
+        df.to_csv(self._file, header=False, index=False)
+        self._file.flush()
+        self.rows_written += len(df)
+
+    def close(self):
+        self._file.close()
+
+
+class GzipCsvReportWriter(CsvReportWriter):
+    """
+    Запись в csv со сжатием gzip
+    """
+    extension = 'csv.gz'
+
+    def open_file(self, path: Path):
+        return gzip.open(path, 'wt', newline='', encoding='utf-8')
+
+
+class ZstdCsvReportWriter(CsvReportWriter):
+    """
+    Запись в csv со сжатием zstd (нужен пакет zstandard)
+    """
+    extension = 'csv.zst'
+
+    def open_file(self, path: Path):
+        import zstandard
+        return zstandard.open(path, 'wt', newline='', encoding='utf-8')
+
+
+class ArrowReportWriter(ReportWriter):
+    """
+    Базовый писатель колоночных форматов: строки копятся до ROW_GROUP_ROWS и пишутся пакетом
+    """
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+        self.schema = get_report_schema()
+        self._frames = []
+        self._buffered = 0
+
+    def write_frame(self, df: 'pd.DataFrame'):
+        self._frames.append(df)
+        self._buffered += len(df)
+        self.rows_written += len(df)
+        if self._buffered >= ROW_GROUP_ROWS:
+            self.flush()
+
+    def flush(self):
+        if not self._frames:
+            return
+        import pandas as pd
+        import pyarrow as pa
+        df = pd.concat(self._frames, ignore_index=True)
+        self._frames, self._buffered = [], 0
+        df = df.astype({'shop': 'string', 'category_path': 'string'})
+        self.write_table(pa.Table.from_pandas(df, preserve_index=False).cast(self.schema))
+
+    def write_table(self, table):
+        raise NotImplementedError
+
+    def close(self):
+        self.flush()
+
+
+class ParquetReportWriter(ArrowReportWriter):
+    """
+    Запись в parquet по группам строк (нужен пакет pyarrow)
+    """
+    extension = 'parquet'
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+        import pyarrow.parquet as pq
+        self._writer = pq.ParquetWriter(path, self.schema, compression='zstd')
+
+    def write_table(self, table):
+        self._writer.write_table(table)
+
+    def close(self):
+        super().close()
+        self._writer.close()
+
+
+class FeatherReportWriter(ArrowReportWriter):
+    """
+    Запись в Arrow IPC / Feather v2 пакетами (нужен пакет pyarrow)
+    """
+    extension = 'feather'
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+        import pyarrow as pa
+        self._sink = pa.OSFile(str(path), 'wb')
+        self._writer = pa.ipc.new_file(self._sink, self.schema,
+                                       options=pa.ipc.IpcWriteOptions(compression='zstd'))
+
+    def write_table(self, table):
+        self._writer.write_table(table)
+
+    def close(self):
+        super().close()
+        self._writer.close()
+        self._sink.close()
+
+
+# доступные форматы отчета
+REPORT_WRITERS = {writer.extension: writer for writer in (
+    CsvReportWriter, GzipCsvReportWriter, ZstdCsvReportWriter, ParquetReportWriter, FeatherReportWriter)}
+REPORT_FORMATS = tuple(REPORT_WRITERS)
+
+
+def get_writer_class(fmt: str) -> type[ReportWriter]:
+    try:
+        return REPORT_WRITERS[fmt]
+    except KeyError:
+        raise ValueError(f'Неизвестный формат отчета: {fmt}, доступны: {REPORT_FORMATS}')
+
+
+def save_report(df: 'pd.DataFrame', seller_id: str, fmt: str = 'csv', path: Path = None) -> bool:
+    """
+    Сохранение дата-фрейма целиком в отчет выбранного формата (path - заранее выбранный путь отчета)
+    """
+    try:
+        writer_class = get_writer_class(fmt)
+        if path is None:
+            path = get_report_path(seller_id, writer_class.extension)
+        with writer_class(path) as writer:
+            writer.write_frame(df)
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении отчета: {e}")
+        return False